@@ -1,3 +1,4 @@
+import time
 import pyglet
 from engine.service import ServiceManager
 
@@ -53,5 +54,62 @@ class Application(object):
         """
         self.setup()
         self.mgr.send_broadcast('on_init', self.mgr)
-        pyglet.app.run()
-        self.teardown()
\ No newline at end of file
+        try:
+            pyglet.app.run()
+        finally:
+            self.teardown()
+
+
+class HeadlessApplication(object):
+    """
+    An Application without a window, e.g. for dedicated servers. The
+    services are ticked at a fixed 'tick_rate' by a simple loop, which
+    sleeps in between, until 'stop' is called.
+    """
+
+    tick_rate = 60.
+
+    def __init__(self):
+        self.mgr = ServiceManager()
+        self.running = False
+
+    def setup(self):
+        """
+        Interface to set up the Application.
+        """
+        pass
+
+    def teardown(self):
+        """
+        Interface to tear down the Application.
+        """
+        pass
+
+    def run(self):
+        """
+        Set up the Application and run the tick loop.
+        """
+        self.setup()
+        self.mgr.send_broadcast('on_init', self.mgr)
+        self.running = True
+        try:
+            self.loop()
+        finally:
+            self.teardown()
+
+    def loop(self):
+        """
+        The tick loop, ticking the services in real time.
+        """
+        interval = 1. / self.tick_rate
+        last = time.time()
+        while self.running:
+            now = time.time()
+            self.mgr.send_broadcast('on_tick', now - last)
+            last = now
+            delay = last + interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self):
+        self.running = False
\ No newline at end of file
@@ -21,26 +21,93 @@ class Property(object):
             setter(value)
 
 
+class EntityMetadata(object):
+    """
+    Per-class initialization data of an Entity subclass, computed only
+    once: the defaults defined in the Entity subclass, which are passed
+    to the models along with the arguments of each instance, and the
+    table of properties provided by the models.
+    """
+
+    def __init__(self, entity_class):
+        # collect the defaults (defined in the Entity subclass)
+        defaults = {}
+        for argname in dir(entity_class):
+            if not argname.startswith("__") and argname != '_metadata':
+                defaults[argname] = getattr(entity_class, argname)
+
+        self.models = list(entity_class.models)
+        self.defaults = defaults
+        self.getters = None
+        self.setters = None
+        self.static_properties = True
+
+    def build_property_table(self, models):
+        """
+        Build the property table from the models of the first instance.
+        Getters and setters are stored as (model class, function) tuples.
+        If a model returns handlers that are not its own methods, the
+        properties need to be registered for every instance.
+        """
+        getters = {}
+        setters = {}
+        for cls in self.models:
+            model = models[cls]
+            for prop in model.properties():
+                name, getter, setter = prop[:3]
+                override = prop[3] if len(prop) > 3 else False
+                for handler in (getter, setter):
+                    if (handler is not None
+                        and getattr(handler, '__self__', None) is not model):
+                        self.static_properties = False
+                        return
+                if getter is not None and (override or name not in getters):
+                    getters[name] = (cls, getter.__func__)
+                if setter is not None:
+                    setters.setdefault(name, []).append((cls,
+                                                         setter.__func__))
+        self.getters = getters
+        self.setters = setters
+
+
 class Entity(object):
     models = []
 
     def __init__(self, *args, **kwargs):
+        metadata = self._get_metadata()
+
         # set up initial arguments (defined in the Entity subclass)
-        initargs = {}
-        for argname in dir(self.__class__):
-            if not argname.startswith("__"):
-                initargs[argname] = getattr(self.__class__, argname)
-        initargs.update(kwargs)
+        if kwargs:
+            initargs = dict(metadata.defaults)
+            initargs.update(kwargs)
+        else:
+            initargs = metadata.defaults
 
         models = {}
         self.properties = {}
-        for cls in self.models:
-            model = cls(self, *args, **initargs)
-            for prop in model.properties():
-                self.register_property(*prop)
-            models[cls] = model
+        for cls in metadata.models:
+            models[cls] = cls(self, *args, **initargs)
         self.models = models
 
+        if metadata.getters is None and metadata.static_properties:
+            metadata.build_property_table(models)
+
+        if not metadata.static_properties:
+            for model in models.itervalues():
+                for prop in model.properties():
+                    self.register_property(*prop)
+
+    @classmethod
+    def _get_metadata(cls):
+        """
+        Return the cached metadata of the class, create it on first use.
+        """
+        try:
+            return cls.__dict__['_metadata']
+        except KeyError:
+            cls._metadata = EntityMetadata(cls)
+            return cls._metadata
+
     #####################
     #   MODELS          #
     #####################
@@ -68,22 +135,50 @@ class Entity(object):
         Get the propery by name. Dispatches the 'get'
         handler of the registered property.
         """
-        return self.properties[name][0]()
+        if name in self.properties:
+            return self.properties[name][0]()
+        cls, getter = self._metadata.getters[name]
+        return getter(self.models[cls])
 
     def __setitem__(self, name, value):
         """
+        Set the property by name. Dispatches all 'set'
+        handlers of the registered property.
         """
-        for handler in self.properties[name][1]:
-            handler(value)
+        if name in self.properties:
+            for handler in self.properties[name][1]:
+                handler(value)
+        else:
+            for cls, setter in self._metadata.setters[name]:
+                setter(self.models[cls], value)
+
+    def _bind_property(self, name):
+        """
+        Private method to copy a property of the class
+        property table to the properties of this instance,
+        so that it can be extended.
+        """
+        metadata = self._metadata
+        if (name in self.properties or metadata.getters is None
+            or (name not in metadata.getters and name not in metadata.setters)):
+            return
+        getter = None
+        if name in metadata.getters:
+            cls, func = metadata.getters[name]
+            getter = func.__get__(self.models[cls])
+        setters = [func.__get__(self.models[cls])
+                   for cls, func in metadata.setters.get(name, ())]
+        self.properties[name] = [getter, setters]
 
     def _register_property_getter(self, name, handler, override=False):
         """
         Private method to register a property getter
         function for a specific property.
         """
+        self._bind_property(name)
         if name not in self.properties:
             self.properties[name] = [handler, []]
-        elif override:
+        elif override or self.properties[name][0] is None:
             self.properties[name][0] = handler
 
     def _register_property_setter(self, name, handler):
@@ -91,6 +186,7 @@ class Entity(object):
         Private method to register a property setter
         function for a specific property.
         """
+        self._bind_property(name)
         if name not in self.properties:
             self.properties[name] = [None, [handler]]
         else:
@@ -170,9 +266,8 @@ class ImageModel(AbstractModel):
     scale = 1.                  # the size-scale of the object
     group_index = 1             # the display group index
 
-    def __init__(self, image_path=None, animation_path=None, scale=1.,
-                 *args, **kwargs):
-        super(ImageModel, self).__init__(*args, **kwargs)
+    def __init__(self, entity, *args, **kwargs):
+        super(ImageModel, self).__init__(entity, *args, **kwargs)
 
         self.image_path = kwargs.get('image_path', self.image_path)
         self.animation_path = kwargs.get('animation_path', self.animation_path)
@@ -180,16 +275,29 @@ class ImageModel(AbstractModel):
         self.group_index = kwargs.get('group_index', self.group_index)
         self.position = kwargs.get('position', (0, 0))
         self.angle = math.degrees(kwargs.get('angle', 0))
-
-    def _set_scale(self, value): self.sprite.scale = value
+        self.sprite = None
+
+    def _get_scale(self): return self.scale
+    def _set_scale(self, value):
+        self.scale = value
+        if self.sprite is not None:
+            self.sprite.scale = value
+
+    def _get_position(self): return self.position
+    def _set_position(self, value):
+        self.position = value
+        if self.sprite is not None:
+            self.sprite.position = value
+
+    def _get_angle(self): return math.radians(self.angle)
+    def _set_angle(self, value):
+        self.angle = math.degrees(value)
+        if self.sprite is not None:
+            self.sprite.rotation = -self.angle
 
     def properties(self):
-        return super(ImageModel, self).properties + [
+        return super(ImageModel, self).properties() + [
             ('scale', self._get_scale, self._set_scale),
             ('position', self._get_position, self._set_position),
             ('angle', self._get_angle, self._set_angle),
-            #('image_path', , )
         ]
-
-
-
@@ -0,0 +1,160 @@
+def subscribe(event, types=None, components=None):
+    """
+    Decorator to mark a service method as a subscriber of an event on
+    the EventBus. The method is called with a list of all matching
+    objects of a batch. Interest can be restricted to instances of
+    certain classes ('types') and/or to objects having all of the
+    given attributes ('components').
+    """
+    def decorator(func):
+        if not hasattr(func, 'subscriptions'):
+            func.subscriptions = []
+        func.subscriptions.append((event, types, components))
+        return func
+    return decorator
+
+
+class Subscription(object):
+    """
+    Helper class for a single registered event handler.
+    """
+    def __init__(self, handler, types=None, components=None, priority=0):
+        self.handler = handler
+        self.types = tuple(types) if types is not None else None
+        self.components = tuple(components) if components is not None else ()
+        self.priority = priority
+
+    def matches(self, obj):
+        """
+        Check whether or not the subscription is interested in the
+        given object.
+        """
+        if self.types is not None and not isinstance(obj, self.types):
+            return False
+        for component in self.components:
+            if not hasattr(obj, component):
+                return False
+        return True
+
+
+class EventBus(object):
+    """
+    The EventBus collects published events and delivers them in batches
+    to the subscribers that registered interest in the type or the
+    components of the subject object.
+    Routes are cached per event and object class, so objects of one class
+    are assumed to share the same set of components.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty EventBus.
+        """
+        self.subscriptions = {}
+        self.pending = []
+        self.routes = {}
+
+    def subscribe(self, event, handler, types=None, components=None,
+                  priority=0):
+        """
+        Register a handler for an event. The handler is called with a
+        list of objects of all pending events it is interested in.
+        Lower priorities mean earlier receit.
+        """
+        subscriptions = self.subscriptions.setdefault(event, [])
+        subscriptions.append(Subscription(handler, types, components,
+                                          priority))
+        subscriptions.sort(key=lambda subscription: subscription.priority)
+        self._invalidate(event)
+
+    def unsubscribe(self, event, handler):
+        """
+        Remove all subscriptions of a handler for an event.
+        """
+        self.subscriptions[event] = [subscription for subscription
+                                     in self.subscriptions.get(event, [])
+                                     if subscription.handler != handler]
+        self._invalidate(event)
+
+    def subscribe_service(self, service):
+        """
+        Register all methods of a service that were marked with the
+        'subscribe' decorator, using the priority of the service.
+        """
+        for name in dir(service.__class__):
+            func = getattr(service.__class__, name)
+            for event, types, components in getattr(func, 'subscriptions',
+                                                    ()):
+                self.subscribe(event, getattr(service, name), types,
+                               components, service.priority)
+
+    def publish(self, event, obj):
+        """
+        Queue an event for the given object. It is delivered with the
+        next call to 'flush'.
+        """
+        self.pending.append((event, obj))
+
+    def retract(self, event, obj):
+        """
+        Remove a pending event that was not delivered yet. Returns True
+        if the event was pending.
+        """
+        try:
+            self.pending.remove((event, obj))
+            return True
+        except ValueError:
+            return False
+
+    def flush(self):
+        """
+        Deliver all pending events. Consecutive events of the same kind
+        are delivered in one batch per subscriber. Events published
+        while flushing are delivered in the same call.
+        """
+        while self.pending:
+            pending, self.pending = self.pending, []
+            start = 0
+            while start < len(pending):
+                event = pending[start][0]
+                end = start + 1
+                while end < len(pending) and pending[end][0] == event:
+                    end += 1
+                self._deliver(event, [obj for _, obj in pending[start:end]])
+                start = end
+
+    def _deliver(self, event, objects):
+        """
+        Private method to sort a batch of objects by interested
+        subscribers and to call the handlers.
+        """
+        batches = {}
+        for obj in objects:
+            for subscription in self._route(event, obj):
+                batches.setdefault(subscription, []).append(obj)
+
+        for subscription in self.subscriptions.get(event, ()):
+            if subscription in batches:
+                subscription.handler(batches[subscription])
+
+    def _route(self, event, obj):
+        """
+        Private method to get the subscriptions that are interested in
+        an object. The result is cached for the class of the object.
+        """
+        key = (event, obj.__class__)
+        try:
+            return self.routes[key]
+        except KeyError:
+            route = tuple(subscription for subscription
+                          in self.subscriptions.get(event, ())
+                          if subscription.matches(obj))
+            self.routes[key] = route
+            return route
+
+    def _invalidate(self, event):
+        """
+        Private method to clear the cached routes of an event.
+        """
+        for key in [key for key in self.routes if key[0] == event]:
+            del self.routes[key]
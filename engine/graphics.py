@@ -1,89 +1,174 @@
 import math
+import numpy
 import pyglet.gl
 import pyglet.graphics
-from engine.entity import AbstractModel
-
-class GraphicalModel(AbstractModel):
-    image_path = None           # path to the static image.
-    animation_path = None       # path to the animation image
-    animation_tiling = (1, 1)   # the tiling of the animation image
-    animation_duration = 1.     # the overall duration of the animation
-    scale = 1.                  # the size-scale of the object
-    group_index = 1             # the display group index
-
-    def __init__(self, *args, **kwargs):
-        super(GraphicalModel, self).__init__(*args, **kwargs)
-        
-        self.image_path = kwargs.get('image_path', self.image_path)
-        self.animation_path = kwargs.get('animation_path', self.animation_path)
-        self.scale = kwargs.get('scale', self.scale)
-        self.group_index = kwargs.get('group_index', self.group_index)
-        self.position = kwargs.get('position', (0, 0))
-        self.angle = math.degrees(kwargs.get('angle', 0))
-        
-        self._create_sprite()
-    
-    def _create_sprite(self):
-        pass
-    
-    def _set_scale(self, value): self.sprite.scale = value
-    
-    def _get_position(self): return self.sprite.position
-    def _set_position(self, value): self.sprite.position = value
-    
-    properties = {
-        'scale': (None, _set_scale),
-        'position': (_get_position, _set_position),
-    }
-
-#def create_sprite(model, 
-
-def draw_line_loop(points, color = None):
+
+class Camera(object):
+    """
+    The view of a window onto the game world. 'position' is the world
+    position shown in the lower left corner of the window. In a world
+    that wraps around at its 'world_size', the view continues across the
+    edges of the world.
+    """
+
+    def __init__(self, size, position=(0, 0), world_size=None):
+        self.size = size
+        self.position = position
+        self.world_size = world_size
+
+    def look_at(self, position):
+        """
+        Center the view on a world position.
+        """
+        self.position = (position[0] - self.size[0] / 2.,
+                         position[1] - self.size[1] / 2.)
+
+    def get_rect(self, margin=0.):
+        """
+        Return the visible world rectangle (left, bottom, right, top),
+        extended by the margin on all sides.
+        """
+        x, y = self.position
+        return (x - margin, y - margin,
+                x + self.size[0] + margin, y + self.size[1] + margin)
+
+    def get_rects(self, margin=0.):
+        """
+        Return the visible world rectangles, extended by the margin. In a
+        wrapped world, the view is split at the edges of the world into
+        up to four rectangles within it.
+        """
+        rect = self.get_rect(margin)
+        if self.world_size is None:
+            return [rect]
+        columns = _wrap_range(rect[0], rect[2], self.world_size[0])
+        rows = _wrap_range(rect[1], rect[3], self.world_size[1])
+        return [(left, bottom, right, top)
+                for left, right in columns for bottom, top in rows]
+
+    def place(self, position):
+        """
+        Return the copy of a world position that is nearest to the center
+        of the view, where it is drawn in a wrapped world.
+        """
+        if self.world_size is None:
+            return position
+        width, height = self.world_size
+        x = position[0] + width * round((self.position[0] + self.size[0] / 2.
+                                         - position[0]) / width)
+        y = position[1] + height * round((self.position[1] + self.size[1] / 2.
+                                          - position[1]) / height)
+        return x, y
+
+    def apply(self):
+        pyglet.gl.glPushMatrix()
+        pyglet.gl.glTranslatef(-self.position[0], -self.position[1], 0.)
+
+    def restore(self):
+        pyglet.gl.glPopMatrix()
+
+
+def _wrap_range(start, end, size):
     """
-    helper function to draw a specific line loop, specified by a list 
-    of points (iterable of Vec2ds) in a specified color (not implemented).
+    Helper function to split the range from start to end into ranges
+    within [0, size), as seen in a world wrapping around at size.
     """
-    if color is not None:
-        if len(color) == 3: pyglet.gl.glColor3f(*color)
-        if len(color) == 4: pyglet.gl.glColor4f(*color)
-    
-    verts = []
-    for point in points:
-        verts.extend(point)
-    
-    pyglet.graphics.draw(len(verts)/2, pyglet.gl.GL_LINE_LOOP,
-        ('v2f', verts)
-    )
-
-def draw_line(start, end, color = None):
-    if color is not None:
-        if len(color) == 3: pyglet.gl.glColor3f(*color)
-        if len(color) == 4: pyglet.gl.glColor4f(*color)
-    
-    verts = [start[0], start[1], end[0], end[1]]
-    pyglet.graphics.draw(2, pyglet.gl.GL_LINE_LOOP,
-        ('v2f', verts)
-    )
-
-_circlepoints = []
-for i in range(100):
-    angle = i * 2 * math.pi / 100
-    _circlepoints.append(math.cos(angle))
-    _circlepoints.append(math.sin(angle))
-circle_list = pyglet.graphics.vertex_list(len(_circlepoints)/2,
-                                          ('v2f', _circlepoints))
-
-def draw_circle(position, radius, color = None):
+    if end - start >= size:
+        return [(0., size)]
+    length = end - start
+    start %= size
+    if start + length <= size:
+        return [(start, start + length)]
+    return [(start, size), (0., start + length - size)]
+
+
+class CameraGroup(pyglet.graphics.OrderedGroup):
     """
-    helper function to draw a circle at a given position (Vec2d) with a 
-    given radius in a specified color.
+    Group drawing its children in world coordinates, as seen through
+    the camera.
     """
-    if color is not None:
-        if len(color) == 3: pyglet.gl.glColor3f(*color)
-        if len(color) == 4: pyglet.gl.glColor4f(*color)
-    
-    pyglet.gl.glPushMatrix()
-    pyglet.gl.glTranslatef(position[0], position[1], 0.)
-    pyglet.gl.glScalef(radius, radius, 0)
-    circle_list.draw(pyglet.gl.GL_LINE_LOOP)
-    pyglet.gl.glPopMatrix()
\ No newline at end of file
+
+    def __init__(self, camera, order=0, parent=None):
+        super(CameraGroup, self).__init__(order, parent)
+        self.camera = camera
+
+    def set_state(self):
+        self.camera.apply()
+
+    def unset_state(self):
+        self.camera.restore()
+
+
+class DebugDraw(object):
+    """
+    Collector for debug lines and circles. All primitives are stored as
+    line segments in one vertex array per color, so a frame of debug
+    drawing costs a single draw call per color instead of one per shape.
+    The primitives are collected during 'on_draw' and drawn (and
+    cleared) with 'draw'.
+    """
+
+    circle_segments = 24
+
+    def __init__(self):
+        self.segments = {}
+        angles = numpy.linspace(0., 2 * math.pi, self.circle_segments + 1)
+        ring = numpy.column_stack((numpy.cos(angles), numpy.sin(angles)))
+        # the segments of the unit circle as rows of (x0, y0, x1, y1)
+        self.unit_circle = numpy.hstack((ring[:-1], ring[1:]))
+
+    def _add(self, segments, color):
+        color = tuple(color)
+        if len(color) == 3:
+            color += (1.,)
+        self.segments.setdefault(color, []).append(segments)
+
+    def line(self, start, end, color):
+        self._add(numpy.array([[start[0], start[1], end[0], end[1]]]), color)
+
+    def line_loop(self, points, color):
+        """
+        Add a closed line through the points (iterable of Vec2ds).
+        """
+        points = numpy.array([(point[0], point[1]) for point in points])
+        self._add(numpy.hstack((points, numpy.roll(points, -1, axis=0))),
+                  color)
+
+    def circle(self, position, radius, color):
+        self.circles([(position[0], position[1])], [radius], color)
+
+    def circles(self, positions, radii, color):
+        """
+        Add a circle for each position and radius, computed at once for
+        all of them.
+        """
+        if not len(positions):
+            return
+        positions = numpy.tile(numpy.asarray(positions, dtype=float), 2)
+        radii = numpy.asarray(radii, dtype=float)
+        segments = (positions[:, numpy.newaxis, :]
+                    + radii[:, numpy.newaxis, numpy.newaxis]
+                    * self.unit_circle[numpy.newaxis, :, :])
+        self._add(segments.reshape(-1, 4), color)
+
+    def clear(self):
+        self.segments.clear()
+
+    def draw(self):
+        """
+        Draws all collected primitives and clears the collector.
+        """
+        if not self.segments:
+            return
+
+        gl = pyglet.gl
+        gl.glPushClientAttrib(gl.GL_CLIENT_VERTEX_ARRAY_BIT)
+        gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+        for color, parts in self.segments.iteritems():
+            vertices = numpy.ascontiguousarray(numpy.concatenate(parts),
+                                               dtype=numpy.float32)
+            gl.glColor4f(*color)
+            gl.glVertexPointer(2, gl.GL_FLOAT, 0, vertices.ctypes.data)
+            gl.glDrawArrays(gl.GL_LINES, 0, len(vertices) * 2)
+        gl.glPopClientAttrib()
+        self.clear()
@@ -2,11 +2,213 @@ from engine.service import (
     AbstractService, GraphicsService,
     ServiceManager
 )
+import inspect
+import json
+import marshal
+import os
+import os.path
+import re
+import xml.etree.cElementTree as xml
 import pyglet
 import kytten
 
+# themes by (path, override), see get_theme
+_themes = {}
+
+# GuiBuilders by path, see load_gui
+_builders = {}
+
+# format of the compiled GUI files written next to the XML files
+COMPILED_SUFFIX = 'c'
+COMPILED_VERSION = 1
+
+# keyword argument taking the text of an element, if not 'text'
+TEXT_ARGUMENTS = {
+    'Document': 'document',
+    'FoldingSection': 'title',
+    'SectionHeader': 'title',
+    'TitleFrame': 'title',
+}
+
+# keyword argument taking the child elements, if not 'content'
+CONTENT_ARGUMENTS = {
+    'Dropdown': 'options',
+    'Menu': 'options',
+    'VirtualMenu': 'options',
+}
+
+# elements taking a list of children instead of a single one
+LIST_CONTENT = set(['Dropdown', 'GridLayout', 'HorizontalLayout', 'Menu',
+                    'VerticalLayout', 'VirtualMenu'])
+
+# keyword argument an element's callback is bound to by its id
+CALLBACK_ARGUMENTS = {
+    'Button': 'on_click',
+    'Checkbox': 'on_click',
+    'Dropdown': 'on_select',
+    'Input': 'on_input',
+    'Menu': 'on_select',
+    'Slider': 'on_set',
+    'VirtualMenu': 'on_select',
+}
+
+_constant = re.compile(r'^[A-Z][A-Z0-9_]*$')
+
+
+def get_theme(path, override=None):
+    """
+    Return the kytten theme at 'path' with the entries of 'override'.
+    Themes are cached: the theme file is parsed and its textures are
+    loaded once per path, and each distinct override is applied once on
+    top of that theme, sharing its textures.
+    """
+    base = _themes.get((path, None))
+    if base is None:
+        base = _themes[(path, None)] = kytten.Theme(path)
+    if not override:
+        return base
+    key = (path, json.dumps(override, sort_keys=True))
+    theme = _themes.get(key)
+    if theme is None:
+        theme = _themes[key] = kytten.Theme(base, override=override)
+    return theme
+
+
+def _parse_value(value):
+    """
+    Convert an XML attribute value to a boolean, number or kytten
+    constant (e.g. "ANCHOR_CENTER"), or leave it a string.
+    """
+    if value in ('true', 'false'):
+        return value == 'true'
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    if _constant.match(value) and hasattr(kytten, value):
+        return getattr(kytten, value)
+    return value
+
+
+def _compile_element(element):
+    """
+    Return the element as a tuple of (tag, attributes, text, children),
+    which marshal can store.
+    """
+    attributes = dict((name, _parse_value(value))
+                      for name, value in element.attrib.iteritems())
+    text = element.text.strip() if element.text else None
+    return (element.tag, attributes, text or None,
+            tuple(_compile_element(child) for child in element))
+
+
+class GuiBuilder(object):
+    """
+    A GUI definition compiled from an XML file. Every element is a
+    kytten widget of the same name, its attributes are the keyword
+    arguments, its text is the text (or title) and its child elements
+    are the content. The rows of a GridLayout are 'Row' elements, the
+    options of a Menu or Dropdown are 'Option' elements:
+
+        <Dialog anchor="ANCHOR_CENTER" on_escape="close">
+            <TitleFrame title="Main Menu">
+                <VerticalLayout align="HALIGN_LEFT">
+                    <Button id="start">Start</Button>
+                    <Button id="quit">Quit</Button>
+                </VerticalLayout>
+            </TitleFrame>
+        </Dialog>
+
+    Callbacks are bound by id: the callback for an element's id is
+    passed as its on_click (Button), on_select (Menu) etc. Attributes
+    starting with 'on_' name a callback explicitly.
+    """
+
+    def __init__(self, tree, mtime=None):
+        self.tree = tree
+        self.mtime = mtime
+
+    def build(self, callbacks=None, **kwargs):
+        """
+        Create the widgets, binding the callbacks of the dict
+        'callbacks'. The keyword arguments are passed to the root widget,
+        e.g. the window, batch, group and theme of a Dialog.
+        """
+        return self._build(self.tree, callbacks or {}, kwargs)
+
+    def _build(self, node, callbacks, kwargs=None):
+        tag, attributes, text, children = node
+        if tag == 'Row':
+            return [self._build(child, callbacks) for child in children]
+        if tag == 'Option':
+            return text or ''
+
+        cls = getattr(kytten, tag)
+        arguments = dict(attributes)
+        for name, value in attributes.iteritems():
+            if name.startswith('on_'):
+                arguments[name] = callbacks[value]
+        id = attributes.get('id')
+        callback = CALLBACK_ARGUMENTS.get(tag)
+        if id in callbacks and callback is not None:
+            arguments.setdefault(callback, callbacks[id])
+        if 'id' in arguments and \
+           'id' not in inspect.getargspec(cls.__init__).args:
+            del arguments['id']
+
+        if text is not None:
+            arguments[TEXT_ARGUMENTS.get(tag, 'text')] = text
+        if children:
+            content = [self._build(child, callbacks) for child in children]
+            if tag not in LIST_CONTENT:
+                content, = content
+            arguments[CONTENT_ARGUMENTS.get(tag, 'content')] = content
+        if kwargs:
+            arguments.update(kwargs)
+        return cls(**arguments)
+
+
+def load_gui(path):
+    """
+    Return the GuiBuilder for the XML file at 'path'. The compiled file is
+    kept in memory and written next to the XML file, so the XML is only
+    parsed again when it was modified.
+    """
+    mtime = os.path.getmtime(path)
+    builder = _builders.get(path)
+    if builder is not None and builder.mtime == mtime:
+        return builder
+
+    compiled_path = path + COMPILED_SUFFIX
+    tree = None
+    try:
+        with open(compiled_path, 'rb') as compiled:
+            version, compiled_mtime, compiled_tree = marshal.load(compiled)
+        if version == COMPILED_VERSION and compiled_mtime == mtime:
+            tree = compiled_tree
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+
+    if tree is None:
+        tree = _compile_element(xml.parse(path).getroot())
+        try:
+            with open(compiled_path, 'wb') as compiled:
+                marshal.dump((COMPILED_VERSION, mtime, tree), compiled)
+        except IOError:
+            pass # read-only, compile again next time
+
+    builder = _builders[path] = GuiBuilder(tree, mtime)
+    return builder
+
+
 class GuiService(AbstractService):
-    """ Service to manage GUI screens """
+    """
+    Service to manage GUI screens. A screen is built the first time it
+    is shown and kept afterwards: hiding it only stops drawing its
+    dialog. Screens whose content changed are rebuilt with
+    'rebuild_gui'.
+    """
 
     def __init__(self, window, group_index = 1):
         self.guis = {}
@@ -25,6 +227,9 @@ class GuiService(AbstractService):
     
     def hide_gui(self, name):
         self.guis[name].hide()
+
+    def rebuild_gui(self, name):
+        self.guis[name].rebuild()
         
     def on_draw(self):
         self.batch.draw()
@@ -33,14 +238,14 @@ class AbstractGui(object):
     def __init__(self, name):
         self.name = name
         self.root = None
-        import os.path
         pth = os.path.abspath(os.path.join('graphics', 'theme'))
-        self.theme = kytten.Theme(pth,
+        self.theme = get_theme(pth,
             override={
             "gui_color": [64, 128, 255, 255],
             "font_size": 14
         })
         self.visible = False
+        self.window = self.batch = self.group = None
         
     def _build_gui(self, window, batch, group):
         return kytten.Dialog(
@@ -53,11 +258,44 @@ class AbstractGui(object):
     
     def show(self, window, batch, group):
         if not self.visible:
-            self.root = self._build_gui(window, batch, group)
+            if self.root is None:
+                self.window, self.batch, self.group = window, batch, group
+                self.root = self._build_gui(window, batch, group)
+            else:
+                self.root.set_visible(True)
             self.visible = True
-        
+
     def hide(self):
         if self.visible:
-            self.root.teardown()
+            self.root.set_visible(False)
             self.visible = False
-            self.root = None
\ No newline at end of file
+
+    def rebuild(self):
+        """
+        Discard the built dialog, e.g. because the content of the screen
+        changed. A visible screen is built again right away, a hidden one
+        the next time it is shown.
+        """
+        if self.root is None:
+            return
+        self.root.teardown()
+        self.root = None
+        if self.visible:
+            self.root = self._build_gui(self.window, self.batch, self.group)
+
+
+class XmlGui(AbstractGui):
+    """
+    A GUI screen defined in an XML file, see GuiBuilder. The root element
+    is the Dialog, which gets the window, batch, group and theme.
+    """
+
+    def __init__(self, name, path, callbacks=None):
+        AbstractGui.__init__(self, name)
+        self.path = path
+        self.callbacks = callbacks or {}
+
+    def _build_gui(self, window, batch, group):
+        return load_gui(self.path).build(self.callbacks, window=window,
+                                         batch=batch, group=group,
+                                         theme=self.theme)
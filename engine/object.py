@@ -2,15 +2,38 @@ import pyglet
 import pymunk
 import math
 import engine.resource
+from engine.serialization import (OBJECT_SCHEMA, PHYSICAL_OBJECT_SCHEMA,
+                                  BODY_STATE_FIELDS, Schema)
+
+def create_object(cls, args, kwargs):
+    """
+    Helper function to recreate a pickled GameObject.
+    """
+    return cls(*args, **kwargs)
 
 class GameObject(object):
     """
     Common base class for all game objects in the game.
+    In the snapshots of the ServiceManager, game objects are stored by
+    their class, the 'snapshot_arguments' they are created with and
+    their state (see '__getstate__'), packed with the snapshot schema of
+    the class. Elsewhere they are pickled as their class, the arguments
+    they were created with and their state.
     """
     
+    schema = None               # binary layout of the serialized state
+    snapshot_fields = ()        # (name, codec) of attributes changing
+                                # after creation
+    snapshot_arguments = ()     # attributes passed to the constructor
+                                # when restoring an object
+    state_fields = ()           # (name, codec) of the state kept apart
+                                # from the attributes, e.g. in the body
+    
     def __init__(self, *args, **kwargs):
-        if not hasattr(self, 'properties'):
+        if 'properties' not in self.__dict__:
             self.properties = {}
+        self.init_args = args
+        self.init_kwargs = kwargs
     
     def _register_property_getter(self, name, handler):
         if name not in self.properties:
@@ -47,6 +70,88 @@ class GameObject(object):
         except AttributeError:
             return self.__dict__['properties'][name][0][0]()
     
+    def __reduce__(self):
+        return (create_object, (self.__class__, self.init_args,
+                                self.init_kwargs), self.__getstate__())
+    
+    def __getstate__(self):
+        """
+        Return the state of the object: a tuple of the values of its
+        'snapshot_fields', followed by the values of its 'state_fields'.
+        """
+        values = self.__dict__
+        return tuple([values[name] for name, _ in self.snapshot_fields])
+    
+    def __setstate__(self, state):
+        self.__dict__.update(zip([name for name, _ in self.snapshot_fields],
+                                 state))
+    
+    @classmethod
+    def get_snapshot_schema(cls):
+        """
+        Return the schema of the state of the objects of the class (see
+        '__getstate__'). It is created once per class.
+        """
+        schema = cls.__dict__.get('_snapshot_schema')
+        if schema is None:
+            schema = Schema(list(cls.snapshot_fields) + list(cls.state_fields))
+            cls._snapshot_schema = schema
+        return schema
+    
+    def get_snapshot_arguments(self):
+        """
+        Return the values of the 'snapshot_arguments'. Objects with the
+        same class and arguments can take the state of each other.
+        """
+        values = self.__dict__
+        return tuple([values[name] for name in self.snapshot_arguments])
+    
+    @classmethod
+    def create_many(cls, count, kwargs):
+        """
+        Create 'count' objects of the class with the same arguments, e.g.
+        when restoring a snapshot. Subclasses may create them in bulk.
+        """
+        return [cls(**kwargs) for _ in xrange(count)]
+    
+    @classmethod
+    def get_states(cls, objects):
+        """
+        Return the states (see '__getstate__') of objects of the class.
+        """
+        return [obj.__getstate__() for obj in objects]
+    
+    @classmethod
+    def set_states(cls, objects, states):
+        """
+        Set the states (see '__setstate__') of objects of the class.
+        """
+        for obj, state in zip(objects, states):
+            obj.__setstate__(state)
+    
+    def get_serial_state(self):
+        """
+        Return the values of the serialized state, in the order of
+        the fields of the schema.
+        """
+        raise NotImplementedError
+    
+    def serialize(self):
+        """
+        Encode the state of the object with the schema of its class.
+        """
+        return self.schema.pack(self.get_serial_state())
+    
+    @classmethod
+    def deserialize(cls, buffer, offset=0):
+        """
+        Decode a state encoded with 'serialize' into a dict of field
+        names and values. Returns the dict and the offset after the
+        state. The buffer may be a memoryview.
+        """
+        values, offset = cls.schema.unpack_from(buffer, offset)
+        return dict(zip(cls.schema.names, values)), offset
+    
     def on_added(self):
         """
         Stub message handler for 'on_added' messages.
@@ -65,7 +170,10 @@ class GameObject(object):
         """
         pass
         
-    def debug_draw(self):
+    def debug_draw(self, debug):
+        """
+        Add debug primitives to the DebugDrawService 'debug'.
+        """
         pass
         
     def on_key_press(self, key, modifiers):
@@ -91,7 +199,10 @@ class GraphicalObject(GameObject):
     animation_duration = 1.     # the overall duration of the animation
     scale = 1.                  # the size-scale of the object
     group_index = 1             # the display group index
+    screen_space = False        # drawn in window coordinates (HUD)
     angle = 0                   # default angle
+    schema = OBJECT_SCHEMA
+    snapshot_arguments = ('position', 'scale')
     
     def __init__(self, *args, **kwargs):
         """
@@ -112,6 +223,11 @@ class GraphicalObject(GameObject):
     def _get_position(self): return self.sprite.position
     def _set_position(self, value): self.sprite.position = value
     
+    def get_serial_state(self):
+        position = self.sprite.position
+        return (self.id, position[0], position[1],
+                math.radians(self.angle))
+    
     def on_animation_end(self):
         """
         Default event handler for ending animations.
@@ -139,6 +255,9 @@ class PhysicalObject(GameObject):
     sensor = False              # sensor flag
     elasticity = 1.             # bouncing property
     friction = 1.               # friction property
+    schema = PHYSICAL_OBJECT_SCHEMA
+    snapshot_arguments = ('scale',)
+    state_fields = BODY_STATE_FIELDS
     
     def __init__(self, *args, **kwargs):
         """
@@ -147,45 +266,93 @@ class PhysicalObject(GameObject):
         GameObject.__init__(self, *args, **kwargs)
         
         self.scale = kwargs.get('scale', self.scale)
+        self._create_body(self._get_geometry(kwargs))
+        
+        # set up initial parameters
+        self.body.position = kwargs.get('position', (0, 0))
+        self.body.velocity = kwargs.get('velocity', (0, 0))
+        self.body.angle = kwargs.get('angle', 0)
+        
+        self.shape.group = kwargs.get('group', self.group)
+        self.shape.layers = kwargs.get('layers', self.layers)
+        self.shape.sensor = kwargs.get('sensor', self.sensor)
+        self.shape.elasticity = kwargs.get('elasticity', self.elasticity)
+        self.shape.friction = kwargs.get('friction', self.friction)
+        
+        self._register_property('position', self._get_position, self._set_position)
+        self._register_property('velocity', self._get_velocity, self._set_velocity)
+        self._register_property('angle', self._get_angle, self._set_angle)
+    
+    def _get_geometry(self, kwargs):
+        """
+        Private method to compute the mass, the moment and the radius or
+        the vertices of the body and shape of the object.
+        """
         mass = kwargs.get('mass', self.mass) * self.scale
         radius = kwargs.get('radius', self.radius)
         points = kwargs.get('points', self.points)
         
         if radius is not None:
             radius *= self.scale
-            moment = pymunk.moment_for_circle(mass, 0, radius)
-            self.body = pymunk.Body(mass, moment)
-            self.shape = pymunk.Circle(self.body, radius)
+            return mass, pymunk.moment_for_circle(mass, 0, radius), radius, None
         
         elif points is not None:
             vertices = map(pymunk.Vec2d, self.points)
             for vertex in vertices:
                 vertex *= self.scale
-            moment = pymunk.moment_for_poly(mass, vertices)
-            self.body = pymunk.Body(mass, moment)
-            self.shape = pymunk.Poly(self.body, vertices)
+            return mass, pymunk.moment_for_poly(mass, vertices), None, vertices
         else:
             raise Exception("Neither radius nor points are specified")
+    
+    def _create_body(self, geometry):
+        """
+        Private method to create the body and the shape of the object.
+        """
+        mass, moment, radius, vertices = geometry
+        self.body = pymunk.Body(mass, moment)
+        if radius is not None:
+            self.shape = pymunk.Circle(self.body, radius)
+        else:
+            self.shape = pymunk.Poly(self.body, vertices)
         
         self.body._bodycontents.v_limit = self.maximum_speed
         
         # set up hook to get from the body to the game object
         self.body.object = self
-        
-        # set up initial parameters
-        self.body.position = kwargs.get('position', (0, 0))
-        self.body.velocity = kwargs.get('velocity', (0, 0))
-        self.body.angle = kwargs.get('angle', 0)
-        
-        self.shape.group = kwargs.get('group', self.group)
-        self.shape.layers = kwargs.get('layers', self.layers)
-        self.shape.sensor = kwargs.get('sensor', self.sensor)
-        self.shape.elasticity = kwargs.get('elasticity', self.elasticity)
-        self.shape.friction = kwargs.get('friction', self.friction)
-        
-        self._register_property('position', self._get_position, self._set_position)
-        self._register_property('velocity', self._get_velocity, self._set_velocity)
-        self._register_property('angle', self._get_angle, self._set_angle)
+    
+    @classmethod
+    def create_many(cls, count, kwargs):
+        """
+        Create 'count' objects with the same arguments. Only the first
+        object runs the constructor, the others are copies of it with a
+        body and a shape of their own, which is a lot faster.
+        """
+        if not count:
+            return []
+        first = cls(**kwargs)
+        objects = [first]
+        template = first.__dict__
+        geometry = first._get_geometry(kwargs)
+        shape = first.shape
+        shape_values = (shape.group, shape.layers, shape.sensor,
+                        shape.elasticity, shape.friction)
+        properties = [(name, [method.__func__ for method in getters],
+                       [method.__func__ for method in setters])
+                      for name, (getters, setters)
+                      in template['properties'].iteritems()]
+        for _ in xrange(count - 1):
+            obj = cls.__new__(cls)
+            obj.__dict__.update(template)
+            obj.properties = dict(
+                (name, ([getter.__get__(obj, cls) for getter in getters],
+                        [setter.__get__(obj, cls) for setter in setters]))
+                for name, getters, setters in properties)
+            obj._create_body(geometry)
+            shape = obj.shape
+            (shape.group, shape.layers, shape.sensor, shape.elasticity,
+             shape.friction) = shape_values
+            objects.append(obj)
+        return objects
     
     """ Property getters/setters """
     def _get_position(self): return self.body.position
@@ -196,6 +363,73 @@ class PhysicalObject(GameObject):
     
     def _get_angle(self): return self.body.angle
     def _set_angle(self, value): self.body.angle = value
+    
+    def get_serial_state(self):
+        body = self.body
+        return (self.id, body.position[0], body.position[1],
+                body.velocity[0], body.velocity[1], body.angle)
+    
+    def __getstate__(self):
+        """
+        Return the state of the object, followed by the state of its
+        body.
+        """
+        body = self.body
+        position = body.position
+        velocity = body.velocity
+        state = (position.x, position.y, velocity.x, velocity.y,
+                 body.angle, body.angular_velocity)
+        if self.snapshot_fields:
+            return GameObject.__getstate__(self) + state
+        return state
+    
+    def __setstate__(self, state):
+        if self.snapshot_fields:
+            GameObject.__setstate__(self, state[:-6])
+        body = self.body
+        body.position = state[-6:-4]
+        body.velocity = state[-4:-2]
+        body.angle = state[-2]
+        body.angular_velocity = state[-1]
+    
+    @classmethod
+    def get_states(cls, objects):
+        """
+        Return the states of objects of the class, like '__getstate__'.
+        """
+        if cls.__getstate__.im_func is not PhysicalObject.__getstate__.im_func:
+            return GameObject.get_states.im_func(cls, objects)
+        states = []
+        append = states.append
+        for obj in objects:
+            body = obj.body
+            position = body.position
+            velocity = body.velocity
+            append((position.x, position.y, velocity.x, velocity.y,
+                    body.angle, body.angular_velocity))
+        if cls.snapshot_fields:
+            names = [name for name, _ in cls.snapshot_fields]
+            states = [tuple([obj.__dict__[name] for name in names]) + state
+                      for obj, state in zip(objects, states)]
+        return states
+    
+    @classmethod
+    def set_states(cls, objects, states):
+        """
+        Set the states of objects of the class, like '__setstate__'.
+        """
+        if cls.__setstate__.im_func is not PhysicalObject.__setstate__.im_func:
+            return GameObject.set_states.im_func(cls, objects, states)
+        if cls.snapshot_fields:
+            names = [name for name, _ in cls.snapshot_fields]
+            for obj, state in zip(objects, states):
+                obj.__dict__.update(zip(names, state))
+        for obj, state in zip(objects, states):
+            body = obj.body
+            body.position = state[-6:-4]
+            body.velocity = state[-4:-2]
+            body.angle = state[-2]
+            body.angular_velocity = state[-1]
         
     def on_collision(self, other, arbiter):
         """
@@ -210,6 +444,10 @@ class CombinedObject(GraphicalObject, PhysicalObject):
     Convenience class for combined graphical and physical objects.
     """
     
+    schema = PHYSICAL_OBJECT_SCHEMA
+    get_serial_state = PhysicalObject.get_serial_state
+    snapshot_arguments = PhysicalObject.snapshot_arguments
+    
     def __init__(self, *args, **kwargs):
         """
         Convenience CTOR to initialize both Graphical and Physical part
@@ -0,0 +1,314 @@
+"""
+Particle effects like smoke trails, flames and explosions. The
+particles of a ParticleSystem share one texture (an animation image)
+and are stored in contiguous numpy arrays, which are updated at once
+every tick and drawn with a single vertex list in the batch of the
+GraphicsService.
+
+Game objects emit particles continuously by declaring
+'particle_emitters', a ParticleEffect emits a single burst when it is
+added to the game.
+"""
+import ctypes
+import math
+import numpy
+import pyglet
+import engine.resource
+from engine.service import AbstractService, GraphicsService
+from engine.object import GameObject
+from engine.event import subscribe
+
+
+class ParticleSystem(object):
+    """
+    The particles of one texture. Each particle has a position, a
+    velocity, an age, a scale and the frame of the animation it shows,
+    which advances over the lifetime of the particle.
+    """
+
+    def __init__(self, animation_path, animation_tiling=(1, 1),
+                 lifetime=1., group_index=0, fade=False, capacity=256):
+        """
+        Initializes an empty system with space for 'capacity' particles.
+        The storage grows automatically. With 'fade', the particles fade
+        out over their lifetime.
+        """
+        self.animation_path = animation_path
+        self.animation_tiling = animation_tiling
+        self.lifetime = float(lifetime)
+        self.group_index = group_index
+        self.fade = fade
+        self.frames = animation_tiling[0] * animation_tiling[1]
+
+        self.count = 0
+        self.position = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.age = numpy.zeros(capacity)
+        self.scale = numpy.zeros(capacity)
+        self.frame = numpy.zeros(capacity, dtype=int)
+
+        self.batch = None
+        self.vertex_list = None
+
+    def emit(self, positions, velocities, scales):
+        """
+        Add particles, given as arrays of their positions, velocities
+        and scales.
+        """
+        count = len(positions)
+        while self.count + count > len(self.age):
+            self._grow()
+        new = slice(self.count, self.count + count)
+        self.position[new] = positions
+        self.velocity[new] = velocities
+        self.scale[new] = scales
+        self.age[new] = 0.
+        self.frame[new] = 0
+        self.count += count
+
+    def update(self, dt):
+        """
+        Age and move all particles and remove the expired ones.
+        """
+        count = self.count
+        if not count:
+            return
+
+        self.age[:count] += dt
+        alive = self.age[:count] < self.lifetime
+        if not alive.all():
+            # keep the particles contiguous
+            remaining = int(alive.sum())
+            for array in (self.position, self.velocity, self.age,
+                          self.scale):
+                array[:remaining] = array[:count][alive]
+            count = self.count = remaining
+
+        self.position[:count] += self.velocity[:count] * dt
+        numpy.minimum((self.age[:count] * (self.frames / self.lifetime))
+                      .astype(int), self.frames - 1, self.frame[:count])
+
+    def clear(self):
+        self.count = 0
+
+    def bind(self, batch, group):
+        """
+        Load the texture and prepare drawing the particles in the batch
+        within the (ordered) group.
+        """
+        animation = engine.resource.animation(self.animation_path,
+                                              self.animation_tiling,
+                                              self.lifetime)
+        images = [frame.image for frame in animation.frames]
+        image = images[0]
+        self.batch = batch
+        self.group = pyglet.sprite.SpriteGroup(image.get_texture(),
+                                               pyglet.gl.GL_SRC_ALPHA,
+                                               pyglet.gl.GL_ONE_MINUS_SRC_ALPHA,
+                                               group)
+        self.tex_coords = numpy.array([image.get_texture().tex_coords
+                                       for image in images],
+                                      dtype=numpy.float32)
+
+        # corners of the quad of a particle relative to its position
+        left = -image.anchor_x
+        bottom = -image.anchor_y
+        right = left + image.width
+        top = bottom + image.height
+        self.corners = numpy.array([(left, bottom), (right, bottom),
+                                    (right, top), (left, top)])
+
+    def sync(self):
+        """
+        Write the particles to their vertex list.
+        """
+        count = self.count
+        if not count:
+            if self.vertex_list is not None:
+                self.vertex_list.delete()
+                self.vertex_list = None
+            return
+
+        if self.vertex_list is None:
+            self.vertex_list = self.batch.add(4 * count, pyglet.gl.GL_QUADS,
+                                              self.group, 'v2f/stream',
+                                              't3f/stream', 'c4B/stream')
+        elif self.vertex_list.get_size() != 4 * count:
+            self.vertex_list.resize(4 * count)
+
+        vertices = (self.position[:count, numpy.newaxis, :]
+                    + self.scale[:count, numpy.newaxis, numpy.newaxis]
+                    * self.corners[numpy.newaxis, :, :])
+        colors = numpy.empty((count, 4, 4), dtype=numpy.uint8)
+        colors[:, :, :3] = 255
+        if self.fade:
+            colors[:, :, 3] = (255 * (1. - self.age[:count] / self.lifetime)
+                               )[:, numpy.newaxis]
+        else:
+            colors[:, :, 3] = 255
+
+        _copy(self.vertex_list.vertices, vertices.astype(numpy.float32))
+        _copy(self.vertex_list.tex_coords, self.tex_coords[self.frame[:count]])
+        _copy(self.vertex_list.colors, colors)
+
+    def _grow(self):
+        """
+        Private method to double the capacity of the particle storage.
+        """
+        capacity = len(self.age)
+        self.position = numpy.concatenate((self.position,
+                                           numpy.zeros((capacity, 2))))
+        self.velocity = numpy.concatenate((self.velocity,
+                                           numpy.zeros((capacity, 2))))
+        self.age = numpy.concatenate((self.age, numpy.zeros(capacity)))
+        self.scale = numpy.concatenate((self.scale, numpy.zeros(capacity)))
+        self.frame = numpy.concatenate((self.frame,
+                                        numpy.zeros(capacity, dtype=int)))
+
+
+def _copy(target, array):
+    """
+    Copy a numpy array into a ctypes array of a vertex list.
+    """
+    array = numpy.ascontiguousarray(array)
+    ctypes.memmove(target, array.ctypes.data, array.nbytes)
+
+
+class Emitter(object):
+    """
+    Description of particles a game object emits continuously: 'rate'
+    particles per second of the system named 'system', at 'offset'
+    relative to the object, ejected with 'speed' in 'direction' (radians,
+    relative to the object) within +/- 'spread'. With a 'condition', the
+    emitter is only active while that attribute of the object is true.
+    """
+
+    def __init__(self, system, rate, offset=(0, 0), direction=math.pi,
+                 speed=0., spread=0., scale=1., condition=None):
+        self.system = system
+        self.rate = rate
+        self.offset = offset
+        self.direction = direction
+        self.speed = speed
+        self.spread = spread
+        self.scale = scale
+        self.condition = condition
+
+
+class ParticleEffect(GameObject):
+    """
+    A burst of 'count' particles of the system 'system' (or a random one
+    of a tuple of systems), emitted when the effect is added to the game.
+    The object itself is removed right after.
+    """
+
+    system = None
+    count = 1
+    speed = 0.
+    scale = 1.
+    angle = 0
+    snapshot_arguments = ('position', 'scale')
+
+    def __init__(self, *args, **kwargs):
+        GameObject.__init__(self, *args, **kwargs)
+        self.position = kwargs.get('position', (0, 0))
+        self.angle = math.degrees(kwargs.get('angle', self.angle))
+        self.scale = kwargs.get('scale', self.scale)
+
+    def update(self, dt):
+        self.object_service.remove_object(self)
+
+
+def _placement(obj):
+    """
+    Return the position and angle (in radians) of a physical or
+    graphical object.
+    """
+    if hasattr(obj, 'body'):
+        return obj.body.position, obj.body.angle
+    return obj.position, math.radians(obj.angle)
+
+
+class ParticleService(AbstractService):
+    """
+    Service holding the particle systems by name. It runs the emitters
+    of the game objects and updates all particles every tick. Without
+    this service (e.g. headless), emitters and effects have no effect.
+    """
+
+    # emit from the positions after the physics step
+    priority = 11
+
+    def __init__(self):
+        self.systems = {}
+        self.emitters = {}
+        self.random = numpy.random.RandomState()
+
+    def add_system(self, name, system):
+        graphics = self.mgr[GraphicsService]
+        system.bind(graphics.batch,
+                    graphics.get_display_group(system.group_index))
+        self.systems[name] = system
+
+    def emit(self, name, position, count=1, direction=0., speed=0.,
+             spread=math.pi, scale=1.):
+        """
+        Emit 'count' particles of a system at the position, ejected with
+        up to 'speed' in 'direction' within +/- 'spread'.
+        """
+        angles = direction + self.random.uniform(-spread, spread, count)
+        speeds = speed * self.random.uniform(0.5, 1., count)
+        velocities = numpy.column_stack((numpy.cos(angles) * speeds,
+                                         numpy.sin(angles) * speeds))
+        self.systems[name].emit(numpy.tile((position[0], position[1]),
+                                           (count, 1)),
+                                velocities, numpy.repeat(scale, count))
+
+    @subscribe('object_added', components=('particle_emitters',))
+    def on_emitters_added(self, objects):
+        for obj in objects:
+            self.emitters[obj] = [[emitter, 0.]
+                                  for emitter in obj.particle_emitters]
+
+    @subscribe('object_removed', components=('particle_emitters',))
+    def on_emitters_removed(self, objects):
+        for obj in objects:
+            self.emitters.pop(obj, None)
+
+    @subscribe('object_added', types=(ParticleEffect,))
+    def on_effects_added(self, effects):
+        for effect in effects:
+            system = effect.system
+            if isinstance(system, tuple):
+                system = system[self.random.randint(len(system))]
+            self.emit(system, effect.position, effect.count,
+                      speed=effect.speed, scale=effect.scale)
+
+    def on_tick(self, dt):
+        """
+        Emit the particles of all active emitters, then update and
+        write the particles of all systems.
+        """
+        for obj, emitters in self.emitters.iteritems():
+            for entry in emitters:
+                emitter = entry[0]
+                if emitter.condition and not getattr(obj, emitter.condition):
+                    entry[1] = 0.
+                    continue
+                entry[1] += emitter.rate * dt
+                count = int(entry[1])
+                if not count:
+                    continue
+                entry[1] -= count
+                position, angle = _placement(obj)
+                x, y = emitter.offset
+                cos, sin = math.cos(angle), math.sin(angle)
+                self.emit(emitter.system,
+                          (position[0] + x * cos - y * sin,
+                           position[1] + x * sin + y * cos),
+                          count, angle + emitter.direction, emitter.speed,
+                          emitter.spread, emitter.scale)
+
+        for system in self.systems.itervalues():
+            system.update(dt)
+            system.sync()
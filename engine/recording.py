@@ -0,0 +1,135 @@
+"""
+Recording and deterministic replay of game sessions. A recording holds
+the seed of the 'random' module and, for every tick, its 'dt' and the
+key events the InputService dispatched before it. The ticks are
+compressed with zlib, so idle ticks cost next to nothing.
+"""
+import random
+import struct
+import time
+import zlib
+from engine.service import AbstractService, InputService
+from engine.application import HeadlessApplication
+from engine.serialization import encode_varint, decode_varint
+
+MAGIC = 'YAAREC'
+VERSION = 1
+
+HEADER = struct.Struct('!6sBQ')
+TICK = struct.Struct('!d')
+
+
+class InputRecorder(AbstractService):
+    """
+    Service writing the session to a recording file. It seeds the
+    'random' module when it is created, so it needs to be created before
+    anything random happens, e.g. first thing in Application.setup.
+    The file is complete after 'close' was called.
+    """
+
+    # record the dt before any other service ticks
+    priority = -1
+
+    def __init__(self, path, seed=None):
+        """
+        Initializes the recorder, writing to the file at 'path'. Without
+        a seed, one is derived from the current time.
+        """
+        if seed is None:
+            seed = int(time.time() * 1000)
+        self.seed = seed
+        random.seed(seed)
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed))
+        self.compressor = zlib.compressobj()
+        self.events = []
+        self.ticks = 0
+
+    def on_init(self, mgr):
+        mgr[InputService].add_listener(self.on_input)
+
+    def on_input(self, key, modifiers, pressed):
+        self.events.append((key, modifiers, pressed))
+
+    def on_tick(self, dt):
+        """
+        Writes the dt of the tick and the key events since the last one.
+        """
+        parts = [TICK.pack(dt), encode_varint(len(self.events))]
+        for key, modifiers, pressed in self.events:
+            parts.append(encode_varint(key << 1 | pressed))
+            parts.append(encode_varint(modifiers))
+        del self.events[:]
+        self.file.write(self.compressor.compress(''.join(parts)))
+        self.ticks += 1
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+
+class Recording(object):
+    """
+    A recording file read by 'InputRecorder'. Iterating it yields a
+    tuple of (dt, events) per tick, where events is a list of
+    (key, modifiers, pressed) tuples.
+    """
+
+    def __init__(self, path):
+        data = open(path, 'rb').read()
+        magic, version, self.seed = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("%s is not a recording of version %d"
+                            % (path, VERSION))
+        self.data = zlib.decompress(data[HEADER.size:])
+
+    def __iter__(self):
+        data = self.data
+        offset = 0
+        while offset < len(data):
+            dt, = TICK.unpack_from(data, offset)
+            count, offset = decode_varint(data, offset + TICK.size)
+            events = []
+            for _ in range(count):
+                value, offset = decode_varint(data, offset)
+                modifiers, offset = decode_varint(data, offset)
+                events.append((value >> 1, modifiers, bool(value & 1)))
+            yield dt, events
+
+
+class ReplayApplication(HeadlessApplication):
+    """
+    Replays a recording on a headless application, as fast as possible.
+    Subclasses set up the same services and initial objects as the
+    recorded application in 'setup', with an InputService without a
+    window. After 'run', 'ticks' and 'duration' hold the number of
+    replayed ticks and the wall time they took.
+    """
+
+    def __init__(self, path):
+        HeadlessApplication.__init__(self)
+        self.recording = Recording(path)
+        self.ticks = 0
+        self.duration = 0.
+
+    def run(self):
+        random.seed(self.recording.seed)
+        HeadlessApplication.run(self)
+
+    def loop(self):
+        """
+        Feeds the recorded key events and ticks to the services.
+        """
+        input_service = self.mgr[InputService]
+        start = time.time()
+        for dt, events in self.recording:
+            if not self.running:
+                break
+            for key, modifiers, pressed in events:
+                if pressed:
+                    input_service.on_key_press(key, modifiers)
+                else:
+                    input_service.on_key_release(key, modifiers)
+            self.mgr.send_broadcast('on_tick', dt)
+            self.ticks += 1
+        self.duration = time.time() - start
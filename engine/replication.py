@@ -1,74 +1,1458 @@
+import errno
+import heapq
+import math
+import socket
+import struct
+import time
+from engine.service import AbstractService, GameObjectService
+from engine.spatial import SpatialGrid
+from engine.serialization import (
+    encode_varint, decode_varint, PHYSICAL_OBJECT_SCHEMA
+)
+
+# sequence number used when no snapshot is available/acknowledged
+NO_SNAPSHOT = 0xFFFFFFFF
+
+# replication policies of game object classes ('replication_policy')
+REPLICATE = 'replicate'             # the state is sent every network tick
+SPAWN_LOCALLY = 'spawn_locally'     # clients spawn it from a spawn event
+NEVER = 'never'                     # the object is not replicated at all
+
+# flags of the fields contained in an ObjectUpdateMessage
+POSITION = 1
+VELOCITY = 2
+ANGLE = 4
+
+
+# codecs of the fields of a replicated state, see 'capture_state'
+STATE_CODECS = [codec for _, codec in PHYSICAL_OBJECT_SCHEMA.fixed]
+
+
+def _update_layout(fields):
+    """
+    Return the indices of the state fields contained in an
+    ObjectUpdateMessage with the given flags and the struct of their
+    quantized values.
+    """
+    indices = []
+    if fields & POSITION:
+        indices.extend((0, 1))
+    if fields & VELOCITY:
+        indices.extend((2, 3))
+    if fields & ANGLE:
+        indices.append(4)
+    return indices, struct.Struct('!' + ''.join(STATE_CODECS[index].format
+                                                for index in indices))
+
+UPDATE_LAYOUTS = [_update_layout(fields) for fields in range(8)]
+
+
+def capture_state(obj):
+    """
+    Return the replicated state of an object as a tuple of
+    (x, y, velocity x, velocity y, angle).
+    """
+    body = obj.body
+    return (body.position[0], body.position[1],
+            body.velocity[0], body.velocity[1], body.angle)
+
+
+def get_position(obj):
+    """
+    Return the position of a physical or graphical object.
+    """
+    if hasattr(obj, 'body'):
+        return obj.body.position
+    return obj.position
+
+
+def get_angle(obj):
+    """
+    Return the angle of a physical or graphical object in radians.
+    """
+    if hasattr(obj, 'body'):
+        return obj.body.angle
+    return math.radians(obj.angle)
+
+
+def get_arguments(names, state):
+    """
+    Return the constructor arguments of a replicated object from the
+    names of the fields of its serialized state (without the id) and
+    their values: its position, velocity and angle, followed by the
+    further fields of its class, e.g. the scale of an asteroid.
+    """
+    arguments = dict(zip(names, state))
+    arguments['position'] = arguments.pop('x'), arguments.pop('y')
+    arguments['velocity'] = (arguments.pop('velocity_x'),
+                             arguments.pop('velocity_y'))
+    return arguments
+
+
+def apply_state(obj, state):
+    """
+    Set the replicated state (see 'capture_state') of an object.
+    """
+    obj.body.position = state[0], state[1]
+    obj.body.velocity = state[2], state[3]
+    obj.body.angle = state[4]
+
 
 class AbstractReplicationMessage(object):
-    pass
-    
+    """
+    Abstract base class for all messages sent between the replication
+    services. Messages are encoded in a compact binary format, starting
+    with the one byte 'code' of the message class.
+    """
+    code = None
+    registry = {}
+
+    def encode(self):
+        return struct.pack('!B', self.code)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        """
+        Decode a message of this class from the data at the offset.
+        Returns the message and the offset after it.
+        """
+        return cls(), offset
+
+    @staticmethod
+    def decode_message(data, offset=0):
+        """
+        Decode any message from a datagram by its leading code.
+        """
+        code, = struct.unpack_from('!B', data, offset)
+        message_class = AbstractReplicationMessage.registry[code]
+        return message_class.decode(data, offset)[0]
+
+    @staticmethod
+    def register(message_class):
+        AbstractReplicationMessage.registry[message_class.code] = message_class
+        return message_class
+
+
 class ObjectCreateMessage(AbstractReplicationMessage):
-    pass
+    """
+    Entry of a snapshot for an object unknown to the baseline. The
+    'data' is the serialized object (see 'GameObject.serialize'), which
+    starts with the id. Its schema depends on the class, so it is
+    prefixed with its length and decoded by the ReplicationClientService,
+    which sets the 'state' of received messages.
+    """
+    format = struct.Struct('!B')
+
+    def __init__(self, id, type, state, data):
+        self.id = id
+        self.type = type
+        self.state = state
+        self.data = data
+
+    def encode(self):
+        return (self.format.pack(self.type) + encode_varint(len(self.data))
+                + self.data)
+
+    def size(self):
+        return (self.format.size + len(encode_varint(len(self.data)))
+                + len(self.data))
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        type, = cls.format.unpack_from(data, offset)
+        length, offset = decode_varint(data, offset + cls.format.size)
+        record = data[offset:offset + length]
+        id, _ = decode_varint(record)
+        return cls(id, type, None, record), offset + length
+
 
 class ObjectDeleteMessage(AbstractReplicationMessage):
-    pass
+    """
+    Entry of a snapshot for an object of the baseline that is gone.
+    """
+    def __init__(self, id):
+        self.id = id
+
+    def encode(self):
+        return encode_varint(self.id)
+
+    def size(self):
+        return len(self.encode())
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        id, offset = decode_varint(data, offset)
+        return cls(id), offset
+
+
+class SpawnMessage(AbstractReplicationMessage):
+    """
+    Entry of a SpawnEventMessage for an object that is spawned locally
+    by the clients, e.g. short lived effects like explosions.
+    """
+    format = struct.Struct('!B4f')
+
+    def __init__(self, type, x, y, angle, scale):
+        self.type = type
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.scale = scale
+
+    def encode(self):
+        return self.format.pack(self.type, self.x, self.y, self.angle,
+                                self.scale)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        return (cls(*cls.format.unpack_from(data, offset)),
+                offset + cls.format.size)
+
 
 class ObjectUpdateMessage(AbstractReplicationMessage):
-    pass
+    """
+    Entry of a snapshot for an object of the baseline that changed.
+    Only the changed fields, marked in the 'fields' flags, are encoded,
+    quantized like in the PHYSICAL_OBJECT_SCHEMA.
+    """
+    format = struct.Struct('!B')
+
+    def __init__(self, id, fields, values):
+        self.id = id
+        self.fields = fields
+        self.values = values
+
+    @classmethod
+    def diff(cls, id, old, new):
+        """
+        Create an update message for the changes between two states or
+        return None if nothing changed.
+        """
+        fields = 0
+        values = []
+        if old[0:2] != new[0:2]:
+            fields |= POSITION
+            values.extend(new[0:2])
+        if old[2:4] != new[2:4]:
+            fields |= VELOCITY
+            values.extend(new[2:4])
+        if old[4] != new[4]:
+            fields |= ANGLE
+            values.append(new[4])
+        if not fields:
+            return None
+        return cls(id, fields, values)
+
+    def apply(self, state):
+        """
+        Return the given state with the changes of this message applied.
+        """
+        state = list(state)
+        values = iter(self.values)
+        if self.fields & POSITION:
+            state[0:2] = next(values), next(values)
+        if self.fields & VELOCITY:
+            state[2:4] = next(values), next(values)
+        if self.fields & ANGLE:
+            state[4] = next(values)
+        return tuple(state)
+
+    def encode(self):
+        indices, layout = UPDATE_LAYOUTS[self.fields]
+        return (encode_varint(self.id) + self.format.pack(self.fields)
+                + layout.pack(*[STATE_CODECS[index].to_raw(value)
+                                for index, value in zip(indices,
+                                                        self.values)]))
+
+    def size(self):
+        return (len(encode_varint(self.id)) + self.format.size
+                + UPDATE_LAYOUTS[self.fields][1].size)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        id, offset = decode_varint(data, offset)
+        fields, = cls.format.unpack_from(data, offset)
+        offset += cls.format.size
+        indices, layout = UPDATE_LAYOUTS[fields]
+        values = [STATE_CODECS[index].from_raw(raw)
+                  for index, raw in zip(indices,
+                                        layout.unpack_from(data, offset))]
+        return cls(id, fields, values), offset + layout.size
+
+
+@AbstractReplicationMessage.register
+class SnapshotMessage(AbstractReplicationMessage):
+    """
+    The state of all replicated objects at a network tick, delta
+    compressed against the 'baseline' snapshot the client acknowledged.
+    """
+    code = ord('S')
+    format = struct.Struct('!BIIHHH')
 
+    def __init__(self, sequence, baseline, creates=(), updates=(),
+                 deletes=()):
+        self.sequence = sequence
+        self.baseline = baseline
+        self.creates = creates
+        self.updates = updates
+        self.deletes = deletes
+
+    def apply(self, snapshot):
+        """
+        Return a new snapshot with the contents of this message applied
+        to the given baseline snapshot.
+        """
+        snapshot = dict(snapshot)
+        for message in self.deletes:
+            snapshot.pop(message.id, None)
+        for message in self.updates:
+            type, state = snapshot[message.id]
+            snapshot[message.id] = (type, message.apply(state))
+        for message in self.creates:
+            snapshot[message.id] = (message.type, tuple(message.state))
+        return snapshot
+
+    def encode(self):
+        parts = [self.format.pack(self.code, self.sequence, self.baseline,
+                                  len(self.creates), len(self.updates),
+                                  len(self.deletes))]
+        for messages in (self.creates, self.updates, self.deletes):
+            for message in messages:
+                parts.append(message.encode())
+        return ''.join(parts)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        counts = cls.format.unpack_from(data, offset)
+        sequence, baseline = counts[1:3]
+        offset += cls.format.size
+        lists = []
+        for message_class, count in zip((ObjectCreateMessage,
+                                         ObjectUpdateMessage,
+                                         ObjectDeleteMessage), counts[3:]):
+            messages = []
+            for _ in range(count):
+                message, offset = message_class.decode(data, offset)
+                messages.append(message)
+            lists.append(messages)
+        return cls(sequence, baseline, *lists), offset
+
+
+@AbstractReplicationMessage.register
+class SpawnEventMessage(AbstractReplicationMessage):
+    """
+    The objects spawned locally by the clients within a network tick.
+    Sent on the reliable channel, so that no spawn gets lost.
+    """
+    code = ord('E')
+    format = struct.Struct('!BH')
+
+    def __init__(self, spawns):
+        self.spawns = spawns
+
+    def encode(self):
+        return (self.format.pack(self.code, len(self.spawns))
+                + ''.join(spawn.encode() for spawn in self.spawns))
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        _, count = cls.format.unpack_from(data, offset)
+        offset += cls.format.size
+        spawns = []
+        for _ in range(count):
+            spawn, offset = SpawnMessage.decode(data, offset)
+            spawns.append(spawn)
+        return cls(spawns), offset
+
+
+@AbstractReplicationMessage.register
+class AckMessage(AbstractReplicationMessage):
+    """
+    Acknowledges the receipt of a snapshot. An acknowledgement of
+    NO_SNAPSHOT (re-)connects a client and requests a full snapshot.
+    """
+    code = ord('A')
+    format = struct.Struct('!BI')
+
+    def __init__(self, sequence=NO_SNAPSHOT):
+        self.sequence = sequence
+
+    def encode(self):
+        return self.format.pack(self.code, self.sequence)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        _, sequence = cls.format.unpack_from(data, offset)
+        return cls(sequence), offset + cls.format.size
+
+
+@AbstractReplicationMessage.register
+class InterestMessage(AbstractReplicationMessage):
+    """
+    Sets the interest area of a client: only objects within the radius
+    around the center are replicated to it. A radius of zero disables
+    the interest management for the client.
+    """
+    code = ord('I')
+    format = struct.Struct('!B3f')
+
+    def __init__(self, x=0., y=0., radius=0.):
+        self.x = x
+        self.y = y
+        self.radius = radius
+
+    def encode(self):
+        return self.format.pack(self.code, self.x, self.y, self.radius)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        _, x, y, radius = cls.format.unpack_from(data, offset)
+        return cls(x, y, radius), offset + cls.format.size
+
+
+@AbstractReplicationMessage.register
+class InputMessage(AbstractReplicationMessage):
+    """
+    The input commands of a client, one flags byte per fixed input tick,
+    starting with the sequence number 'first'. All commands that were
+    not acknowledged yet are repeated, so lost datagrams do not matter.
+    """
+    code = ord('C')
+    format = struct.Struct('!BIB')
+
+    def __init__(self, first, commands):
+        self.first = first
+        self.commands = commands
+
+    def encode(self):
+        return (self.format.pack(self.code, self.first, len(self.commands))
+                + struct.pack('!%dB' % len(self.commands), *self.commands))
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        _, first, count = cls.format.unpack_from(data, offset)
+        offset += cls.format.size
+        commands = struct.unpack_from('!%dB' % count, data, offset)
+        return cls(first, commands), offset + count
+
+
+@AbstractReplicationMessage.register
+class InputAckMessage(AbstractReplicationMessage):
+    """
+    The authoritative state of the object controlled by a client after
+    the input command with the given sequence number was processed.
+    """
+    code = ord('R')
+    format = struct.Struct('!BII5f')
+
+    def __init__(self, id, sequence, state):
+        self.id = id
+        self.sequence = sequence
+        self.state = state
+
+    def encode(self):
+        return self.format.pack(self.code, self.id, self.sequence,
+                                *self.state)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        values = cls.format.unpack_from(data, offset)
+        return (cls(values[1], values[2], values[3:]),
+                offset + cls.format.size)
+
+
+@AbstractReplicationMessage.register
 class PingMessage(AbstractReplicationMessage):
-    pass
-    
-class PongMessage(AbstractReplicationMessage):
-    pass
+    """
+    Requests a PongMessage with the same timestamp.
+    """
+    code = ord('P')
+    format = struct.Struct('!Bd')
+
+    def __init__(self, timestamp=0.):
+        self.timestamp = timestamp
+
+    def encode(self):
+        return self.format.pack(self.code, self.timestamp)
+
+    @classmethod
+    def decode(cls, data, offset=0):
+        _, timestamp = cls.format.unpack_from(data, offset)
+        return cls(timestamp), offset + cls.format.size
+
+
+@AbstractReplicationMessage.register
+class PongMessage(PingMessage):
+    """
+    Answer to a PingMessage.
+    """
+    code = ord('Q')
+
 
-class ReplicationClientService(AbstractService):
+class Connection(object):
+    """
+    Helper class for the state of a Transport towards one remote address:
+    the reliable messages in flight, the reliable messages received out
+    of order and the estimated round trip time.
+    The reliable stream in each direction is identified by the 'epoch'
+    of its sender; 'remote_epoch' is the epoch of the stream received
+    from the remote address (0 while none was accepted).
+    """
+    def __init__(self, address, now, epoch):
+        self.address = address
+        self.epoch = epoch
+        self.remote_epoch = 0
+        self.send_sequence = 0
+        self.unacked = {}
+        self.receive_sequence = 0
+        self.received = {}
+        self.rtt = None
+        self.rtt_deviation = 0.
+        self.last_ping = now
+        self.last_receive = now
+
+    def restart(self, epoch):
+        """
+        Start a new outgoing stream with the epoch. The reliable messages
+        that are not acknowledged yet are numbered again from zero, so
+        they are delivered by the new stream.
+        """
+        self.epoch = epoch
+        unacked = sorted(self.unacked.iteritems())
+        self.unacked = dict((sequence, [payload, 0., 0])
+                            for sequence, (_, (payload, _, _))
+                            in enumerate(unacked))
+        self.send_sequence = len(unacked)
+
+    def accept(self, remote_epoch):
+        """
+        Start receiving the stream with the epoch from its beginning.
+        """
+        self.remote_epoch = remote_epoch
+        self.receive_sequence = 0
+        self.received = {}
+
+    def update_rtt(self, sample):
+        """
+        Add a measured round trip time to the smoothed estimation (as in
+        TCP, RFC 6298).
+        """
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_deviation = sample / 2.
+        else:
+            self.rtt_deviation = (0.75 * self.rtt_deviation
+                                  + 0.25 * abs(self.rtt - sample))
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+
+    def get_timeout(self, default, minimum):
+        """
+        Return the time after which a reliable message is resent.
+        """
+        if self.rtt is None:
+            return default
+        return max(minimum, self.rtt + 4 * self.rtt_deviation)
+
+
+def is_newer_epoch(epoch, other):
+    """
+    Return whether the epoch was chosen after the other one, which is 0
+    if there is none. Epochs wrap around as serial numbers (RFC 1982).
+    """
+    return other == 0 or 0 < (epoch - other) & 0xFFFFFFFF < 0x80000000
+
+
+class Transport(object):
+    """
+    Non blocking UDP transport of replication messages, offering an
+    unreliable and a reliable, ordered channel. Every datagram starts
+    with its channel byte, the epoch of the stream of its sender and the
+    epoch of the stream it received from the other end. Reliable messages
+    carry a sequence number and are resent until they are acknowledged,
+    with a timeout derived from the round trip time, which is measured
+    with Ping/PongMessages.
+    The epochs keep both ends in step when one of them lost its state,
+    because the connection expired or the process was restarted: a
+    stream that was accepted by an earlier state of the other end is
+    restarted with a new epoch, the messages that are not acknowledged
+    yet are sent again under it. The addresses of the peers that started
+    anew are listed in 'resets' after each 'poll'.
+    'poll' never blocks: it is called once per tick to handle all
+    datagrams that arrived. For testing, an artificial 'latency' (in
+    seconds) can be added to all sent datagrams.
+    """
+
+    # channels of the datagrams
+    UNRELIABLE = 0
+    RELIABLE = 1
+    ACK = 2
+
+    # channel, epoch of the sender and the epoch it received
+    prefix = struct.Struct('!BII')
+
+    # the prefix followed by the sequence number
+    header = struct.Struct('!BIII')
+
+    # maximum size of a datagram
+    buffer_size = 65507
+
+    # seconds between two pings of a connection
+    ping_interval = 1.
+
+    # timeouts of reliable messages, before and after the RTT is known
+    initial_timeout = 0.5
+    minimum_timeout = 0.05
+
+    # number of sends after which a reliable message is dropped
+    max_attempts = 20
+
+    # artificial delay of sent datagrams
+    latency = 0.
+
+    def __init__(self, address=('', 0)):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.socket.bind(address)
+        self.address = self.socket.getsockname()
+        self.connections = {}
+        self.outgoing = []
+        self.resets = []
+        self.epoch = 0
+
+    def get_connection(self, address):
+        connection = self.connections.get(address)
+        if connection is None:
+            connection = Connection(address, time.time(), self.new_epoch())
+            self.connections[address] = connection
+        return connection
+
+    def new_epoch(self):
+        """
+        Return an epoch that is newer than all epochs used before, also
+        by earlier runs of the process, as it is taken from the clock.
+        """
+        epoch = int(time.time() * 1000) & 0xFFFFFFFF
+        if not is_newer_epoch(epoch, self.epoch):
+            epoch = (self.epoch + 1) & 0xFFFFFFFF
+        self.epoch = epoch or 1
+        return self.epoch
+
+    def get_rtt(self, address):
+        """
+        Return the estimated round trip time to the address in seconds or
+        None if it was not measured yet.
+        """
+        connection = self.connections.get(address)
+        return connection.rtt if connection is not None else None
+
+    def send(self, message, address, reliable=False):
+        """
+        Send a message to the address, on the reliable channel if
+        requested.
+        """
+        connection = self.get_connection(address)
+        if reliable:
+            sequence = connection.send_sequence
+            connection.send_sequence += 1
+            payload = message.encode()
+            connection.unacked[sequence] = [payload, time.time(), 1]
+            data = self.header.pack(self.RELIABLE, connection.epoch,
+                                    connection.remote_epoch,
+                                    sequence) + payload
+        else:
+            data = self.prefix.pack(self.UNRELIABLE, connection.epoch,
+                                    connection.remote_epoch) \
+                   + message.encode()
+        self._send(data, address)
+
+    def poll(self):
+        """
+        Handle all datagrams that arrived since the last call, resend
+        reliable messages that timed out and ping the connections.
+        Returns a list of the received messages with the addresses of
+        their senders, reliable messages in the order they were sent.
+        """
+        now = time.time()
+        self.flush(now)
+        messages = []
+        self.resets = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(self.buffer_size)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                if e.args[0] in (errno.ECONNREFUSED, errno.ECONNRESET):
+                    continue # an earlier datagram was not delivered
+                raise
+            try:
+                self._receive(data, address, now, messages)
+            except (struct.error, KeyError, IndexError):
+                continue # malformed or unknown message
+
+        for connection in self.connections.itervalues():
+            self._resend(connection, now)
+            if now - connection.last_ping >= self.ping_interval:
+                connection.last_ping = now
+                self.send(PingMessage(now), connection.address)
+        return messages
+
+    def expire(self, timeout):
+        """
+        Forget all connections that did not receive anything within the
+        timeout. Returns the addresses of the expired connections.
+        """
+        now = time.time()
+        expired = [address for address, connection
+                   in self.connections.iteritems()
+                   if now - connection.last_receive > timeout]
+        for address in expired:
+            del self.connections[address]
+        return expired
+
+    def flush(self, now=None):
+        """
+        Send all delayed datagrams that are due.
+        """
+        if now is None:
+            now = time.time()
+        while self.outgoing and self.outgoing[0][0] <= now:
+            _, data, address = heapq.heappop(self.outgoing)
+            self.socket.sendto(data, address)
+
+    def close(self):
+        self.socket.close()
+
+    def _send(self, data, address):
+        """
+        Private method to send a datagram, delayed by the latency.
+        """
+        if self.latency:
+            heapq.heappush(self.outgoing, (time.time() + self.latency,
+                                           data, address))
+        else:
+            self.socket.sendto(data, address)
+
+    def _receive(self, data, address, now, messages):
+        """
+        Private method to handle one received datagram. Received
+        messages are appended to 'messages'.
+        """
+        channel, epoch, remote_epoch = self.prefix.unpack_from(data)
+        connection = self.get_connection(address)
+        connection.last_receive = now
+
+        if epoch != connection.remote_epoch:
+            if not is_newer_epoch(epoch, connection.remote_epoch):
+                return # late datagram of an older stream
+            if remote_epoch not in (0, connection.epoch):
+                # the stream was accepted by an earlier state of this
+                # end, tell the sender to restart it
+                self.send(PingMessage(now), address)
+                return
+            if connection.remote_epoch != 0:
+                self.resets.append(address)
+                if remote_epoch != connection.epoch:
+                    connection.restart(self.new_epoch())
+            connection.accept(epoch)
+
+        if channel == self.ACK:
+            if remote_epoch != connection.epoch:
+                return # acknowledges an earlier stream
+            sequence = self.header.unpack_from(data)[3]
+            entry = connection.unacked.pop(sequence, None)
+            if entry is not None and entry[2] == 1:
+                # only unambiguous samples (Karn's algorithm)
+                connection.update_rtt(now - entry[1])
+
+        elif channel == self.RELIABLE:
+            sequence = self.header.unpack_from(data)[3]
+            self._send(self.header.pack(self.ACK, connection.epoch,
+                                        epoch, sequence), address)
+            if (sequence < connection.receive_sequence
+                or sequence in connection.received):
+                return # duplicate
+            connection.received[sequence] = \
+                AbstractReplicationMessage.decode_message(data,
+                                                          self.header.size)
+            while connection.receive_sequence in connection.received:
+                message = connection.received.pop(connection.receive_sequence)
+                messages.append((message, address))
+                connection.receive_sequence += 1
+
+        elif channel == self.UNRELIABLE:
+            message = AbstractReplicationMessage.decode_message(
+                data, self.prefix.size)
+            if isinstance(message, PongMessage):
+                connection.update_rtt(now - message.timestamp)
+            elif isinstance(message, PingMessage):
+                self.send(PongMessage(message.timestamp), address)
+            else:
+                messages.append((message, address))
+
+    def _resend(self, connection, now):
+        """
+        Private method to resend the reliable messages of a connection
+        that were not acknowledged in time.
+        """
+        timeout = connection.get_timeout(self.initial_timeout,
+                                         self.minimum_timeout)
+        for sequence, entry in connection.unacked.items():
+            payload, sent, attempts = entry
+            if now - sent < timeout * min(2 ** (attempts - 1), 8):
+                continue
+            if attempts >= self.max_attempts:
+                del connection.unacked[sequence]
+                continue
+            entry[1] = now
+            entry[2] = attempts + 1
+            self._send(self.header.pack(self.RELIABLE, connection.epoch,
+                                        connection.remote_epoch, sequence)
+                       + payload, connection.address)
+
+
+class AbstractReplicationService(AbstractService):
+    """
+    Common base class for the replication services, sending and
+    receiving messages with a Transport. The transport is polled every
+    tick and never blocks, so the frame is never held up by the network.
+    """
+
+    priority = 5
+
+    # length of the fixed input ticks
+    command_interval = 1. / 60.
+
+    def __init__(self, types, address=('', 0)):
+        """
+        Initializes the service with the list of replicated classes. The
+        index of a class in the list identifies it on the network, so
+        server and clients need to use the same list.
+        """
+        self.types = list(types)
+        self.type_ids = dict((cls, index)
+                             for index, cls in enumerate(self.types))
+        self.transport = Transport(address)
+        self.address = self.transport.address
+
+    def receive(self):
+        """
+        Return all messages received since the last call and the
+        addresses of their senders.
+        """
+        return self.transport.poll()
+
+    def send(self, message, address, reliable=False):
+        self.transport.send(message, address, reliable)
+
+    def close(self):
+        self.transport.close()
+
+
+class ReplicationServerService(AbstractReplicationService):
+    """
+    The ReplicationServerService sends the state of all objects of the
+    replicated classes to its clients each network tick.
+    Clients may control an object (see 'set_controlled'), which is driven
+    by the input commands of the client, one per fixed input tick.
+    What is sent depends on the 'replication_policy' of the class of an
+    object (REPLICATE by default), the interest area of the client and
+    the bandwidth budget: the relevant changes are sent by priority,
+    which grows with the time an object was not sent and with its
+    closeness to the center of the interest area.
+    Objects are created on the clients from their serialized state (see
+    'GameObject.serialize'), so the schema of a replicated class starts
+    with the fields of the PHYSICAL_OBJECT_SCHEMA; later snapshots only
+    update these fields.
+    Snapshots are delta compressed against the last snapshot each client
+    acknowledged and sent unreliably: lost creates and deletes are
+    repeated by the next snapshot, as the baseline stays the same.
+    Connecting and the spawn events use the reliable channel.
+    Clients are disconnected when nothing was received from them for
+    'client_timeout' seconds. The 'on_client_connected(address)' and
+    'on_client_disconnected(address)' messages are broadcast to the
+    services.
+    """
+
+    # number of snapshots kept as possible baselines
+    history_size = 64
+
+    # seconds of silence after which a client is disconnected
+    client_timeout = 10.
+
+    class Client(object):
+        """
+        Helper class for the state of a connected client. 'history'
+        holds the state known to the client after each sent snapshot.
+        """
+        def __init__(self, address):
+            self.address = address
+            self.acked = NO_SNAPSHOT
+            self.history = {}
+            self.interest = None
+            self.priorities = {}
+            self.controlled = None
+            self.commands = {}
+            self.command_sequence = 0
+            self.command_time = 0.
+
+    def __init__(self, types, address=('', 12345), rate=20., budget=1200,
+                 cell_size=200.):
+        """
+        Initializes the server, listening on the given address and
+        sending 'rate' snapshots per second of at most 'budget' bytes
+        to each client.
+        """
+        AbstractReplicationService.__init__(self, types, address)
+        self.interval = 1. / rate
+        self.budget = budget
+        self.elapsed = 0.
+        self.clients = {}
+        self.objects = {}
+        self.spawns = []
+        self.next_id = 0
+        self.sequence = 0
+        self.grid = SpatialGrid(cell_size)
+
+    def on_init(self, mgr):
+        mgr.events.subscribe('object_added', self.on_objects_added,
+                             types=self.types, priority=self.priority)
+        mgr.events.subscribe('object_removed', self.on_objects_removed,
+                             types=self.types, priority=self.priority)
+
+    def on_objects_added(self, objects):
+        """
+        Assigns network IDs to all added objects of replicated classes
+        and queues the spawn events of locally spawned ones.
+        """
+        for obj in objects:
+            if obj.__class__ not in self.type_ids:
+                continue
+            policy = getattr(obj.__class__, 'replication_policy', REPLICATE)
+            if policy == REPLICATE:
+                obj.id = self.next_id
+                self.next_id += 1
+                self.objects[obj.id] = obj
+            elif policy == SPAWN_LOCALLY:
+                position = get_position(obj)
+                self.spawns.append(SpawnMessage(self.type_ids[obj.__class__],
+                                                position[0], position[1],
+                                                get_angle(obj), obj.scale))
+
+    def on_objects_removed(self, objects):
+        for obj in objects:
+            if obj.__class__ in self.type_ids and hasattr(obj, 'id'):
+                self.objects.pop(obj.id, None)
+        for client in self.clients.itervalues():
+            if client.controlled in objects:
+                client.controlled = None
+
+    def set_controlled(self, address, obj):
+        """
+        Let the client at the address control a replicated object. The
+        object needs to implement 'apply_command(flags)'.
+        """
+        client = self.clients[address]
+        client.controlled = obj
+        client.commands.clear()
+
+    def on_tick(self, dt):
+        """
+        Handles received messages and sends a snapshot to every client
+        each network tick.
+        """
+        messages = self.receive()
+        for address in self.transport.resets:
+            # the client started anew, it connects again
+            if self.clients.pop(address, None) is not None:
+                self.mgr.send_broadcast('on_client_disconnected', address)
+        for message, address in messages:
+            client = self.clients.get(address)
+            if isinstance(message, AckMessage):
+                if client is None:
+                    client = self.clients[address] = self.Client(address)
+                    self.mgr.send_broadcast('on_client_connected', address)
+                if message.sequence == NO_SNAPSHOT:
+                    client.acked = NO_SNAPSHOT
+                    client.history.clear()
+                elif (message.sequence in client.history
+                      and (client.acked == NO_SNAPSHOT
+                           or message.sequence > client.acked)):
+                    client.acked = message.sequence
+            elif isinstance(message, InterestMessage):
+                if client is not None:
+                    if message.radius > 0.:
+                        client.interest = (message.x, message.y,
+                                           message.radius)
+                    else:
+                        client.interest = None
+            elif isinstance(message, InputMessage):
+                if client is not None:
+                    for sequence, flags in enumerate(message.commands,
+                                                     message.first):
+                        if sequence > client.command_sequence:
+                            client.commands[sequence] = flags
+
+        for address in self.transport.expire(self.client_timeout):
+            if self.clients.pop(address, None) is not None:
+                self.mgr.send_broadcast('on_client_disconnected', address)
+
+        for client in self.clients.itervalues():
+            self.process_commands(client, dt)
+
+        self.elapsed += dt
+        if self.elapsed < self.interval:
+            return
+        self.elapsed %= self.interval
+
+        snapshot = self.snapshot()
+        spawns, self.spawns = self.spawns, []
+        for client in self.clients.itervalues():
+            controlled = client.controlled
+            if controlled is not None and hasattr(controlled, 'id'):
+                self.send(InputAckMessage(controlled.id,
+                                          client.command_sequence,
+                                          capture_state(controlled)),
+                          client.address)
+            self.send(self.delta(snapshot, client), client.address)
+            relevant = self.relevant_spawns(spawns, client)
+            if relevant:
+                self.send(SpawnEventMessage(relevant), client.address,
+                          reliable=True)
+
+    def process_commands(self, client, dt):
+        """
+        Apply the received input commands of the client that are due
+        within this tick to its controlled object. If commands are
+        missing, the last one stays in effect.
+        """
+        if client.controlled is None:
+            return
+        client.command_time += dt
+        flags = None
+        while client.command_time >= self.command_interval:
+            sequence = client.command_sequence + 1
+            if sequence not in client.commands:
+                # skip commands the client dropped without acknowledgement
+                later = [later for later in client.commands if later > sequence]
+                if not later:
+                    client.command_time = self.command_interval
+                    break
+                sequence = min(later)
+            client.command_time -= self.command_interval
+            flags = client.commands.pop(sequence)
+            client.command_sequence = sequence
+        if flags is not None:
+            client.controlled.apply_command(flags)
+
+    def snapshot(self):
+        """
+        Capture the state of all replicated objects as a new snapshot
+        and update the spatial grid. The state of an object is its
+        serialized state without the id, decoded again, so that changes
+        which would not arrive are not sent either.
+        """
+        self.sequence += 1
+        self.grid.clear()
+        snapshot = {}
+        for id, obj in self.objects.iteritems():
+            state = obj.schema.unpack(obj.serialize())[1:]
+            snapshot[id] = (self.type_ids[obj.__class__], state)
+            self.grid.insert(id, state[0], state[1])
+        return snapshot
+
+    def relevant(self, snapshot, client):
+        """
+        Return a dict of id -> distance of all objects within the
+        interest area of the client. Without an interest area, all
+        objects are relevant with a distance of zero.
+        """
+        if client.interest is None:
+            return dict.fromkeys(snapshot, 0.)
+        return dict(self.grid.query_radius(*client.interest))
+
+    def relevant_spawns(self, spawns, client):
+        """
+        Return the spawn events within the interest area of the client.
+        """
+        if client.interest is None:
+            return spawns
+        x, y, radius = client.interest
+        return [spawn for spawn in spawns
+                if math.hypot(spawn.x - x, spawn.y - y) <= radius]
+
+    def delta(self, snapshot, client):
+        """
+        Create the snapshot message for a client, using its last
+        acknowledged snapshot as baseline if still available. Deletes
+        are always sent, creates and updates by priority within the
+        bandwidth budget.
+        """
+        baseline = client.acked
+        if baseline not in client.history:
+            baseline = NO_SNAPSHOT
+        known = client.history.get(baseline, {})
+        relevant = self.relevant(snapshot, client)
+
+        deletes = [ObjectDeleteMessage(id) for id in known
+                   if id not in relevant]
+        size = (SnapshotMessage.format.size
+                + sum(message.size() for message in deletes))
+
+        # collect all changes with their priorities
+        candidates = []
+        priorities = client.priorities
+        radius = client.interest[2] if client.interest else 1.
+        for id, distance in relevant.iteritems():
+            type, state = snapshot[id]
+            if id not in known:
+                schema = self.types[type].schema
+                message = ObjectCreateMessage(id, type, state,
+                                              schema.pack((id,) + state))
+                message_size = message.size()
+                boost = 2.
+            else:
+                message = ObjectUpdateMessage.diff(id, known[id][1], state)
+                if message is None:
+                    priorities.pop(id, None)
+                    continue
+                message_size = message.size()
+                boost = 1.
+            priority = (priorities.get(id, 0.)
+                        + boost * (2. - distance / radius))
+            priorities[id] = priority
+            candidates.append((priority, message_size, message))
+
+        # choose the most important changes that fit into the budget
+        creates = []
+        updates = []
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        for _, message_size, message in candidates:
+            if self.budget is not None and size + message_size > self.budget:
+                continue
+            size += message_size
+            del priorities[message.id]
+            if isinstance(message, ObjectCreateMessage):
+                creates.append(message)
+            else:
+                updates.append(message)
+
+        for id in [id for id in priorities if id not in relevant]:
+            del priorities[id]
+
+        message = SnapshotMessage(self.sequence, baseline, creates, updates,
+                                  deletes)
+        client.history[self.sequence] = message.apply(known)
+        client.history.pop(self.sequence - self.history_size, None)
+        return message
+
+
+class ReplicationClientService(AbstractReplicationService):
     """
     The ReplicationClientService is responsible to replicate certain
     game objects over a network to the server and/or other clients.
-    TODO: implement
+    Snapshots of the server are applied to the local game objects,
+    creating and removing them as necessary.
+    The object controlled by this client is predicted: its input is
+    sampled every fixed input tick ('get_command'), sent to the server
+    and kept until the server acknowledges it. When the authoritative
+    state arrives, the object is reset to it and all pending commands
+    are replayed ('simulate(flags, dt)') and 'on_controlled(obj)' is
+    broadcast to the services when the controlled object changes.
+    The 'predicted' attribute of the controlled object is set, so that it
+    does not spawn objects like shots itself: the server replicates them.
     """
-    
-    priority = 5
-    
-    def __init__(self, connection = ("localhost", 12345)):
-        self.messages = []
-        # TODO set up client
-        
+
+    # number of received snapshots kept as possible baselines
+    history_size = 64
+
+    def __init__(self, types, connection = ("localhost", 12345)):
+        AbstractReplicationService.__init__(self, types)
+        # the address as the datagrams of the server are received from
+        self.connection = (socket.gethostbyname(connection[0]),
+                           connection[1])
+        self.snapshots = {}
+        self.sequence = NO_SNAPSHOT
+        self.objects = {}
+        self.ids = {}
+        self.interest = None
+        self.controlled = None
+        self.commands = []
+        self.command_sequence = 0
+        self.command_time = 0.
+        self.prediction_error = 0.
+
+    def on_init(self, mgr):
+        mgr.events.subscribe('object_removed', self.on_objects_removed,
+                             types=self.types, priority=self.priority)
+        self.connect()
+
+    def connect(self):
+        """
+        Request a full snapshot from the server.
+        """
+        self.snapshots.clear()
+        self.send(AckMessage(NO_SNAPSHOT), self.connection, reliable=True)
+        if self.interest is not None:
+            self.send(InterestMessage(*self.interest), self.connection,
+                      reliable=True)
+
+    def set_interest(self, center, radius):
+        """
+        Set the area of interest of this client. Only objects within the
+        radius around the center are replicated. A radius of zero means
+        no restriction.
+        """
+        self.interest = (center[0], center[1], radius)
+        self.send(InterestMessage(*self.interest), self.connection,
+                  reliable=True)
+
+    def get_rtt(self):
+        """
+        Return the estimated round trip time to the server in seconds or
+        None if it is not known yet.
+        """
+        return self.transport.get_rtt(self.connection)
+
     def on_tick(self, dt):
         """
-        Send contents of objects this client/server has authority over.
-        Receive contents of other objects and update them.
-        """
-        
-        # TODO receive from server
-        # deserialize messages
-        # loop messages
-        # if msg.type == object update:
-        # get object by ID and set attributes
-        
-        # check for dirty objects
-        # serialize objects
-        # append to messages
-        # TODO send all messages to the server
-        
-        pass
-    
-    def on_object_added(self, obj):
-        """
-        Check if the object is to be replicated (i.e: has the 'local'
-        attribute). If it is a locally created object (local=True) it 
-        is to be replicated to the server.
-        """
-        try:
-            if obj.local:
-                self.messages.append(('c', obj.id, obj.serialize()))
-        except AttributeError: pass # not a replicable object
-        
-    def on_object_removed(self, obj):
-        """
-        Check if the object is replicated (see 'on_object_added') and
-        whether or not it is a local object. If it is a local object
-        it needs to be destroyed on the server and on other clients
-        too, thus a destroy message needs to be sent.
-        """
-        try:
-            if obj.local:
-                self.messages.append(('d', obj.id))
-        except AttributeError: pass # not a replicable object
-    
+        Receive the snapshots of the server and apply the newest one to
+        the objects.
+        """
+        newest = None
+        messages = self.receive()
+        if self.connection in self.transport.resets:
+            # the server started anew, request a full snapshot again
+            self.connect()
+        for message, _ in messages:
+            if isinstance(message, InputAckMessage):
+                self.reconcile(message)
+            elif isinstance(message, SpawnEventMessage):
+                self.spawn(message.spawns)
+            elif isinstance(message, SnapshotMessage):
+                self.decode(message.creates)
+                if message.baseline == NO_SNAPSHOT:
+                    baseline = {}
+                elif message.baseline in self.snapshots:
+                    baseline = self.snapshots[message.baseline]
+                else:
+                    # the baseline is lost, start over
+                    self.connect()
+                    continue
+                self.snapshots[message.sequence] = message.apply(baseline)
+                self.snapshots.pop(message.sequence - self.history_size, None)
+                self.send(AckMessage(message.sequence), self.connection)
+                if (self.sequence == NO_SNAPSHOT
+                    or message.sequence > self.sequence):
+                    newest = message.sequence
+
+        if newest is not None:
+            self.sequence = newest
+            self.apply(self.snapshots[newest])
+
+        self.sample_commands(dt)
+
+    def decode(self, creates):
+        """
+        Decode the serialized objects of the create messages of a
+        snapshot with the schemas of their classes.
+        """
+        for message in creates:
+            cls = self.types[message.type]
+            fields, _ = cls.deserialize(message.data)
+            message.state = tuple([fields[name]
+                                   for name in cls.schema.names[1:]])
+
+    def sample_commands(self, dt):
+        """
+        Record the input of the controlled object for every fixed input
+        tick and send all unacknowledged commands to the server.
+        """
+        if self.controlled is None:
+            return
+        self.command_time += dt
+        sampled = False
+        while self.command_time >= self.command_interval:
+            self.command_time -= self.command_interval
+            self.command_sequence += 1
+            self.commands.append((self.command_sequence,
+                                  self.controlled.get_command()))
+            sampled = True
+        if sampled:
+            del self.commands[:-255]
+            self.send(InputMessage(self.commands[0][0],
+                                   [flags for _, flags in self.commands]),
+                      self.connection)
+
+    def reconcile(self, message):
+        """
+        Reset the controlled object to its authoritative state and replay
+        the commands the server has not processed yet.
+        """
+        controlled = self.objects.get(message.id)
+        if controlled is None:
+            return
+        if controlled is not self.controlled:
+            if self.controlled is not None:
+                self.controlled.predicted = False
+            self.controlled = controlled
+            controlled.predicted = True
+            self.commands = []
+            self.command_sequence = message.sequence
+            self.mgr.send_broadcast('on_controlled', controlled)
+        self.commands = [(sequence, flags)
+                         for sequence, flags in self.commands
+                         if sequence > message.sequence]
+
+        predicted = get_position(controlled)
+        predicted = predicted[0], predicted[1]
+        apply_state(controlled, message.state)
+        for _, flags in self.commands:
+            controlled.simulate(flags, self.command_interval)
+        position = get_position(controlled)
+        self.prediction_error = math.hypot(position[0] - predicted[0],
+                                           position[1] - predicted[1])
+
+    def spawn(self, spawns):
+        """
+        Create the locally spawned objects of a spawn event.
+        """
+        object_service = self.mgr[GameObjectService]
+        for message in spawns:
+            obj = self.types[message.type](position=(message.x, message.y),
+                                           angle=message.angle,
+                                           scale=message.scale)
+            object_service.add_object(obj)
+
+    def apply(self, snapshot):
+        """
+        Synchronize the replicated objects with a snapshot.
+        """
+        object_service = self.mgr[GameObjectService]
+        for id in [id for id in self.objects if id not in snapshot]:
+            obj = self.objects.pop(id)
+            del self.ids[obj]
+            if obj is self.controlled:
+                self.controlled = None
+            object_service.remove_object(obj)
+
+        for id, (type, state) in snapshot.iteritems():
+            obj = self.objects.get(id)
+            if obj is not None and obj is self.controlled:
+                continue # predicted, see 'reconcile'
+
+            if obj is None:
+                cls = self.types[type]
+                obj = cls(**get_arguments(cls.schema.names[1:], state))
+                obj.id = id
+                self.objects[id] = obj
+                self.ids[obj] = id
+                object_service.add_object(obj)
+            else:
+                apply_state(obj, state)
+
+    def on_objects_removed(self, objects):
+        """
+        Forget the removed replicated objects, so they are recreated if
+        the server still has them. Objects of the replicated types which
+        were spawned locally are not known by id and are skipped.
+        """
+        for obj in objects:
+            id = self.ids.pop(obj, None)
+            if id is None:
+                continue
+            del self.objects[id]
+            if obj is self.controlled:
+                self.controlled = None
+
+
+def loopback_check(timeout=5.):
+    """
+    Replicate objects from a ReplicationServerService to a
+    ReplicationClientService over the loopback interface and check that
+    their creates, updates and deletes arrive, the later ones delta
+    compressed against the snapshot acknowledged by the client.
+    """
+    from engine.object import PhysicalObject
+    from engine.serialization import Schema, Quantized
+    from engine.service import ServiceManager
+
+    class Rock(PhysicalObject):
+        radius = 10
+        schema = Schema(PHYSICAL_OBJECT_SCHEMA.fields
+                        + [('scale', Quantized(0, 4, bits=8))])
+
+        def get_serial_state(self):
+            return PhysicalObject.get_serial_state(self) + (self.scale,)
+
+    def create_manager(service):
+        mgr = ServiceManager()
+        mgr += GameObjectService()
+        mgr += service
+        mgr.send_broadcast('on_init', mgr)
+        return mgr
+
+    server = ReplicationServerService([Rock], ('127.0.0.1', 0))
+    server_mgr = create_manager(server)
+    client = ReplicationClientService([Rock], server.address)
+    client_mgr = create_manager(client)
+
+    # keep the received snapshot messages
+    snapshots = []
+    receive = client.receive
+    def record():
+        messages = receive()
+        snapshots.extend(message for message, _ in messages
+                         if isinstance(message, SnapshotMessage))
+        return messages
+    client.receive = record
+
+    def run(condition, description):
+        end = time.time() + timeout
+        while not condition():
+            if time.time() > end:
+                raise AssertionError("timed out waiting for " + description)
+            server_mgr.send_broadcast('on_tick', server.interval)
+            client_mgr.send_broadcast('on_tick', server.interval)
+            time.sleep(0.005)
+
+    def replicated(rocks):
+        # the rocks arrived with their position and scale, nothing else
+        if len(client.objects) != len(rocks):
+            return False
+        for rock in rocks:
+            obj = client.objects.get(getattr(rock, 'id', None))
+            if (obj is None
+                or abs(obj.body.position[0] - rock.body.position[0]) > 0.2
+                or abs(obj.body.position[1] - rock.body.position[1]) > 0.2
+                or abs(obj.scale - rock.scale) > 0.02):
+                return False
+        return True
+
+    add_object = server_mgr[GameObjectService].add_object
+    try:
+        rocks = [add_object(Rock(position=(100., 200.), scale=0.5)),
+                 add_object(Rock(position=(300., 400.), scale=1.5))]
+        run(lambda: replicated(rocks), "the creates")
+        run(lambda: server.clients.values()[0].acked != NO_SNAPSHOT,
+            "the acknowledgement")
+        acked = len(snapshots)
+
+        rocks[0].body.position = (150., 250.)
+        server_mgr[GameObjectService].remove_object(rocks[1])
+        rocks[1:] = [add_object(Rock(position=(500., 600.), scale=2.))]
+        run(lambda: replicated(rocks), "the changes")
+
+        deltas = [message for message in snapshots[acked:]
+                  if message.baseline != NO_SNAPSHOT]
+        for name in ('creates', 'updates', 'deletes'):
+            if not any(getattr(message, name) for message in deltas):
+                raise AssertionError("no delta snapshot contained " + name)
+        print "loopback check passed, %d snapshots received" % len(snapshots)
+    finally:
+        server.close()
+        client.close()
+
+
+if __name__ == '__main__':
+    loopback_check()
@@ -0,0 +1,374 @@
+"""
+Schema driven binary serialization of game objects. A Schema is a list
+of (name, codec) fields. Fixed size fields are packed with one
+precompiled struct, variable sized fields (varints, strings) precede
+them. Decoding works on any buffer, including memoryviews, without
+copying the data.
+
+Run 'python -m engine.serialization' for a benchmark against pickle.
+"""
+import math
+import struct
+
+
+def encode_varint(value):
+    """
+    Encode a non negative integer with 7 bits per byte, the high bit
+    marking that more bytes follow.
+    """
+    parts = []
+    while value > 0x7f:
+        parts.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    parts.append(chr(value))
+    return ''.join(parts)
+
+
+def decode_varint(buffer, offset=0):
+    """
+    Decode a varint from the buffer at the offset. Returns the value and
+    the offset after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(buffer[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def skip_varint(buffer, offset=0):
+    """
+    Return the offset after the varint in the buffer at the offset,
+    without decoding it.
+    """
+    while buffer[offset] >= '\x80':
+        offset += 1
+    return offset + 1
+
+
+class Codec(object):
+    """
+    Abstract base class for field codecs. Fixed size codecs define the
+    struct 'format' of their raw value and convert values from and to
+    it, variable sized codecs implement 'encode' and 'decode'.
+    """
+    format = None
+
+    def to_raw(self, value):
+        return value
+
+    def from_raw(self, raw):
+        return raw
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, buffer, offset):
+        raise NotImplementedError
+
+    def skip(self, buffer, offset):
+        """
+        Return the offset after the encoded value at the offset. Variable
+        sized codecs override it to find the end without decoding.
+        """
+        return self.decode(buffer, offset)[1]
+
+
+class UInt8(Codec):
+    format = 'B'
+
+
+class UInt16(Codec):
+    format = 'H'
+
+
+class UInt32(Codec):
+    format = 'I'
+
+
+class Float32(Codec):
+    format = 'f'
+
+
+class Float64(Codec):
+    format = 'd'
+
+
+class Bool(Codec):
+    format = '?'
+
+
+class Quantized(Codec):
+    """
+    A float within [minimum, maximum] stored as an unsigned integer of
+    'bits' bits. Values outside of the range are clamped.
+    """
+
+    formats = {8: 'B', 16: 'H', 32: 'I'}
+
+    def __init__(self, minimum, maximum, bits=16):
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.steps = (1 << bits) - 1
+        self.scale = self.steps / (self.maximum - self.minimum)
+        self.format = self.formats[bits]
+
+    def to_raw(self, value):
+        raw = int(round((value - self.minimum) * self.scale))
+        return min(max(raw, 0), self.steps)
+
+    def from_raw(self, raw):
+        return self.minimum + raw / self.scale
+
+
+class Angle(Quantized):
+    """
+    An angle in radians, quantized over one full turn.
+    """
+
+    def __init__(self, bits=16):
+        Quantized.__init__(self, 0., 2 * math.pi, bits)
+
+    def to_raw(self, value):
+        return Quantized.to_raw(self, value % (2 * math.pi))
+
+
+class VarInt(Codec):
+    """
+    A non negative integer of variable length, see 'encode_varint'.
+    """
+
+    def encode(self, value):
+        return encode_varint(value)
+
+    def decode(self, buffer, offset):
+        return decode_varint(buffer, offset)
+
+    def skip(self, buffer, offset):
+        return skip_varint(buffer, offset)
+
+
+class SignedVarInt(VarInt):
+    """
+    An integer of variable length, zigzag encoded so that small
+    negative values stay short.
+    """
+
+    def encode(self, value):
+        return encode_varint((value << 1) ^ (value >> 63))
+
+    def decode(self, buffer, offset):
+        value, offset = decode_varint(buffer, offset)
+        return (value >> 1) ^ -(value & 1), offset
+
+
+class Reference(VarInt):
+    """
+    A reference to another object, stored as its id, 0 for None. The ids
+    are assigned by the user of the schema, e.g. the snapshots of the
+    GameObjectService, which converts the objects to ids and back.
+    """
+
+
+class String(Codec):
+    """
+    An unicode string, stored as UTF-8 with a varint length prefix.
+    """
+
+    def encode(self, value):
+        data = value.encode('utf-8')
+        return encode_varint(len(data)) + data
+
+    def decode(self, buffer, offset):
+        length, offset = decode_varint(buffer, offset)
+        end = offset + length
+        data = buffer[offset:end]
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return data.decode('utf-8'), end
+
+    def skip(self, buffer, offset):
+        length, offset = decode_varint(buffer, offset)
+        return offset + length
+
+
+class Schema(object):
+    """
+    The binary layout of a record of named fields. Values are passed and
+    returned as tuples in the order of the fields.
+    """
+
+    def __init__(self, fields):
+        """
+        Initializes the schema from a list of (name, codec) tuples.
+        """
+        self.fields = list(fields)
+        self.names = [name for name, _ in self.fields]
+        self.variable = [(index, codec) for index, (_, codec)
+                         in enumerate(self.fields) if codec.format is None]
+        self.fixed = [(index, codec) for index, (_, codec)
+                      in enumerate(self.fields) if codec.format is not None]
+        self.struct = struct.Struct('!' + ''.join(codec.format for _, codec
+                                                  in self.fixed))
+        self.size = self.struct.size if not self.variable else None
+        self.references = [index for index, (_, codec)
+                           in enumerate(self.fields)
+                           if isinstance(codec, Reference)]
+        # records of plain struct values are packed in one go
+        self.raw = self.size is not None and all(
+            codec.to_raw.im_func is Codec.to_raw.im_func
+            and codec.from_raw.im_func is Codec.from_raw.im_func
+            for _, codec in self.fields)
+
+    def pack(self, values):
+        """
+        Encode the values of one record.
+        """
+        data = self.struct.pack(*[codec.to_raw(values[index])
+                                  for index, codec in self.fixed])
+        if not self.variable:
+            return data
+        parts = [codec.encode(values[index])
+                 for index, codec in self.variable]
+        parts.append(data)
+        return ''.join(parts)
+
+    def unpack_from(self, buffer, offset=0):
+        """
+        Decode one record from the buffer at the offset. Returns the
+        values and the offset after the record.
+        """
+        values = [None] * len(self.fields)
+        for index, codec in self.variable:
+            values[index], offset = codec.decode(buffer, offset)
+        raw = self.struct.unpack_from(buffer, offset)
+        for (index, codec), value in zip(self.fixed, raw):
+            values[index] = codec.from_raw(value)
+        return tuple(values), offset + self.struct.size
+
+    def unpack(self, data):
+        return self.unpack_from(data)[0]
+
+    def pack_many(self, records):
+        """
+        Encode a sequence of records, prefixed by their number.
+        """
+        if self.raw and records:
+            values = [value for record in records for value in record]
+            return (encode_varint(len(records))
+                    + struct.pack('!' + self.struct.format[1:] * len(records),
+                                  *values))
+        return encode_varint(len(records)) + ''.join(self.pack(values)
+                                                     for values in records)
+
+    def unpack_many(self, buffer, offset=0):
+        """
+        Decode records encoded with 'pack_many'. Returns a list of value
+        tuples and the offset after the records.
+        """
+        count, offset = decode_varint(buffer, offset)
+        if self.raw:
+            bulk = struct.Struct('!' + self.struct.format[1:] * count)
+            values = iter(bulk.unpack_from(buffer, offset))
+            return (zip(*[values] * len(self.fields)),
+                    offset + bulk.size)
+        records = []
+        for _ in range(count):
+            values, offset = self.unpack_from(buffer, offset)
+            records.append(values)
+        return records, offset
+
+    def split(self, buffer, offset=0):
+        """
+        Split records encoded with 'pack_many' into memoryviews of the
+        single records, without copying or decoding them. Variable sized
+        fields are skipped, e.g. only the length of a string is read.
+        """
+        view = memoryview(buffer)
+        count, offset = decode_varint(buffer, offset)
+        records = []
+        if self.size is not None:
+            size = self.size
+            for start in xrange(offset, offset + count * size, size):
+                records.append(view[start:start + size])
+            return records
+        skips = [codec.skip for _, codec in self.variable]
+        size = self.struct.size
+        for _ in xrange(count):
+            start = offset
+            for skip in skips:
+                offset = skip(buffer, offset)
+            offset += size
+            records.append(view[start:offset])
+        return records
+
+
+# default quantization of the state of game objects
+POSITION = Quantized(-4096, 4096)
+VELOCITY = Quantized(-2048, 2048)
+ANGLE = Angle()
+
+OBJECT_SCHEMA = Schema([('id', VarInt()),
+                        ('x', POSITION), ('y', POSITION),
+                        ('angle', ANGLE)])
+
+PHYSICAL_OBJECT_SCHEMA = Schema([('id', VarInt()),
+                                 ('x', POSITION), ('y', POSITION),
+                                 ('velocity_x', VELOCITY),
+                                 ('velocity_y', VELOCITY),
+                                 ('angle', ANGLE)])
+
+# lossless state of physical bodies, e.g. for local snapshots
+BODY_STATE_FIELDS = [('x', Float64()), ('y', Float64()),
+                     ('velocity_x', Float64()), ('velocity_y', Float64()),
+                     ('angle', Float64()), ('angular_velocity', Float64())]
+
+
+def benchmark(count=1000, repeat=20):
+    """
+    Compare size and encode/decode time of the physical object schema
+    against pickle, for 'count' object states.
+    """
+    import cPickle as pickle
+    import random
+    import timeit
+
+    records = [(index,
+                random.uniform(0, 700), random.uniform(0, 700),
+                random.uniform(-350, 350), random.uniform(-350, 350),
+                random.uniform(0, 2 * math.pi))
+               for index in range(count)]
+    schema = PHYSICAL_OBJECT_SCHEMA
+
+    packed = schema.pack_many(records)
+    pickled = pickle.dumps(records, pickle.HIGHEST_PROTOCOL)
+
+    def time(function):
+        return min(timeit.repeat(function, number=1, repeat=repeat))
+
+    results = [
+        ('schema', len(packed),
+         time(lambda: schema.pack_many(records)),
+         time(lambda: schema.unpack_many(packed))),
+        ('schema (split)', len(packed),
+         time(lambda: schema.pack_many(records)),
+         time(lambda: schema.split(packed))),
+        ('pickle', len(pickled),
+         time(lambda: pickle.dumps(records, pickle.HIGHEST_PROTOCOL)),
+         time(lambda: pickle.loads(pickled))),
+    ]
+
+    print "%d object states, best of %d runs" % (count, repeat)
+    print "%-16s %10s %12s %12s" % ('format', 'bytes', 'encode ms',
+                                    'decode ms')
+    for name, size, encode, decode in results:
+        print "%-16s %10d %12.3f %12.3f" % (name, size, encode * 1000,
+                                            decode * 1000)
+
+
+if __name__ == '__main__':
+    benchmark()
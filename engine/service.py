@@ -1,8 +1,14 @@
+import gc
 import math
+import copy_reg
+import cPickle as pickle
+from cStringIO import StringIO
 import pymunk
 import pyglet
 import engine
-from engine.graphics import draw_line_loop, draw_circle
+from engine.graphics import DebugDraw, Camera, CameraGroup
+from engine.spatial import SpatialGrid
+from engine.event import EventBus, subscribe
 
 
 class ServiceManager():
@@ -18,6 +24,8 @@ class ServiceManager():
         self.__services = {}
         ServiceManager.instance = self
         self.broadcasts = {}
+        self.events = EventBus()
+        self.restoring = False
 
     def register_service(self, service_class, *args, **kwargs):
         """
@@ -26,6 +34,7 @@ class ServiceManager():
         service = service_class(*args, **kwargs)
         service.mgr = self
         self.__services[service_class] = service
+        self.events.subscribe_service(service)
 
     def add_service(self, service):
         self +=service
@@ -38,6 +47,7 @@ class ServiceManager():
 
         service.mgr = self
         self.__services[cls] = service
+        self.events.subscribe_service(service)
         return self
 
     def __getitem__(self, service_class):
@@ -74,6 +84,77 @@ class ServiceManager():
         for handler in self.broadcasts[event]:
             handler(*args, **kwargs)
 
+    def snapshot(self):
+        """
+        Capture the state of all services (see 'AbstractService.get_state')
+        as a binary string for 'restore'. The game objects are stored
+        compactly by the GameObjectService (see 'ObjectSnapshot'), the
+        other states are pickled with references to game objects stored
+        as their ids and references to services as their class.
+        """
+        objects = self[GameObjectService].get_state()
+        ids = objects.get_ids()
+        states = {}
+        for service_class, service in self.__services.iteritems():
+            if service_class is GameObjectService:
+                continue
+            state = service.get_state()
+            if state is not None:
+                states[service_class] = state
+        with _no_gc():
+            output = StringIO()
+            pickler = pickle.Pickler(output, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = lambda obj: ids.get(id(obj))
+            pickler.dump(states)
+            return pickle.dumps((objects, output.getvalue()),
+                                pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, data):
+        """
+        Restore a snapshot. The game objects are restored first, reusing
+        the current objects where possible, then the other services in
+        the order of their priority. While restoring, 'restoring' is True.
+        """
+        self.restoring = True
+        try:
+            with _no_gc():
+                objects, data = pickle.loads(data)
+                self[GameObjectService].set_state(objects)
+                self.events.flush()
+                unpickler = pickle.Unpickler(StringIO(data))
+                unpickler.persistent_load = objects.get_object
+                states = unpickler.load()
+            for service in sorted(self.__services.values(),
+                                  key=lambda service: service.priority):
+                if service.__class__ in states:
+                    service.set_state(states[service.__class__])
+        finally:
+            self.restoring = False
+
+class _no_gc(object):
+    """
+    Context manager to pause the cyclic garbage collector, which would
+    otherwise run many times while (un)pickling thousands of objects.
+    """
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            gc.enable()
+
+def get_service(service_class):
+    """
+    Helper function to unpickle a reference to a service.
+    """
+    return ServiceManager.instance[service_class]
+
+def _reduce_vector(vector):
+    return pymunk.Vec2d, (vector.x, vector.y)
+
+copy_reg.pickle(pymunk.Vec2d, _reduce_vector)
+
 class AbstractService(object):
     """
     An abstract base class for all game services.
@@ -86,10 +167,132 @@ class AbstractService(object):
     def on_init(self, mgr):
         pass
 
+    def __reduce__(self):
+        # services are pickled as references to the registered ones
+        return get_service, (self.__class__,)
+
+    def get_state(self):
+        """
+        Return the picklable state of the service for snapshots or None
+        if the service has none.
+        """
+        return None
+
+    def set_state(self, state):
+        """
+        Restore a state returned by 'get_state'.
+        """
+        pass
+
+class ObjectSnapshot(object):
+    """
+    The compact state of game objects, as stored in the snapshots of the
+    ServiceManager: the objects are grouped by their class and
+    'snapshot_arguments', the states of each group are packed with the
+    snapshot schema of the class. The objects are numbered from 1 in this
+    order; references to objects, also from the states of other services,
+    are stored as these ids.
+    """
+
+    def __init__(self, objects):
+        groups = _group_objects(objects).items()
+        self.objects = []
+        for _, members in groups:
+            self.objects.extend(members)
+        self.ids = None
+        ids = self.get_ids()
+
+        self.groups = []
+        for (cls, arguments), members in groups:
+            schema = cls.get_snapshot_schema()
+            states = cls.get_states(members)
+            if schema.references:
+                states = [_replace_references(state, schema.references,
+                                              lambda obj: ids.get(id(obj), 0))
+                          for state in states]
+            self.groups.append((cls, arguments, len(members),
+                                schema.pack_many(states)))
+
+    def __getstate__(self):
+        return self.groups
+
+    def __setstate__(self, groups):
+        self.groups = groups
+        self.objects = None
+        self.ids = None
+
+    def get_ids(self):
+        """
+        Return a dict of the ids of the objects by their identity.
+        """
+        if self.ids is None:
+            self.ids = dict((id(obj), index)
+                            for index, obj in enumerate(self.objects, 1))
+        return self.ids
+
+    def get_object(self, object_id):
+        return self.objects[object_id - 1]
+
+    def apply(self, objects):
+        """
+        Set the states of the snapshot to the objects, one for each state
+        in the order of the groups.
+        """
+        self.objects = objects
+        self.ids = None
+        get_object = lambda object_id: (objects[object_id - 1] if object_id
+                                        else None)
+        offset = 0
+        for cls, _, count, data in self.groups:
+            schema = cls.get_snapshot_schema()
+            states = schema.unpack_many(data)[0]
+            if schema.references:
+                states = [_replace_references(state, schema.references,
+                                              get_object)
+                          for state in states]
+            cls.set_states(objects[offset:offset + count], states)
+            offset += count
+
+
+def _group_objects(objects):
+    """
+    Helper function to group objects by their class and their snapshot
+    arguments (see 'GameObject.get_snapshot_arguments'). Returns a dict
+    of lists of objects by (class, arguments).
+    """
+    classes = {}
+    for obj in objects:
+        classes.setdefault(obj.__class__, []).append(obj)
+    groups = {}
+    for cls, members in classes.iteritems():
+        names = cls.snapshot_arguments
+        if not names:
+            groups[(cls, ())] = members
+            continue
+        for obj in members:
+            values = obj.__dict__
+            key = (cls, tuple([values[name] for name in names]))
+            groups.setdefault(key, []).append(obj)
+    return groups
+
+
+def _replace_references(state, indices, convert):
+    """
+    Helper function to convert the references at the indices of a state.
+    """
+    state = list(state)
+    for index in indices:
+        state[index] = convert(state[index])
+    return tuple(state)
+
+
 class GameObjectService(AbstractService):
     """
     GameObjectServices manage the insertion and extraction of object
     from and to the game.
+    Additions and removals are published as 'object_added' and
+    'object_removed' events on the EventBus of the service manager and
+    are delivered in batches at the beginning of the next tick.
     """
 
     def __init__(self):
@@ -97,8 +300,11 @@ class GameObjectService(AbstractService):
         Initializes the GameObjectService.
         """
         self.objects = []
+        self.objects_to_add = []
         self.objects_to_remove = set()
         self.debug_draw = True
+        # updates the objects in place of 'on_tick', e.g. the WorldService
+        self.partition = None
 
     def add_object_class(self, cls, *args, **kwargs):
         """
@@ -110,45 +316,100 @@ class GameObjectService(AbstractService):
 
     def add_object(self, obj):
         """
-        Adds a GameObject to the active GameObjects. Sends a broadcast
-        message 'on_object_added' of the addition of the object to all
-        other services.
+        Adds a GameObject to the active GameObjects. Publishes an
+        'object_added' event of the addition of the object to all
+        interested services.
+
+        Objects are added in the next update
         """
         obj.object_service = self
         obj.on_added()
-        self.objects.append(obj)
-        self.mgr.send_broadcast('on_object_added', obj)
+        self.objects_to_add.append(obj)
+        self.mgr.events.publish('object_added', obj)
         return obj
 
     def remove_object(self, obj):
         """
-        Removes a game object from the game. Sends a broadcast message
-        'on_object_removed' to all other services.
+        Removes a game object from the game. Publishes an 'object_removed'
+        event to all interested services. If the addition of the object
+        was not delivered yet, neither event is delivered.
         
         UPDATE: objects are removed in the next update
         """
-        if obj not in self.objects_to_remove:
+        if obj in self.objects_to_add:
+            obj.on_removed()
+            self.objects_to_add.remove(obj)
+            self.mgr.events.retract('object_added', obj)
+        elif obj not in self.objects_to_remove:
             obj.on_removed()
-            self.mgr.send_broadcast('on_object_removed', obj)
+            self.mgr.events.publish('object_removed', obj)
             self.objects_to_remove.add(obj)
 
     def clear(self):
         """
         Removes all objects currently registered.
         """
-        for obj in self.objects:
+        for obj in self.objects + self.objects_to_add:
             self.remove_object(obj)
 
+    def get_state(self):
+        removed = self.objects_to_remove
+        return ObjectSnapshot([obj for obj in self.objects + self.objects_to_add
+                               if obj not in removed])
+
+    def set_state(self, snapshot):
+        """
+        Apply an ObjectSnapshot. The current objects of the same class and
+        'snapshot_arguments' take the restored states, the others are
+        removed. The missing objects are created and added in bulk. They
+        get their state from the snapshot, so 'on_added' is not called.
+        """
+        removed = self.objects_to_remove
+        available = _group_objects([obj for obj
+                                    in self.objects + self.objects_to_add
+                                    if obj not in removed])
+
+        objects = []
+        created = []
+        for cls, arguments, count, _ in snapshot.groups:
+            reused = available.get((cls, arguments), [])
+            start = max(len(reused) - count, 0)
+            objects.extend(reused[start:])
+            missing = count - (len(reused) - start)
+            del reused[start:]
+            kwargs = dict(zip(cls.snapshot_arguments, arguments))
+            new = cls.create_many(missing, kwargs)
+            objects.extend(new)
+            created.extend(new)
+
+        for reused in available.itervalues():
+            for obj in reused:
+                self.remove_object(obj)
+
+        snapshot.apply(objects)
+        for obj in created:
+            obj.object_service = self
+            self.mgr.events.publish('object_added', obj)
+        self.objects_to_add.extend(created)
 
     def on_tick(self, dt):
         """
-        This version of on_tick sends the 'update' message to all
-        active objects in the game.
+        This version of on_tick delivers the pending events and sends
+        the 'update' message to all active objects in the game.
         """
-        for obj in self.objects_to_remove:
-            self.objects.remove(obj)
+        self.mgr.events.flush()
+
+        if self.objects_to_remove:
+            removed = self.objects_to_remove
+            self.objects = [obj for obj in self.objects if obj not in removed]
+            self.objects_to_remove = set()
 
-        self.objects_to_remove.clear()
+        self.objects.extend(self.objects_to_add)
+        del self.objects_to_add[:]
+
+        if self.partition is not None:
+            self.partition.update(self.objects, dt)
+            return
 
         for obj in self.objects:
             obj.update(dt)
@@ -157,15 +418,20 @@ class GameObjectService(AbstractService):
         if not self.debug_draw:
             return
 
+        debug = self.mgr[DebugDrawService]
         for obj in self.objects:
-            obj.debug_draw()
+            obj.debug_draw(debug)
 
 
 class PhysicsService(AbstractService):
     """
     The PhysicsService is responsible to hold and update the physical
     state of all objects with a physical component registered.
-    It also updates the graphical position and rotation of the objects.
+    It also updates the graphical position and rotation of the objects,
+    unless 'sync_sprites' is disabled (e.g. on a headless server).
+    With 'collisions' disabled (e.g. on the clients of a server, which
+    owns the game), objects pass through each other and their
+    'on_collision' handlers are never called.
     """
     priority = 10
 
@@ -177,6 +443,10 @@ class PhysicsService(AbstractService):
         self.space = pymunk.Space()
         self.physical_objects = []
         self.bounds = kwargs.get('bounds', None)
+        # disabled when another service wraps the objects around
+        self.wrap_around = self.bounds is not None
+        self.sync_sprites = kwargs.get('sync_sprites', True)
+        self.collisions = kwargs.get('collisions', True)
 
         self.space.set_default_collision_handler(self.on_collision, None, None, None)
 
@@ -190,7 +460,11 @@ class PhysicsService(AbstractService):
         """
         self.space.step(dt)
         for obj in self.physical_objects:
-            self._check_wrap_around(obj)
+            if self.wrap_around:
+                self.check_wrap_around(obj)
+            if not self.sync_sprites or not obj.sprite.visible:
+                # culled sprites are synchronized when they are shown
+                continue
             obj.sprite.position = obj.body.position
             obj.sprite.rotation = -math.degrees(obj.body.angle)
 
@@ -204,41 +478,50 @@ class PhysicsService(AbstractService):
         if not self.debug_draw:
             return
 
-        pyglet.gl.glColor4f(1.0, 0, 0, 1.0)
+        debug = self.mgr[DebugDrawService]
+        color = (1.0, 0, 0, 1.0)
+        positions = []
+        radii = []
         for shape in self.space.shapes:
             if isinstance(shape, pymunk.Poly):
-                draw_line_loop(shape.get_points())
+                debug.line_loop(shape.get_points(), color)
             elif isinstance(shape, pymunk.Circle):
-                draw_circle(shape.body.position, shape.radius)
+                position = shape.body.position
+                positions.append((position.x, position.y))
+                radii.append(shape.radius)
+        debug.circles(positions, radii, color)
 
-    def on_object_added(self, obj):
+    @subscribe('object_added', components=('body', 'shape'))
+    def on_objects_added(self, objects):
         """
-        Message handler for 'on_object_added' messages. If the object
-        contains a body and a shape, it is added to the list of physical
-        objects.
+        Event handler for 'object_added' events. All objects containing
+        a body and a shape are added to the list of physical objects.
         """
-        if hasattr(obj, 'shape') and hasattr(obj, 'body'):
+        for obj in objects:
             self.physical_objects.append(obj)
             self.space.add(obj.shape, obj.body)
 
-    def on_object_removed(self, obj):
+    @subscribe('object_removed', components=('body', 'shape'))
+    def on_objects_removed(self, objects):
         """
-        Message handler for 'on_object_removed' messages. Removes objects 
+        Event handler for 'object_removed' events. Removes objects 
         and shapes from the space.
         """
-        if obj in self.physical_objects:
-            self.physical_objects.remove(obj)
+        removed = set(objects)
+        self.physical_objects = [obj for obj in self.physical_objects
+                                 if obj not in removed]
+        for obj in objects:
             self.space.remove(obj.shape, obj.body)
 
-    def _check_wrap_around(self, obj):
+    def check_wrap_around(self, obj):
         """
         Provides the 'wrap around' functionality.
         TODO: outsource this to an own service
         maybe create a WrapAroundPhysicsService
         """
-        width = self.bounds[2] - self.bounds[0]
-        height = self.bounds[3] - self.bounds[1]
         if self.bounds is not None:
+            width = self.bounds[2] - self.bounds[0]
+            height = self.bounds[3] - self.bounds[1]
             while obj.body.position[0] < self.bounds[0]:
                 obj.body.position[0] += width
             while obj.body.position[0] > self.bounds[2]:
@@ -250,8 +533,11 @@ class PhysicsService(AbstractService):
 
     def on_collision(self, space, arbiter, *args, **kwargs):
         """
-        TODO document
+        Calls the 'on_collision' handlers of both objects. The collision
+        is only processed if both handlers return True.
         """
+        if not self.collisions:
+            return False
         first = arbiter.shapes[0].body.object
         second = arbiter.shapes[1].body.object
         ret = (first.on_collision(second, arbiter),
@@ -295,40 +581,126 @@ class GraphicsService(AbstractService):
     """
     The GraphicsService is responsible for drawing objects and managing 
     graphical representations of the game objects.
+    With a 'view_size', the display groups are drawn through a camera
+    of that size and the sprites outside of its view are hidden. The
+    sprites are looked up in a spatial grid, so only the sprites
+    entering or leaving the view are touched when drawing. In a world
+    wrapping around (see 'Camera.world_size'), the visible sprites are
+    placed by the camera, next to the view.
     """
     priority = 1
 
-    def __init__(self):
+    def __init__(self, view_size=None, cell_size=128., margin=100.):
         """
-        Initializes the GraphicsService.
+        Initializes the GraphicsService. Sprites are culled when their
+        position is more than 'margin' outside of the view.
         """
         self.batch = pyglet.graphics.Batch()
         self.groups = {}
+        self.screen_groups = {}
         self.debug_draw = False
 
+        self.camera = None
+        self.camera_group = None
+        if view_size is not None:
+            self.camera = Camera(view_size)
+            self.camera_group = CameraGroup(self.camera)
+        self.margin = margin
+        self.grid = SpatialGrid(cell_size)
+        self.moving = set()
+        self.visible = set()
+
         self.fps = pyglet.clock.ClockDisplay()
 
     def get_display_group(self, index):
         if index in self.groups:
             return self.groups[index]
         else:
-            group = pyglet.graphics.OrderedGroup(index)
+            group = pyglet.graphics.OrderedGroup(index, self.camera_group)
             self.groups[index] = group
             return group
 
+    def get_screen_group(self, index):
+        """
+        Return a display group drawn in window coordinates, regardless
+        of the camera, e.g. for the HUD.
+        """
+        if self.camera_group is None:
+            return self.get_display_group(index)
+        if index not in self.screen_groups:
+            self.screen_groups[index] = pyglet.graphics.OrderedGroup(index)
+        return self.screen_groups[index]
+
     def on_draw(self):
         """
         Draws all objects registerd in the batch.
         """
+        if self.camera is not None:
+            self._cull()
 
         self.batch.draw()
         self.fps.draw()
 
-    def on_object_added(self, obj):
+    def _cull(self):
+        """
+        Private method to show the sprites within the view of the camera
+        and to hide the ones that left it.
+        """
+        grid = self.grid
+        camera = self.camera
+        for obj in self.moving:
+            position = obj.body.position
+            grid.move(obj, position[0], position[1])
+
+        visible = set()
+        for rect in camera.get_rects(self.margin):
+            visible.update(grid.query_rect(*rect))
+        for obj in self.visible - visible:
+            obj.sprite.visible = False
+        if camera.world_size is not None:
+            # the sprites are drawn at the copies of their positions next
+            # to the view, so they are placed every frame
+            for obj in visible:
+                if obj in self.moving:
+                    obj.sprite.position = camera.place(obj.body.position)
+                    obj.sprite.rotation = -math.degrees(obj.body.angle)
+                else:
+                    obj.sprite.position = camera.place(obj.position)
+        else:
+            for obj in visible - self.visible:
+                if obj in self.moving:
+                    obj.sprite.position = obj.body.position
+                    obj.sprite.rotation = -math.degrees(obj.body.angle)
+        for obj in visible - self.visible:
+            obj.sprite.visible = True
+        self.visible = visible
+
+    @subscribe('object_added', components=('image_path', 'animation_path'))
+    def on_objects_added(self, objects):
+        """
+        Adds graphical objects to the drawing batch.
+        """
+        for obj in objects:
+            self._create_sprite(obj)
+            if self.camera is None or obj.screen_space:
+                continue
+            # hidden until the next culling finds it within the view
+            obj.sprite.visible = False
+            if hasattr(obj, 'body'):
+                self.moving.add(obj)
+                position = obj.body.position
+            else:
+                position = obj.sprite.position
+            self.grid.insert(obj, position[0], position[1])
+
+    def _create_sprite(self, obj):
         """
-        Adds an object to the drawing batch.
+        Creates the sprite of a graphical object.
         """
-        group = self.get_display_group(obj.group_index)
+        if obj.screen_space:
+            group = self.get_screen_group(obj.group_index)
+        else:
+            group = self.get_display_group(obj.group_index)
 
         if obj.image_path is not None:
             image = engine.resource.image(obj.image_path)
@@ -361,24 +733,54 @@ class GraphicsService(AbstractService):
         obj.sprite.rotation = obj.angle
         obj.sprite.scale = obj.scale
 
-    def on_object_removed(self, obj):
+    @subscribe('object_removed', components=('image_path', 'animation_path'))
+    def on_objects_removed(self, objects):
         """
-        Removes an object from the drawing batch.
+        Removes graphical objects from the drawing batch.
         """
-        obj.sprite.delete()
-        pass # TODO, or maybe not :)
+        for obj in objects:
+            obj.sprite.delete()
+            if obj in self.grid:
+                self.grid.remove(obj)
+                self.moving.discard(obj)
+                self.visible.discard(obj)
+
+class DebugDrawService(AbstractService, DebugDraw):
+    """
+    The DebugDrawService collects the debug lines and circles the other
+    services draw in 'on_draw' and draws them batched after them.
+    """
+    # draw after all other services collected their primitives
+    priority = 100
+
+    def __init__(self):
+        DebugDraw.__init__(self)
+
+    def on_draw(self):
+        camera = self.mgr[GraphicsService].camera
+        if camera is None:
+            self.draw()
+            return
+        camera.apply()
+        self.draw()
+        camera.restore()
+
 
 class InputService(AbstractService):
     """
     Service for gathering and redirecting input signals.
+    Without a window, key events can be fed to 'on_key_press' and
+    'on_key_release' directly, e.g. when replaying a recording.
     """
-    def __init__(self, window):
+    def __init__(self, window=None):
         """
         Initializes the service and sets up the window handlers.
         """
         self.input_handlers = {}
-        window.set_handler('on_key_press', self.on_key_press)
-        window.set_handler('on_key_release', self.on_key_release)
+        self.listeners = []
+        if window is not None:
+            window.set_handler('on_key_press', self.on_key_press)
+            window.set_handler('on_key_release', self.on_key_release)
 
         """
         @window.event
@@ -395,6 +797,9 @@ class InputService(AbstractService):
         if key not in self.input_handlers:
             return
 
+        for listener in self.listeners:
+            listener(key, modifiers, True)
+
         obj, handler = self.input_handlers[key]
         if handler is not None:
             if callable(getattr(obj, handler)):
@@ -413,6 +818,9 @@ class InputService(AbstractService):
         if key not in self.input_handlers:
             return
 
+        for listener in self.listeners:
+            listener(key, modifiers, False)
+
         obj, handler = self.input_handlers[key]
         if handler is not None:
             if callable(getattr(obj, handler)):
@@ -430,6 +838,13 @@ class InputService(AbstractService):
         """
         self.input_handlers[key] = (obj, handler)
 
+    def add_listener(self, listener):
+        """
+        Register a function that is called with (key, modifiers, pressed)
+        for every key event dispatched to an input handler.
+        """
+        self.listeners.append(listener)
+
 class ResourceService(AbstractService):
     """
     Service for handling (loading/unloading) resources (images, sounds, 
@@ -549,3 +964,15 @@ class MessageService(AbstractService):
                 self.queue.remove(msg)
             else:
                 break
+
+    def get_state(self):
+        return (self.timestamp,
+                [(msg.receivers, msg.message, msg.timestamp, msg.args,
+                  msg.kwargs) for msg in self.queue])
+
+    def set_state(self, state):
+        self.timestamp, messages = state
+        self.queue = [MessageService.Message(receivers, message, timestamp,
+                                             *args, **kwargs)
+                      for receivers, message, timestamp, args, kwargs
+                      in messages]
@@ -0,0 +1,105 @@
+import math
+
+
+class SpatialGrid(object):
+    """
+    A uniform grid to look up keys (e.g. object IDs) by their position.
+    Each key is stored in the cell containing its position, so queries
+    only need to look at the cells overlapping the queried area.
+    """
+
+    def __init__(self, cell_size=100.):
+        """
+        Initializes an empty grid with square cells of 'cell_size'.
+        """
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.locations = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def cell(self, x, y):
+        """
+        Return the index of the cell containing the position.
+        """
+        return (int(math.floor(x / self.cell_size)),
+                int(math.floor(y / self.cell_size)))
+
+    def insert(self, key, x, y):
+        cell = self.cell(x, y)
+        self.cells.setdefault(cell, {})[key] = (x, y)
+        self.locations[key] = cell
+
+    def remove(self, key):
+        cell = self.locations.pop(key)
+        keys = self.cells[cell]
+        del keys[key]
+        if not keys:
+            del self.cells[cell]
+
+    def move(self, key, x, y):
+        """
+        Update the position of a key. Returns True if the key changed
+        its cell.
+        """
+        cell = self.cell(x, y)
+        old = self.locations.get(key)
+        if old == cell:
+            self.cells[cell][key] = (x, y)
+            return False
+        if old is not None:
+            self.remove(key)
+        self.insert(key, x, y)
+        return True
+
+    def clear(self):
+        self.cells.clear()
+        self.locations.clear()
+
+    def position(self, key):
+        return self.cells[self.locations[key]][key]
+
+    def cells_in_rect(self, left, bottom, right, top):
+        """
+        Generator for the indices of all cells overlapping a rectangle.
+        """
+        x0, y0 = self.cell(left, bottom)
+        x1, y1 = self.cell(right, top)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield x, y
+
+    def query_rect(self, left, bottom, right, top):
+        """
+        Return all keys with a position inside of the rectangle.
+        """
+        result = []
+        for cell in self.cells_in_rect(left, bottom, right, top):
+            keys = self.cells.get(cell)
+            if keys is None:
+                continue
+            for key, (x, y) in keys.iteritems():
+                if left <= x <= right and bottom <= y <= top:
+                    result.append(key)
+        return result
+
+    def query_radius(self, x, y, radius):
+        """
+        Return a list of (key, distance) tuples for all keys within the
+        radius around the position.
+        """
+        result = []
+        for cell in self.cells_in_rect(x - radius, y - radius,
+                                       x + radius, y + radius):
+            keys = self.cells.get(cell)
+            if keys is None:
+                continue
+            for key, (kx, ky) in keys.iteritems():
+                distance = math.hypot(kx - x, ky - y)
+                if distance <= radius:
+                    result.append((key, distance))
+        return result
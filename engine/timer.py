@@ -0,0 +1,148 @@
+import numpy
+from engine.service import AbstractService
+
+
+class TimerService(AbstractService):
+    """
+    Service for countdown timers like lifetimes and cooldowns of game
+    objects. The remaining times of all timers are stored in one
+    contiguous array that is decremented with a single subtraction per
+    tick. Callbacks are only called for the timers that expired.
+    """
+
+    priority = 3
+
+    def __init__(self, capacity=256):
+        """
+        Initializes the TimerService with space for 'capacity' timers.
+        The storage grows automatically.
+        """
+        self.remaining = numpy.zeros(capacity)
+        self.active = numpy.zeros(capacity, dtype=bool)
+        self.allocated = numpy.zeros(capacity, dtype=bool)
+        self.callbacks = [None] * capacity
+        self.intervals = [None] * capacity
+        self.free = range(capacity - 1, -1, -1)
+        # handles cancelled during on_tick, released after the callbacks
+        self.released = None
+
+    def start(self, duration, callback=None, interval=None):
+        """
+        Start a new timer and return its handle. The callback is called
+        when the timer expires. If an interval is given, the timer is
+        restarted with it after expiring.
+        """
+        if not self.free:
+            self._grow()
+        handle = self.free.pop()
+        self.allocated[handle] = True
+        self.remaining[handle] = duration
+        self.active[handle] = True
+        self.callbacks[handle] = callback
+        self.intervals[handle] = interval
+        return handle
+
+    def reset(self, handle, duration):
+        """
+        Restart a timer with a new duration.
+        """
+        self.remaining[handle] = duration
+        self.active[handle] = True
+
+    def cancel(self, handle):
+        """
+        Stop a timer and release its handle. Handles which were already
+        released are ignored. The handles cancelled by callbacks are only
+        reused after all expired timers of the tick were processed.
+        """
+        if not self.allocated[handle]:
+            return
+        self.allocated[handle] = False
+        self.active[handle] = False
+        self.callbacks[handle] = None
+        self.intervals[handle] = None
+        if self.released is not None:
+            self.released.append(handle)
+        else:
+            self.free.append(handle)
+
+    def get_remaining(self, handle):
+        """
+        Return the remaining time of a timer, which is never negative.
+        """
+        return max(0., float(self.remaining[handle]))
+
+    def is_expired(self, handle):
+        """
+        Check whether or not a timer has run out.
+        """
+        return self.remaining[handle] <= 0.
+
+    def on_tick(self, dt):
+        """
+        Decrements all timers and calls the callbacks of the timers that
+        expired in this tick.
+        """
+        self.remaining -= dt
+        expired = numpy.flatnonzero(self.active & (self.remaining <= 0.))
+        self.released = []
+        try:
+            for handle in expired:
+                # earlier callbacks may have cancelled or reset the timer
+                if self.active[handle] and self.remaining[handle] <= 0.:
+                    self._expire(handle)
+        finally:
+            self.free.extend(self.released)
+            self.released = None
+
+    def _expire(self, handle):
+        """
+        Private method to restart or stop an expired timer and call its
+        callback.
+        """
+        callback = self.callbacks[handle]
+        interval = self.intervals[handle]
+        if interval is not None:
+            self.remaining[handle] += interval
+        else:
+            self.active[handle] = False
+        if callback is not None:
+            callback()
+
+    def get_state(self):
+        """
+        Return the state of all timers. Callbacks are stored as pairs of
+        object and method name, as bound methods can not be pickled.
+        """
+        callbacks = [(callback.im_self, callback.__name__)
+                     if callback is not None else None
+                     for callback in self.callbacks]
+        return (self.remaining.copy(), self.active.copy(), callbacks,
+                list(self.intervals), list(self.free))
+
+    def set_state(self, state):
+        remaining, active, callbacks, intervals, free = state
+        self.remaining = remaining.copy()
+        self.active = active.copy()
+        self.callbacks = [getattr(callback[0], callback[1])
+                          if callback is not None else None
+                          for callback in callbacks]
+        self.intervals = list(intervals)
+        self.free = list(free)
+        self.allocated = numpy.ones(len(self.remaining), dtype=bool)
+        self.allocated[self.free] = False
+
+    def _grow(self):
+        """
+        Private method to double the capacity of the timer storage.
+        """
+        capacity = len(self.remaining)
+        self.remaining = numpy.concatenate((self.remaining,
+                                            numpy.zeros(capacity)))
+        self.active = numpy.concatenate((self.active,
+                                         numpy.zeros(capacity, dtype=bool)))
+        self.allocated = numpy.concatenate((self.allocated,
+                                            numpy.zeros(capacity, dtype=bool)))
+        self.callbacks.extend([None] * capacity)
+        self.intervals.extend([None] * capacity)
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
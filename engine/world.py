@@ -0,0 +1,176 @@
+"""
+Game worlds larger than the window. The world is partitioned into
+square chunks: the objects in the chunks around the followed objects
+(e.g. the ship of the player) are updated every tick, the objects in
+distant chunks only every few ticks with the time passed since. The
+world wraps around at its edges: all physical objects are wrapped into
+it after each physics step and the camera shows the objects across the
+edges.
+"""
+import collections
+import math
+from engine.service import (
+    AbstractService, GameObjectService, GraphicsService, PhysicsService
+)
+from engine.spatial import SpatialGrid
+from engine.event import subscribe
+
+
+def _get_position(obj):
+    """
+    Return the position of a physical or graphical object, or None if
+    it has none.
+    """
+    if hasattr(obj, 'body'):
+        return obj.body.position
+    if hasattr(obj, 'position'):
+        return obj.position
+    return None
+
+
+class WorldService(AbstractService):
+    """
+    Service partitioning the game objects into chunks of 'chunk_size'.
+    Chunks within 'active_radius' chunks of a followed object are
+    active, all others are updated every 'distant_interval' ticks. The
+    camera of the GraphicsService, if any, is centered on the first
+    followed object. The world takes over the wrap around of the
+    PhysicsService: positions wrap at the size of the world, which is
+    the only bounds. Objects drawn in window coordinates ('screen_space')
+    are not part of the world.
+    """
+
+    # move the camera after the physics step
+    priority = 11
+
+    def __init__(self, size, chunk_size=512., active_radius=1,
+                 distant_interval=4):
+        """
+        Initializes the world of the given size (width, height).
+        """
+        self.size = size
+        self.chunk_size = float(chunk_size)
+        self.columns = int(math.ceil(size[0] / self.chunk_size))
+        self.rows = int(math.ceil(size[1] / self.chunk_size))
+        self.active_radius = active_radius
+        self.distant_interval = distant_interval
+
+        self.grid = SpatialGrid(chunk_size)
+        self.targets = []
+        self.focus = (size[0] / 2., size[1] / 2.)
+        self.camera = None
+        self.physics = None
+        self.ticks = 0
+        self.dts = collections.deque(maxlen=distant_interval)
+
+    def on_init(self, mgr):
+        mgr[GameObjectService].partition = self
+        self.physics = mgr[PhysicsService]
+        self.physics.wrap_around = False
+        try:
+            self.camera = mgr[GraphicsService].camera
+        except KeyError:
+            pass # headless
+        if self.camera is not None:
+            # the sprites are placed by the camera of the wrapped world
+            self.camera.world_size = self.size
+            self.physics.sync_sprites = False
+
+    def follow(self, obj):
+        """
+        Keep the chunks around the object active while it is in the
+        game.
+        """
+        if obj not in self.targets:
+            self.targets.append(obj)
+
+    def unfollow(self, obj):
+        if obj in self.targets:
+            self.targets.remove(obj)
+
+    def wrap(self, position):
+        """
+        Return the position wrapped into the bounds of the world.
+        """
+        return position[0] % self.size[0], position[1] % self.size[1]
+
+    def get_active_chunks(self):
+        """
+        Return the set of chunks around the followed objects, or around
+        the focus if there are none.
+        """
+        positions = [_get_position(obj) for obj in self.targets]
+        if not positions:
+            positions = [self.focus]
+        radius = self.active_radius
+        chunks = set()
+        for position in positions:
+            x, y = self.grid.cell(*self.wrap(position))
+            for dx in range(-radius, radius + 1):
+                for dy in range(-radius, radius + 1):
+                    chunks.add(((x + dx) % self.columns,
+                                (y + dy) % self.rows))
+        return chunks
+
+    def update(self, objects, dt):
+        """
+        Update the objects of the active chunks and of a share of the
+        distant chunks, the latter with the time since their last update.
+        Called by the GameObjectService in place of updating all objects,
+        in the order of 'objects' to stay deterministic.
+        """
+        self.ticks += 1
+        self.dts.append(dt)
+        phase = self.ticks % self.distant_interval
+        distant_dt = sum(self.dts)
+        active = self.get_active_chunks()
+        locations = self.grid.locations
+        interval = self.distant_interval
+
+        due = []
+        for obj in objects:
+            chunk = locations.get(obj)
+            if chunk is None:
+                obj.update(dt)
+            elif (chunk[0] + chunk[1]) % interval == phase:
+                due.append(obj)
+                obj.update(dt if chunk in active else distant_dt)
+            elif chunk in active:
+                obj.update(dt)
+
+        # objects may have moved into other chunks, which is checked in
+        # the same rhythm as the distant updates
+        for obj in due:
+            if obj in locations:
+                self.grid.move(obj, *self.wrap(_get_position(obj)))
+
+    def on_tick(self, dt):
+        # the physics step moved all bodies, also the ones of the distant
+        # chunks that were not updated
+        width, height = self.size
+        for obj in self.physics.physical_objects:
+            position = obj.body.position
+            x, y = position.x, position.y
+            if not (0 <= x < width and 0 <= y < height):
+                obj.body.position = (x % width, y % height)
+
+        if self.targets:
+            self.focus = self.wrap(_get_position(self.targets[0]))
+        if self.camera is not None:
+            self.camera.look_at(self.focus)
+
+    @subscribe('object_added')
+    def on_objects_added(self, objects):
+        for obj in objects:
+            if hasattr(obj, 'screen_space') and obj.screen_space:
+                continue # e.g. the HUD
+            position = _get_position(obj)
+            if position is not None:
+                self.grid.insert(obj, *self.wrap(position))
+
+    @subscribe('object_removed')
+    def on_objects_removed(self, objects):
+        for obj in objects:
+            if obj in self.grid:
+                self.grid.remove(obj)
+            self.unfollow(obj)
@@ -0,0 +1,368 @@
+"""
+The game objects and rules of YaaGame, shared by the game (main.py), its
+headless replay and the dedicated server (server.py). Nothing in here
+needs a window or the GUI.
+"""
+from engine.service import (
+    ServiceManager, GameObjectService, PhysicsService, MessageService
+)
+from engine.object import CombinedObject
+from engine.timer import TimerService
+from engine.replication import SPAWN_LOCALLY
+from engine.serialization import (Schema, Quantized, Bool, VarInt, Reference,
+                                  PHYSICAL_OBJECT_SCHEMA)
+from engine.particles import ParticleEffect, Emitter
+from pymunk import Vec2d
+import random
+import math
+
+# the size of the wrapping world
+WORLD_SIZE = 2100, 2100
+
+# five asteroids within the area of the original 700x700 window
+ASTEROID_DENSITY = 5 / (700. * 700.)
+
+
+def asteroid_count(world_size):
+    return max(5, int(round(ASTEROID_DENSITY * world_size[0] * world_size[1])))
+
+
+class SpaceShip(CombinedObject):
+    image_path = "SpaceShip2.png"
+    points = [(32, 0),
+              (-32, 32),
+              (-32, -32)]
+    mass = 1
+    maximum_speed = 350
+    group = 1
+    scale = 0.75
+    particle_emitters = (Emitter('flames', 40., offset=(-26, 0), speed=150.,
+                                 spread=0.2, condition='is_accellerating'),)
+    snapshot_fields = [('is_turning_left', Bool()),
+                       ('is_turning_right', Bool()),
+                       ('is_accellerating', Bool()),
+                       ('is_shooting', Bool()),
+                       ('is_special', Bool()),
+                       ('next_shot', VarInt()),
+                       ('next_special', VarInt())]
+    # set on the client controlling the ship, see ReplicationClientService
+    predicted = False
+
+    def __init__(self, *args, **kwargs):
+        """
+        Create a new spaceship object.
+        """
+        super(SpaceShip, self).__init__(*args, **kwargs)
+
+        self.is_turning_left = False
+        self.is_turning_right = False
+        self.is_accellerating = False
+        self.is_shooting = False
+        self.is_special = False
+
+        self.accelleration = 50
+        self.turning_speed = 6
+        self.body.angular_velocity = 0
+        self.timers = ServiceManager.instance[TimerService]
+
+    def on_added(self):
+        # cooldowns until the next shot/special are possible
+        self.next_shot = self.timers.start(0.)
+        self.next_special = self.timers.start(0.)
+
+    def on_removed(self):
+        self.timers.cancel(self.next_shot)
+        self.timers.cancel(self.next_special)
+
+    def update(self, dt):
+        if self.is_turning_left and not self.is_turning_right:
+            self.body.angular_velocity = self.turning_speed
+        elif self.is_turning_right and not self.is_turning_left:
+            self.body.angular_velocity = -self.turning_speed
+
+        if self.is_accellerating:
+            self.body.apply_force(self.body.rotation_vector *
+                                  self.accelleration)
+        else:
+            self.body.reset_forces()
+
+        if self.predicted:
+            # shots and missiles are spawned by the server only
+            return
+
+        if self.is_shooting and self.timers.is_expired(self.next_shot):
+            # reset time to next shot
+            self.timers.reset(self.next_shot, 0.5)
+
+            # spawn a new Shot object
+            position = self.body.position + self.body.rotation_vector * 40
+            velocity = self.body.rotation_vector * Shot.initial_speed \
+                       + self.body.velocity
+            self.object_service.add_object(Shot(position=position,
+                                                velocity=velocity,
+                                                angle=self.body.angle))
+
+        if self.is_special and self.timers.is_expired(self.next_special):
+            start = self.body.position
+            end = self.body.position + self.body.rotation_vector * 10000
+
+            ps = ServiceManager.instance[PhysicsService]
+            info = ps.segment_query(start, end, True, group=1)
+
+            if (info is not None
+                and isinstance(info.shape.body.object, Asteroid)):
+                self.timers.reset(self.next_special, 0.5)
+                position = self.body.position + self.body.rotation_vector * 40
+                velocity = self.body.rotation_vector * 100 + self.body.velocity
+                missile = Missile(target=info.shape.body.object,
+                                  position=position,
+                                  velocity=velocity,
+                                  angle=self.body.angle)
+                self.object_service.add_object(missile)
+
+    # flags of the input commands (see ReplicationClientService)
+    TURN_LEFT = 1
+    TURN_RIGHT = 2
+    ACCELLERATE = 4
+    SHOOT = 8
+    SPECIAL = 16
+
+    def get_command(self):
+        """
+        Return the current input state as command flags.
+        """
+        return ((self.is_turning_left and self.TURN_LEFT)
+                | (self.is_turning_right and self.TURN_RIGHT)
+                | (self.is_accellerating and self.ACCELLERATE)
+                | (self.is_shooting and self.SHOOT)
+                | (self.is_special and self.SPECIAL))
+
+    def apply_command(self, flags):
+        """
+        Set the input state from command flags.
+        """
+        self.turn_left(bool(flags & self.TURN_LEFT))
+        self.turn_right(bool(flags & self.TURN_RIGHT))
+        self.is_accellerating = bool(flags & self.ACCELLERATE)
+        self.is_shooting = bool(flags & self.SHOOT)
+        self.is_special = bool(flags & self.SPECIAL)
+
+    def simulate(self, flags, dt):
+        """
+        Advance the movement of the ship for one input command, without
+        stepping the physical space. Used to replay commands when the
+        predicted state is corrected.
+        """
+        body = self.body
+        turning = bool(flags & self.TURN_LEFT) - bool(flags & self.TURN_RIGHT)
+        body.angular_velocity = turning * self.turning_speed
+
+        velocity = body.velocity
+        if flags & self.ACCELLERATE:
+            velocity += body.rotation_vector * (self.accelleration
+                                                / body.mass * dt)
+        if velocity.length > self.maximum_speed:
+            velocity = velocity.normalized() * self.maximum_speed
+        body.velocity = velocity
+        body.position += velocity * dt
+        body.angle += body.angular_velocity * dt
+
+    def turn_left(self, value=True):
+        self.is_turning_left = value
+        if not value and not self.is_turning_right:
+            self.body.angular_velocity = 0
+
+    def turn_right(self, value=True):
+        self.is_turning_right = value
+        if not value and not self.is_turning_left:
+            self.body.angular_velocity = 0
+
+    def on_collision(self, other, arbiter):
+        if isinstance(other, Asteroid):
+            #spawn an explosion
+            self.object_service.add_object(Explosion(position=arbiter.contacts[0].position))
+            self.object_service.add_object(Explosion(position=self.body.position,
+                                                     scale=2))
+
+            # spawn some more explosions after time
+            ms = ServiceManager.instance[MessageService]
+            for _ in range(3):
+                ms.send_message(self.object_service,
+                                'add_object',
+                                random.random(),
+                                Explosion(position=self.body.position + Vec2d((random.random() - 0.5) * 100,
+                                                                              (random.random() - 0.5) * 100),
+                                          scale=random.random() + 1))
+
+            self.object_service.remove_object(self)
+            return True
+        else:
+            return False
+
+
+class Asteroid(CombinedObject):
+    image_path = "Asteroid1.png"
+    radius = 32
+    mass = 1
+    schema = Schema(PHYSICAL_OBJECT_SCHEMA.fields
+                    + [('scale', Quantized(0, 4, bits=8))])
+
+    def get_serial_state(self):
+        return CombinedObject.get_serial_state(self) + (self.scale,)
+
+    def on_collision(self, other, arbiter):
+        if isinstance(other, Shot) or isinstance(other, SpaceShip):
+            if self.scale > 0.75:
+                direction = other.body.velocity
+                direction.rotate(math.pi / 2)
+
+                velocity = direction.normalized() * 300 + self.body.velocity
+                position = self.body.position
+                self.object_service.add_object(Asteroid(position=position,
+                                                        velocity=velocity,
+                                                        scale=self.scale / 2))
+                self.object_service.add_object(Asteroid(position=position,
+                                                        velocity= -velocity,
+                                                        scale=self.scale / 2))
+
+            # chance to spawn a coin
+            if random.random() <= Pickup.spawn_chance:
+                self.object_service.add_object(Pickup(position=self.body.position,
+                                                      velocity=self.body.velocity))
+
+            self.object_service.remove_object(self)
+        # return true anyways
+        return True
+
+
+class Shot(CombinedObject):
+    image_path = "shot.png"
+    points = [(8, 0),
+              (-8, 4),
+              (-8, -4)]
+    mass = 1
+    initial_speed = 700
+    maximum_speed = SpaceShip.maximum_speed + initial_speed
+    lifetime = 0.75
+    scale = 0.3
+    snapshot_fields = [('lifetime_timer', VarInt())]
+
+    def __init__(self, *args, **kwargs):
+        super(Shot, self).__init__(*args, **kwargs)
+        self.lifetime = kwargs.get('lifetime', self.lifetime)
+        self.timers = ServiceManager.instance[TimerService]
+
+    def on_added(self):
+        self.lifetime_timer = self.timers.start(self.lifetime,
+                                                self.on_lifetime_end)
+
+    def on_removed(self):
+        self.timers.cancel(self.lifetime_timer)
+
+    def on_lifetime_end(self):
+        self.object_service.remove_object(self)
+
+    def on_collision(self, other, arbiter):
+        if isinstance(other, Asteroid):
+            #spawn an explosion
+            explosion = Explosion(position=arbiter.contacts[0].position)
+            self.object_service.add_object(explosion)
+            self.object_service.remove_object(self)
+            return True
+        else:
+            return False
+
+
+class Missile(Shot):
+    image_path = "missile.png"
+    maximum_speed = SpaceShip.maximum_speed
+    scale = 1
+    # a smoke cloud every 50ms to show the moved path
+    particle_emitters = (Emitter('smoke', 20.),)
+    snapshot_fields = Shot.snapshot_fields + [('target', Reference())]
+
+    def __init__(self, target=None, *args, **kwargs):
+        super(Missile, self).__init__(*args, **kwargs)
+        self.target = target
+        self.lifetime = 10.
+
+    def update(self, dt):
+        if self.target is None:
+            # replicated missiles are steered by the server
+            return
+        mis_pos = self.body.position
+        #mis_vel = self.body.velocity
+        tar_pos = self.target.body.position
+        tar_vel = self.target.body.velocity
+
+        self.target_point = tar_pos - mis_pos + tar_vel# - mis_vel
+
+        desired_vector = (self.target_point) / self.maximum_speed
+        missile_dir = self.body.rotation_vector
+
+        angle_diff = desired_vector.get_angle_between(missile_dir)
+        self.body.angular_velocity = -angle_diff * 10
+
+
+        #TODO remove this
+        #desired_vector = tar_pos - mis_pos
+
+
+        term = math.radians(45) - min(abs(angle_diff), math.radians(45))
+        self.body.apply_force(missile_dir * 1000 * term)
+        #self.body.velocity = desired_vector.normalized() * self.maximum_speed
+
+        self.desired_vector = desired_vector
+
+    def debug_draw(self, debug):
+        if self.target is None:
+            return
+        debug.line(self.body.position,
+                   self.body.position + self.target_point,
+                   (1.0, 0, 0, 1.0))
+
+        debug.line(self.body.position,
+                   self.target.body.position,
+                   (0, 1.0, 0, 1.0))
+
+
+class Explosion(ParticleEffect):
+    system = tuple("explosion%d" % index for index in range(7))
+    replication_policy = SPAWN_LOCALLY
+
+
+class Pickup(CombinedObject):
+    image_path = "coin.png"
+    radius = 16
+    mass = 0.000001
+    group = 2
+
+    spawn_chance = 0.5
+
+    def on_collision(self, other, arbiter):
+        if isinstance(other, SpaceShip):
+            ServiceManager.instance.send_broadcast('on_add_points', 500)
+            self.object_service.remove_object(self)
+            return False
+        return True
+
+
+# the classes replicated between server and clients, in network order
+REPLICATED_TYPES = [SpaceShip, Asteroid, Shot, Missile, Pickup, Explosion]
+
+
+def create_asteroids(mgr, world_size):
+    """
+    Create some Asteroids and add them to the object manager.
+    """
+    for _ in range(asteroid_count(world_size)):
+        position = (random.random() * world_size[0],
+                    random.random() * world_size[1])
+        velocity = ((random.random() - 0.5) * 100,
+                    (random.random() - 0.5) * 100)
+        scale = random.random() + 0.5
+        asteroid = Asteroid(position=position,
+                            velocity=velocity,
+                            scale=scale)
+
+        mgr[GameObjectService].add_object(asteroid)
@@ -52,7 +52,8 @@ from document import Document
 from file_dialogs import FileLoadDialog, FileSaveDialog, DirectorySelectDialog
 from frame import Frame, TitleFrame, Wrapper, SectionHeader, FoldingSection
 from layout import GridLayout, HorizontalLayout, VerticalLayout, FreeLayout
-from menu import Menu, Dropdown
+from layout import VirtualList
+from menu import Menu, VirtualMenu, Dropdown
 from scrollable import Scrollable
 from slider import Slider
 from text_input import Input
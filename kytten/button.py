@@ -54,8 +54,8 @@ class Button(Control):
             self.highlight.update(self.x, self.y, self.width, self.height)
         x, y, width, height = self.button.get_content_region()
         font = self.label.document.get_font()
-        self.label.x = x + width/2 - self.label.content_width/2
-        self.label.y = y + height/2 - font.ascent/2 - font.descent
+        self.label.set_position(x + width/2 - self.label.content_width/2,
+                                y + height/2 - font.ascent/2 - font.descent)
 
     def on_gain_highlight(self):
         Control.on_gain_highlight(self)
@@ -75,7 +75,7 @@ class Button(Control):
 
             # Delete the button to force it to be redrawn
             self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
     def on_mouse_release(self, x, y, button, modifiers):
         if self.is_pressed:
@@ -83,7 +83,7 @@ class Button(Control):
 
             # Delete the button to force it to be redrawn
             self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
             # Now, if mouse is still inside us, signal on_click
             if self.on_click is not None and self.hit_test(x, y):
@@ -133,4 +133,17 @@ class Button(Control):
 
     def teardown(self):
         self.on_click = None
-        Control.teardown(self)
\ No newline at end of file
+        Control.teardown(self)
+
+    def translate(self, dx, dy):
+        """
+        Moves the Button by translating its graphic elements.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        Control.layout(self, self.x + dx, self.y + dy)
+        self.button.translate(dx, dy)
+        if self.highlight is not None:
+            self.highlight.translate(dx, dy)
+        self.label.set_position(self.label.x + dx, self.label.y + dy)
\ No newline at end of file
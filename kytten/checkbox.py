@@ -105,7 +105,7 @@ class Checkbox(Control):
 
             # Delete the button to force it to be redrawn
             self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
     def size(self, dialog):
         """
@@ -149,4 +149,17 @@ class Checkbox(Control):
 
     def teardown(self):
         self.on_click = None
-        Control.teardown(self)
\ No newline at end of file
+        Control.teardown(self)
+
+    def translate(self, dx, dy):
+        """
+        Moves the Checkbox by translating its graphic elements.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        Control.layout(self, self.x + dx, self.y + dy)
+        self.checkbox.translate(dx, dy)
+        if self.highlight is not None:
+            self.highlight.translate(dx, dy)
+        self.label.set_position(self.label.x + dx, self.label.y + dy)
\ No newline at end of file
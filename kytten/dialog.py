@@ -1,6 +1,8 @@
 # kytten/dialog.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
+import math
+
 import pyglet
 from pyglet import gl
 
@@ -10,6 +12,9 @@ from frame import Wrapper, Frame
 from layout import GetRelativePoint, ANCHOR_CENTER
 from layout import VerticalLayout, HorizontalLayout
 
+# Size of the cells of the grid in which controls are looked up by position
+CONTROL_GRID_SIZE = 64.0
+
 class DialogEventManager(Control):
     def __init__(self):
         """
@@ -21,11 +26,49 @@ class DialogEventManager(Control):
         self.controls = []
         self.control_areas = {}
         self.control_map = {}
+        self.control_grid = {}
+        self.control_grid_origin = (0, 0)
         self.hover = None
         self.focus = None
         self.wheel_hint = None
         self.wheel_target = None
 
+    def _index_controls(self):
+        """
+        Sorts our controls into the cells of a grid which they overlap, so
+        the controls at a point are found without testing all of them.
+        Within a cell, the controls keep their order.
+        """
+        self.control_grid = {}
+        self.control_grid_origin = (0, 0)
+        for control in self.controls:
+            left, right, top, bottom = self.control_areas[control]
+            if left >= right or bottom >= top:
+                continue  # clipped away entirely, i.e. by a Scrollable
+            columns = xrange(int(math.floor(left / CONTROL_GRID_SIZE)),
+                             int(math.ceil(right / CONTROL_GRID_SIZE)))
+            rows = xrange(int(math.floor(bottom / CONTROL_GRID_SIZE)),
+                          int(math.ceil(top / CONTROL_GRID_SIZE)))
+            for column in columns:
+                for row in rows:
+                    self.control_grid.setdefault(
+                        (column, row), []).append(control)
+
+    def get_control_at(self, x, y):
+        """
+        Returns the first control which is hit at the given point, or None.
+
+        @param x X coordinate of point
+        @param y Y coordinate of point
+        """
+        origin_x, origin_y = self.control_grid_origin
+        cell = (int(math.floor((x - origin_x) / CONTROL_GRID_SIZE)),
+                int(math.floor((y - origin_y) / CONTROL_GRID_SIZE)))
+        for control in self.control_grid.get(cell, []):
+            if self.hit_control(x, y, control):
+                return control
+        return None
+
     def get_value(self, id):
         widget = self.get_widget(id)
         if widget is not None:
@@ -122,14 +165,13 @@ class DialogEventManager(Control):
         @param dx Delta X
         @param dy Delta Y
         """
-        if self.hover is not None and not self.hit_control(x, y, self.hover):
+        if self.hover is not None:
+            if self.hit_control(x, y, self.hover):
+                # Still within the same control, nothing to look up
+                self.hover.dispatch_event('on_mouse_motion', x, y, dx, dy)
+                return
             self.hover.dispatch_event('on_mouse_motion', x, y, dx, dy)
-        new_hover = None
-        for control in self.controls:
-            if self.hit_control(x, y, control):
-                new_hover = control
-                break
-        self.set_hover(new_hover)
+        self.set_hover(self.get_control_at(x, y))
         if self.hover is not None:
             self.hover.dispatch_event('on_mouse_motion', x, y, dx, dy)
 
@@ -269,14 +311,45 @@ class DialogEventManager(Control):
     def teardown(self):
         self.controls = []
         self.control_map = {}
+        self.control_grid = {}
         self.focus = None
         self.hover = None
         self.wheel_hint = None
         self.wheel_target = None
 
+    def translate_controls(self, dx, dy):
+        """
+        Moves the areas of our controls along with the Dialog, without
+        searching our children for them again.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        if not dx and not dy:
+            return
+        areas = self.control_areas
+        for control, (left, right, top, bottom) in areas.items():
+            areas[control] = (left + dx, right + dx, top + dy, bottom + dy)
+        origin_x, origin_y = self.control_grid_origin
+        self.control_grid_origin = (origin_x + dx, origin_y + dy)
+
     def update_controls(self):
-        """Update our list of controls which may respond to user input."""
+        """
+        Update our list of controls which may respond to user input.  If
+        the controls are still the same, only their areas are updated.
+        """
         controls = self._get_controls()
+        if len(controls) == len(self.controls):
+            areas = self.control_areas
+            for index, (control, left, right, top, bottom) in \
+                    enumerate(controls):
+                if control is not self.controls[index]:
+                    break
+                areas[control] = (left, right, top, bottom)
+            else:
+                self._index_controls()
+                return
+
         self.controls = []
         self.control_areas = {}
         self.control_map = {}
@@ -285,6 +358,7 @@ class DialogEventManager(Control):
             self.control_areas[control] = (left, right, top, bottom)
             if control.id is not None:
                 self.control_map[control.id] = control
+        self._index_controls()
 
         if self.hover is not None and self.hover not in self.controls:
             self.set_hover(None)
@@ -301,7 +375,9 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
     """
     Ensure that all Widgets within a Dialog can be drawn with
     blending enabled, and that our Dialog will be drawn in a particular
-    order relative to other Dialogs.
+    order relative to other Dialogs.  A hidden DialogGroup masks all
+    writes to the framebuffer, so its Widgets stay in the batch but
+    nothing of them is drawn.
     """
     def __init__(self, parent=None):
         """
@@ -312,6 +388,7 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
         pyglet.graphics.OrderedGroup.__init__(
             self, GetNextDialogOrderId(), parent)
         self.real_order = self.order
+        self.is_visible = True
 
     def __cmp__(self, other):
         """
@@ -338,15 +415,21 @@ class DialogGroup(pyglet.graphics.OrderedGroup):
 
     def set_state(self):
         """
-        Ensure that blending is set.
+        Ensure that blending is set, or that nothing is drawn if we are
+        hidden.
         """
-        gl.glPushAttrib(gl.GL_ENABLE_BIT | gl.GL_CURRENT_BIT)
-        gl.glEnable(gl.GL_BLEND)
-        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glPushAttrib(gl.GL_ENABLE_BIT | gl.GL_CURRENT_BIT |
+                        gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        if self.is_visible:
+            gl.glEnable(gl.GL_BLEND)
+            gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        else:
+            gl.glColorMask(gl.GL_FALSE, gl.GL_FALSE, gl.GL_FALSE, gl.GL_FALSE)
+            gl.glDepthMask(gl.GL_FALSE)
 
     def unset_state(self):
         """
-        Restore previous blending state.
+        Restore previous blending and masking state.
         """
         gl.glPopAttrib()
 
@@ -411,7 +494,9 @@ class Dialog(Wrapper, DialogEventManager):
         self.fg_group = pyglet.graphics.OrderedGroup(2, self.root_group)
         self.highlight_group = pyglet.graphics.OrderedGroup(3, self.root_group)
         self.needs_layout = True
+        self.needs_update_controls = False
         self.is_dragging = False
+        self.is_visible = True
 
         if window is None:
             self.screen = Widget()
@@ -424,9 +509,14 @@ class Dialog(Wrapper, DialogEventManager):
         """
         We lay out the Dialog by first determining the size of all its
         chlid Widgets, then laying ourself out relative to the parent window.
+        Only the Widgets which were invalidated since the last layout are
+        sized and laid out again.  If none were, we were merely moved.
         """
-        # Determine size of all components
-        self.size(self)
+        is_moved = not self.is_dirty
+        last_x, last_y = self.x, self.y
+
+        # Determine size of all components that changed
+        self.measure(self)
 
         # Calculate our position relative to our containing window,
         # making sure that we fit completely on the window.  If our offset
@@ -443,10 +533,14 @@ class Dialog(Wrapper, DialogEventManager):
         y += offset_y
 
         # Perform the actual layout now!
-        self.layout(x, y)
-        self.update_controls()
+        self.place(x, y)
+        if is_moved and not self.needs_update_controls:
+            self.translate_controls(self.x - last_x, self.y - last_y)
+        else:
+            self.update_controls()
 
         self.needs_layout = False
+        self.needs_update_controls = False
 
     def draw(self):
         assert self.own_batch
@@ -462,6 +556,14 @@ class Dialog(Wrapper, DialogEventManager):
     def get_root(self):
         return self
 
+    def invalidate(self):
+        """
+        Marks us dirty, so on our next update we are sized and laid out
+        again, and our controls are collected anew.
+        """
+        self.set_dirty()
+        self.needs_layout = True
+
     def on_key_press(self, symbol, modifiers):
         """
         We intercept TAB, ENTER, and ESCAPE events.  TAB and ENTER will
@@ -581,9 +683,45 @@ class Dialog(Wrapper, DialogEventManager):
     def set_needs_layout(self):
         """
         True if we should redo the Dialog layout on our next update.
+        Widgets which changed call invalidate() instead, which marks
+        them dirty so they are sized and laid out again as well.  If
+        nothing was invalidated, we were merely moved, and our Widgets
+        are translated.
+        """
+        self.needs_layout = True
+
+    def set_needs_update_controls(self):
+        """
+        True if our controls changed while no Widget was invalidated, i.e.
+        because a VirtualList recycled its rows, so that we collect them
+        again on our next layout.
         """
+        self.needs_update_controls = True
         self.needs_layout = True
 
+    def set_visible(self, visible):
+        """
+        Shows or hides the Dialog without tearing it down.  A hidden Dialog
+        keeps its graphic elements, but its group draws nothing of them,
+        and it receives no window events.
+        Showing it again puts it on top of the other dialogs.
+
+        @param visible True to show the Dialog, False to hide it
+        """
+        if visible == self.is_visible:
+            return
+        self.is_visible = visible
+        self.root_group.is_visible = visible
+        if visible:
+            if self.window is not None:
+                self.on_resize(*self.window.get_size())
+            self.pop_to_top()
+        else:
+            if self.window is not None:
+                self.window.remove_handlers(self)
+            self.set_hover(None)
+            self.is_dragging = False
+
     def teardown(self):
         DialogEventManager.teardown(self)
         if self.content is not None:
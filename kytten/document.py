@@ -50,6 +50,7 @@ class Document(Control):
         return controls
 
     def delete(self):
+        Control.delete(self)
         if self.content is not None:
             self.content.delete()
             self.content = None
@@ -94,7 +95,7 @@ class Document(Control):
 
         if self.needs_layout:
             self.needs_layout = False
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
     def size(self, dialog):
         if dialog is None:
@@ -119,6 +120,7 @@ class Document(Control):
            (self.max_height and self.content.content_height > self.max_height):
             if self.scrollbar is None:
                 self.scrollbar = VScrollbar(self.max_height)
+            self.scrollbar.parent = self
             self.scrollbar.size(dialog)
             self.scrollbar.set(self.max_height, self.content.content_height)
         if self.scrollbar is not None:
@@ -128,4 +130,13 @@ class Document(Control):
 
     def set_text(self, text):
         self.document.text = text
-        self.needs_layout = True
\ No newline at end of file
+        self.needs_layout = True
+
+    def translate(self, dx, dy):
+        self.x, self.y = self.x + dx, self.y + dy
+        self.content.begin_update()
+        self.content.x += dx
+        self.content.y += dy
+        self.content.end_update()
+        if self.scrollbar is not None:
+            self.scrollbar.translate(dx, dy)
\ No newline at end of file
@@ -1,8 +1,11 @@
 # kytten/file_dialogs.py
 # Copyrighted (C) 2009 by Conrad "Lynx" Wong
 
-import glob
+import bisect
 import os
+import Queue
+import stat
+import threading
 import pyglet
 from pyglet import gl
 
@@ -11,11 +14,105 @@ from dialog import Dialog
 from frame import Frame, SectionHeader
 from layout import VerticalLayout, HorizontalLayout
 from layout import ANCHOR_CENTER, HALIGN_LEFT, VALIGN_BOTTOM
-from menu import Menu, Dropdown
+from menu import VirtualMenu, Dropdown
 from scrollable import Scrollable
 from text_input import Input
 from widgets import Label
 
+# Number of directory entries passed from the scanning thread at once
+SCAN_CHUNK_SIZE = 64
+
+# Listings of scanned directories: path -> (mtime, [(filename, is_dir)])
+directory_cache = {}
+
+def ScanDirectory(path, results, cancelled):
+    """
+    Lists a directory, meant to be run on a background thread.  Chunks of
+    (filename, is_dir) tuples are put into the results queue, followed
+    by None when the listing is complete.  Each entry is stat'ed once, and
+    the listing is cached until the modification time of the directory
+    changes.
+
+    @param path Path of the directory
+    @param results Queue receiving the entries
+    @param cancelled Event which is set to stop the scan early
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        results.put(None)
+        return
+    cached = directory_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        results.put(cached[1])
+        results.put(None)
+        return
+    try:
+        names = os.listdir(path)
+    except OSError:
+        results.put(None)
+        return
+
+    entries = []
+    chunk = []
+    for name in names:
+        if cancelled.is_set():
+            return
+        if name.startswith('.'):
+            continue  # hidden, like glob does
+        filename = os.path.join(path, name)
+        try:
+            mode = os.stat(filename).st_mode
+        except OSError:
+            continue  # i.e. a broken link
+        if stat.S_ISDIR(mode) or stat.S_ISREG(mode):
+            chunk.append((filename, stat.S_ISDIR(mode)))
+        if len(chunk) == SCAN_CHUNK_SIZE:
+            results.put(chunk)
+            entries += chunk
+            chunk = []
+    if chunk:
+        results.put(chunk)
+        entries += chunk
+    directory_cache[path] = (mtime, entries)
+    results.put(None)
+
+def FileSortKey(name):
+    """
+    Sorts the current directory first, then directories, then files.
+    """
+    if name == '(this dir)':
+        return (0, name)
+    elif name.endswith(' (dir)'):
+        return (1, name)
+    else:
+        return (2, name)
+
+def MergeFiles(files, keys, names):
+    """
+    Merges names into a sorted list of files without sorting it again.
+    Only the new names are sorted; they are inserted between the slices
+    of the list found by bisecting its sort keys.
+
+    @param files List of file names, sorted by FileSortKey
+    @param keys List of the sort keys of the files
+    @param names List of the file names to add
+    @returns The merged lists of file names and of their sort keys
+    """
+    merged_files = []
+    merged_keys = []
+    start = 0
+    for key, name in sorted([(FileSortKey(name), name) for name in names]):
+        index = bisect.bisect(keys, key, start)
+        merged_files += files[start:index]
+        merged_keys += keys[start:index]
+        merged_files.append(name)
+        merged_keys.append(key)
+        start = index
+    merged_files += files[start:]
+    merged_keys += keys[start:]
+    return merged_files, merged_keys
+
 class FileLoadDialog(Dialog):
     def __init__(self, path=os.getcwd(), extensions=[], title="Select File",
                  width=540, height=300, window=None, batch=None, group=None,
@@ -26,6 +123,8 @@ class FileLoadDialog(Dialog):
         self.title = title
         self.on_select = on_select
         self.selected_file = None
+        self.scan_cancelled = None
+        self.scan_results = None
         self._set_files()
 
         def on_parent_menu_select(choice):
@@ -38,8 +137,8 @@ class FileLoadDialog(Dialog):
                                  selected=self.parents[-1],
                                  align=VALIGN_BOTTOM,
                                  on_select=on_parent_menu_select)
-        self.menu = Menu(options=self.files, align=HALIGN_LEFT,
-                         on_select=on_menu_select)
+        self.menu = VirtualMenu(options=self.files, align=HALIGN_LEFT,
+                                on_select=on_menu_select, width=width)
         self.scrollable = Scrollable(
             VerticalLayout([self.dropdown, self.menu], align=HALIGN_LEFT),
             width=width, height=height)
@@ -69,11 +168,45 @@ class FileLoadDialog(Dialog):
             if self.on_select is not None:
                 self.on_select(filename)
 
-    def _set_files(self):
-        # Once we have a new path, update our files
-        filenames = glob.glob(os.path.join(self.path, '*'))
+    def _add_files(self, entries):
+        """
+        Adds scanned directory entries to our menu.  They are merged into
+        our sorted files, and the menu is updated once for all entries
+        scanned since the last update.
+
+        @param entries List of (filename, is_dir) tuples
+        """
+        files = self._get_files(entries)
+        self.files_dict.update(files)
+        self.files, self.file_keys = MergeFiles(
+            self.files, self.file_keys, [name for name, filename in files])
+        self.menu.set_items(self.files)
+
+    def _get_files(self, entries):
+        """
+        Returns (name, filename) tuples of the directory entries to show.
+
+        @param entries List of (filename, is_dir) tuples
+        """
+        files = []
+        for filename, is_dir in entries:
+            if is_dir:
+                files.append(("%s (dir)" % os.path.basename(filename),
+                              filename))
+            elif not self.extensions or \
+                 os.path.splitext(filename)[1] in self.extensions:
+                files.append((os.path.basename(filename), filename))
+        return files
+
+    def _get_fixed_files(self):
+        """
+        Returns (name, filename) tuples shown before the directory is
+        scanned.
+        """
+        return []
 
-        # First, a list of directories
+    def _set_files(self):
+        # Once we have a new path, update our parents
         self.parents = []
         self.parents_dict = {}
         path = self.path
@@ -88,43 +221,55 @@ class FileLoadDialog(Dialog):
                 break
         self.parents.reverse()
 
-        files = [("%s (dir)" % os.path.basename(x), x) for x in filenames
-                 if os.path.isdir(x)]
-
-        # Now add the files that match the extensions
-        if self.extensions:
-            for filename in filenames:
-                if os.path.isfile(filename):
-                    ext = os.path.splitext(filename)[1]
-                    if ext in self.extensions:
-                        files.append((os.path.basename(filename), filename))
-        else:
-            files.extend([(os.path.basename(x), x) for x in filenames
-                          if os.path.isfile(x)])
-
+        # The files are added as they are scanned in the background
+        files = self._get_fixed_files()
         self.selected_file = None
         self.files_dict = dict(files)
-        self.files = self.files_dict.keys()
-
-        def dir_sort(x, y):
-            if x.endswith(' (dir)') and y.endswith(' (dir)'):
-                return cmp(x, y)
-            elif x.endswith(' (dir)'):
-                return -1
-            elif y.endswith(' (dir)'):
-                return 1
-            else:
-                return cmp(x, y)
-        self.files.sort(dir_sort)
+        self.files, self.file_keys = MergeFiles(
+            [], [], [name for name, filename in files])
+
+        if self.scan_cancelled is not None:
+            self.scan_cancelled.set()
+        self.scan_cancelled = threading.Event()
+        self.scan_results = Queue.Queue()
+        thread = threading.Thread(target=ScanDirectory,
+                                  args=(self.path, self.scan_results,
+                                        self.scan_cancelled))
+        thread.daemon = True
+        thread.start()
 
     def get(self):
         return self.selected_file
 
+    def on_update(self, dt):
+        """
+        Adds the directory entries scanned since the last update.
+
+        @param dt Time passed since last update event (in seconds)
+        """
+        if self.scan_results is not None:
+            entries = []
+            try:
+                while 1:
+                    chunk = self.scan_results.get_nowait()
+                    if chunk is None:
+                        self.scan_results = None
+                        break
+                    entries += chunk
+            except Queue.Empty:
+                pass
+            if entries:
+                self._add_files(entries)
+        Dialog.on_update(self, dt)
+
     def size(self, dialog):
         Dialog.size(self, dialog)
 
     def teardown(self):
         self.on_select = None
+        if self.scan_cancelled is not None:
+            self.scan_cancelled.set()
+        self.scan_results = None
         Dialog.teardown(self)
 
 class FileSaveDialog(FileLoadDialog):
@@ -271,53 +416,16 @@ class DirectorySelectDialog(FileLoadDialog):
             if self.on_select is not None:
                 self.on_select(filename)
 
-    def _set_files(self):
-        # Once we have a new path, update our files
-        filenames = glob.glob(os.path.join(self.path, '*'))
-
-        # First, a list of directories
-        self.parents = []
-        self.parents_dict = {}
-        path = self.path
-        index = 1
-        while 1:
-            name = "%d %s" % (index, os.path.basename(path) or path)
-            self.parents_dict[name] = path
-            self.parents.append(name)
-            index += 1
-            path, child = os.path.split(path)
-            if not child:
-                break
-        self.parents.reverse()
-
-        files = [('(this dir)', self.path)] + \
-                [("%s (dir)" % os.path.basename(x), x) for x in filenames
-                 if os.path.isdir(x)]
-        # Now add the files that match the extensions
-        if self.extensions:
-            for filename in filenames:
-                if os.path.isfile(filename):
-                    ext = os.path.splitext(filename)[1]
-                    if ext in self.extensions:
-                        files.append(('-%s' % os.path.basename(filename),
-                                      filename))
-        else:
-            files.extend([('-%s' % os.path.basename(x), x) for x in filenames
-                          if os.path.isfile(x)])
-
-        self.selected_file = None
-        self.files_dict = dict(files)
-        self.files = self.files_dict.keys()
-
-        def dir_sort(x, y):
-            if x == '(this dir)':
-                return -1
-            elif x.endswith(' (dir)') and y.endswith(' (dir)'):
-                return cmp(x, y)
-            elif x.endswith(' (dir)') and y != '(this dir)':
-                return -1
-            elif y.endswith(' (dir)'):
-                return 1
-            else:
-                return cmp(x, y)
-        self.files.sort(dir_sort)
+    def _get_files(self, entries):
+        files = []
+        for filename, is_dir in entries:
+            if is_dir:
+                files.append(("%s (dir)" % os.path.basename(filename),
+                              filename))
+            elif not self.extensions or \
+                 os.path.splitext(filename)[1] in self.extensions:
+                files.append(('-%s' % os.path.basename(filename), filename))
+        return files
+
+    def _get_fixed_files(self):
+        return [('(this dir)', self.path)]
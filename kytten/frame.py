@@ -65,7 +65,7 @@ class Wrapper(Widget):
             x, y = GetRelativePoint(
                 self, self.anchor,
                 self.content, self.anchor, self.content_offset)
-            self.content.layout(x, y)
+            self.content.place(x, y)
 
     def set(self, dialog, content):
         """
@@ -77,7 +77,8 @@ class Wrapper(Widget):
         if self.content is not None:
             self.content.delete()
         self.content = content
-        dialog.set_needs_layout()
+        self.invalidate()
+        dialog.invalidate()
 
     def size(self, dialog):
         """
@@ -89,7 +90,7 @@ class Wrapper(Widget):
             return
         Widget.size(self, dialog)
         if self.content is not None:
-            self.content.size(dialog)
+            self.content.measure(dialog, self)
             self.width, self.height = self.content.width, self.content.height
         else:
             self.width = self.height = 0
@@ -150,7 +151,7 @@ class Frame(Wrapper):
         interior.x, interior.y = x, y
         x, y = GetRelativePoint(interior, self.anchor,
                                 self.content, self.anchor, self.content_offset)
-        self.content.layout(x, y)
+        self.content.place(x, y)
 
     def size(self, dialog):
         """
@@ -174,6 +175,18 @@ class Frame(Wrapper):
         self.width, self.height = self.frame.get_needed_size(
             self.content.width, self.content.height)
 
+    def translate(self, dx, dy):
+        """
+        Moves the Frame by translating its graphic element, and places the
+        content within it again.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        self.frame.translate(dx, dy)
+        self.content.place(self.content.x + dx, self.content.y + dy)
+
 class TitleFrame(VerticalLayout):
     def __init__(self, title, content):
         VerticalLayout.__init__(self, content=[
@@ -8,6 +8,8 @@
 # GridLayout: a table of Widgets.
 # FreeLayout: an open area within which Widgets may be positioned freely,
 #             relative to one of its anchor points.
+# VirtualList: a long list of rows of the same height, of which only the
+#              visible ones exist as Widgets.
 
 import pyglet
 from pyglet import gl
@@ -107,7 +109,7 @@ class VerticalLayout(Widget):
         @param item The Widget to be added
         """
         self.content.append(item or Spacer())
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def delete(self):
         """Deletes all graphic elements within the layout."""
@@ -143,7 +145,7 @@ class VerticalLayout(Widget):
         """
         item.delete()
         self.content.remove(item)
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def layout(self, x, y):
         """
@@ -162,17 +164,17 @@ class VerticalLayout(Widget):
         top = y + self.height
         if self.align == HALIGN_RIGHT:
             for item in self.content:
-                item.layout(x + self.width - item.width,
-                            top - item.height)
+                item.place(x + self.width - item.width,
+                           top - item.height)
                 top -= item.height + self.padding
         elif self.align == HALIGN_CENTER:
             for item in self.content:
-                item.layout(x + self.width/2 - item.width/2,
-                            top - item.height)
+                item.place(x + self.width/2 - item.width/2,
+                           top - item.height)
                 top -= item.height + self.padding
         else: # HALIGN_LEFT
             for item in self.content:
-                item.layout(x, top - item.height)
+                item.place(x, top - item.height)
                 top -= item.height + self.padding
 
     def set(self, content):
@@ -183,7 +185,7 @@ class VerticalLayout(Widget):
         """
         self.delete()
         self.content = content
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def size(self, dialog):
         """
@@ -200,7 +202,7 @@ class VerticalLayout(Widget):
             height = -self.padding
         width = 0
         for item in self.content:
-            item.size(dialog)
+            item.measure(dialog, self)
             height += item.height + self.padding
             width = max(width, item.width)
         self.width, self.height = width, height
@@ -261,15 +263,15 @@ class HorizontalLayout(VerticalLayout):
         left = x
         if self.align == VALIGN_TOP:
             for item in self.content:
-                item.layout(left, y + self.height - item.height)
+                item.place(left, y + self.height - item.height)
                 left += item.width + self.padding
         elif self.align == VALIGN_CENTER:
             for item in self.content:
-                item.layout(left, y + self.height/2 - item.height/2)
+                item.place(left, y + self.height/2 - item.height/2)
                 left += item.width + self.padding
         else: # VALIGN_BOTTOM
             for item in self.content:
-                item.layout(left, y)
+                item.place(left, y)
                 left += item.width + self.padding
 
     def size(self, dialog):
@@ -287,7 +289,7 @@ class HorizontalLayout(VerticalLayout):
         else:
             width = -self.padding
         for item in self.content:
-            item.size(dialog)
+            item.measure(dialog, self)
             height = max(height, item.height)
             width += item.width + self.padding
         self.width, self.height = width, height
@@ -343,8 +345,7 @@ class GridLayout(Widget):
         """
         assert isinstance(row, tuple) or isinstance(row, list)
         self.content.append(row)
-        if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def delete(self):
         """Deletes all graphic elements within the layout."""
@@ -365,8 +366,7 @@ class GridLayout(Widget):
         for column in row:
             if column is not None:
                 column.delete()
-        if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def get(self, column, row):
         """
@@ -405,9 +405,9 @@ class GridLayout(Widget):
                 if cell is not None:
                     if cell.is_expandable():
                         cell.expand(placement.width, placement.height)
-                    cell.layout(*GetRelativePoint(placement, self.anchor,
-                                                  cell, self.anchor,
-                                                  self.offset))
+                    cell.place(*GetRelativePoint(placement, self.anchor,
+                                                 cell, self.anchor,
+                                                 self.offset))
                 placement.x += placement.width
                 col_index += 1
             row_index += 1
@@ -429,7 +429,7 @@ class GridLayout(Widget):
         if self.content[row][column] is not None:
             self.content[row][column].delete()
         self.content[row][column] = item
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def size(self, dialog):
         """Recalculates our size and the maximum widths and heights of
@@ -451,7 +451,7 @@ class GridLayout(Widget):
             col_index = 0
             for cell in row:
                 if cell is not None:
-                    cell.size(dialog)
+                    cell.measure(dialog, self)
                     width, height = cell.width, cell.height
                 else:
                     width = height = 0
@@ -525,7 +525,7 @@ class FreeLayout(Spacer):
         @param widget The Widget to be added
         """
         self.content.append( (anchor, x, y, widget) )
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def layout(self, x, y):
         """
@@ -539,7 +539,7 @@ class FreeLayout(Spacer):
         for anchor, offset_x, offset_y, widget in self.content:
             x, y = GetRelativePoint(self, anchor, widget, anchor,
                                     (offset_x, offset_y))
-            widget.layout(x, y)
+            widget.place(x, y)
 
     def remove(self, dialog, widget):
         """
@@ -549,6 +549,7 @@ class FreeLayout(Spacer):
         @param widget The Widget to be removed
         """
         self.content = [x for x in self.content if x[3] != widget]
+        self.invalidate()
 
     def size(self, dialog):
         """
@@ -560,7 +561,7 @@ class FreeLayout(Spacer):
             return
         Spacer.size(self, dialog)
         for anchor, offset_x, offset_y, widget in self.content:
-            widget.size(dialog)
+            widget.measure(dialog, self)
 
     def teardown(self):
         for _, _, _, item in self.content:
@@ -568,3 +569,158 @@ class FreeLayout(Spacer):
         self.content = []
         Widget.teardown(self)
 
+class VirtualList(Widget):
+    """
+    Arranges a list of items as rows from top to bottom, like a
+    VerticalLayout of left-justified Widgets.  However, only the rows which
+    are visible within the Scrollable containing the list exist as
+    Widgets.  When the list is scrolled, the Widgets of rows which become
+    invisible are recycled for the rows which become visible, so the list
+    takes the same memory and layout time regardless of its length.
+
+    All rows must have the same height, which is taken from the first
+    row.  The list is as wide as the first row or the given width,
+    whichever is wider; expandable rows are expanded to its width.
+    """
+    def __init__(self, items=None, create_row=None, update_row=None,
+                 padding=5, width=0):
+        """
+        Creates a new VirtualList.
+
+        @param items A list of items, one for each row
+        @param create_row Called without arguments to create a new row
+                          Widget, by default a Label
+        @param update_row Called with a row Widget and an item to show the
+                          item in the row; by default sets the text of a
+                          Label
+        @param padding This amount of padding is inserted between rows
+        @param width Minimum width of the list, which should be enough
+                     for the widest row
+        """
+        Widget.__init__(self)
+        if items is None:
+            items = []
+        self.items = items
+        self.create_row = create_row or Label
+        self.update_row = update_row or (lambda row, item: row.set_text(item))
+        self.padding = padding
+        self.min_width = width
+        self.row_width = self.row_height = 0
+        self.rows = {}  # index of a visible row -> Widget
+        self.pool = []  # recycled Widgets
+
+    def _get_controls(self):
+        """
+        Returns Controls within the visible rows.
+        """
+        controls = []
+        for index in sorted(self.rows):
+            controls += self.rows[index]._get_controls()
+        return controls
+
+    def _get_visible_range(self):
+        """
+        Returns the indices of the first and after the last visible row.
+        If we are not within a Scrollable, all rows are visible.
+        """
+        count = len(self.items)
+        dialog = self.saved_dialog
+        if not hasattr(dialog, 'content_height') or not self.row_height:
+            return 0, count
+        step = self.row_height + self.padding
+        top = self.y + self.height
+        first = int((top - dialog.content_y - dialog.content_height) // step)
+        last = int((top - dialog.content_y) // step) + 1
+        return max(first, 0), min(last, count)
+
+    def _release_row(self, index):
+        row = self.rows.pop(index)
+        row.delete()
+        self.pool.append(row)
+
+    def _acquire_row(self, index):
+        if self.pool:
+            row = self.pool.pop()
+        else:
+            row = self.create_row()
+        self.update_row(row, self.items[index])
+        self.rows[index] = row
+        return row
+
+    def delete(self):
+        """Deletes all graphic elements within the list."""
+        for row in self.rows.values() + self.pool:
+            row.delete()
+        Widget.delete(self)
+
+    def layout(self, x, y):
+        """
+        Lays out the visible rows, creating or recycling their Widgets
+        as necessary.  If the visible rows changed, the Dialog has to
+        collect its controls again.
+
+        @param x X coordinate of the lower left corner
+        @param y Y coordinate of the lower left corner
+        """
+        Widget.layout(self, x, y)
+        first, last = self._get_visible_range()
+        is_changed = False
+        for index in self.rows.keys():
+            if index < first or index >= last:
+                self._release_row(index)
+                is_changed = True
+
+        top = y + self.height
+        for index in xrange(first, last):
+            row = self.rows.get(index)
+            if row is None:
+                row = self._acquire_row(index)
+                is_changed = True
+            row.measure(self.saved_dialog, self)
+            if row.is_expandable() and row.width < self.width:
+                row.expand(self.width, row.height)
+            row_top = top - index * (self.row_height + self.padding)
+            row.place(x, row_top - row.height)
+        if is_changed and self.saved_dialog is not None:
+            self.saved_dialog.set_needs_update_controls()
+
+    def set_items(self, items):
+        """
+        Sets an entirely new list of items.
+
+        @param items The new list of items
+        """
+        for index in self.rows.keys():
+            self._release_row(index)
+        self.items = items
+        self.invalidate()
+
+    def size(self, dialog):
+        """
+        Calculates the size of the list.  The first time, we create the
+        first row to learn the height of the rows.
+
+        @param dialog The Dialog which contains the list
+        """
+        if dialog is None:
+            return
+        Widget.size(self, dialog)
+        if not self.row_height and self.items:
+            row = self._acquire_row(0)
+            row.measure(dialog, self)
+            self.row_width, self.row_height = row.width, row.height
+        count = len(self.items)
+        if count:
+            self.height = count * (self.row_height + self.padding) \
+                - self.padding
+        else:
+            self.height = 0
+        self.width = max(self.min_width, self.row_width)
+
+    def teardown(self):
+        for row in self.rows.values() + self.pool:
+            row.teardown()
+        self.rows = {}
+        self.pool = []
+        self.items = []
+        Widget.teardown(self)
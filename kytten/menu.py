@@ -6,7 +6,7 @@ import pyglet
 from widgets import Widget, Control
 from dialog import Dialog
 from frame import Frame
-from layout import GetRelativePoint, VerticalLayout
+from layout import GetRelativePoint, VerticalLayout, VirtualList
 from layout import ANCHOR_CENTER, ANCHOR_TOP_LEFT, ANCHOR_BOTTOM_LEFT
 from layout import HALIGN_CENTER
 from layout import VALIGN_TOP, VALIGN_CENTER, VALIGN_BOTTOM
@@ -31,6 +31,7 @@ class MenuOption(Control):
         self.is_selected = False
 
     def delete(self):
+        Control.delete(self)
         if self.label is not None:
             self.label.delete()
             self.label = None
@@ -59,8 +60,7 @@ class MenuOption(Control):
         x, y = GetRelativePoint(self, self.anchor,
                                 Widget(self.label.content_width, height),
                                 self.anchor, (0, 0))
-        self.label.x = x
-        self.label.y = y - font.descent
+        self.label.set_position(x, y - font.descent)
 
     def on_gain_highlight(self):
         Control.on_gain_highlight(self)
@@ -86,7 +86,7 @@ class MenuOption(Control):
         if self.label is not None:
             self.label.delete()
             self.label = None
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def size(self, dialog):
         if dialog is None:
@@ -134,12 +134,20 @@ class MenuOption(Control):
         if self.background is not None:
             self.background.delete()
             self.background = None
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def teardown(self):
         self.menu = None
         Control.teardown(self)
 
+    def translate(self, dx, dy):
+        Control.layout(self, self.x + dx, self.y + dy)
+        if self.background is not None:
+            self.background.translate(dx, dy)
+        if self.highlight is not None:
+            self.highlight.translate(dx, dy)
+        self.label.set_position(self.label.x + dx, self.label.y + dy)
+
 class Menu(VerticalLayout):
     """
     Menu is a VerticalLayout of MenuOptions.  Moving the mouse across
@@ -195,12 +203,68 @@ class Menu(VerticalLayout):
         menu_options = self._make_options(options)
         self.options = dict(zip(options, menu_options))
         self.set(menu_options)
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def teardown(self):
         self.on_select = None
         VerticalLayout.teardown(self)
 
+class VirtualMenu(VirtualList):
+    """
+    VirtualMenu behaves like a Menu, but only the MenuOptions of the options
+    which are visible within its Scrollable exist.  Use it for long lists
+    of options.
+    """
+    def __init__(self, options=None, align=HALIGN_CENTER, padding=4,
+                 on_select=None, width=0):
+        self.align = align
+        self.on_select = on_select
+        self.selected = None
+        VirtualList.__init__(self, options,
+                             create_row=self._create_option,
+                             update_row=self._update_option,
+                             padding=padding, width=width)
+
+    def _create_option(self):
+        return MenuOption(anchor=(VALIGN_CENTER, self.align), menu=self)
+
+    def _update_option(self, menu_option, option):
+        menu_option.delete()
+        menu_option.disabled_flag = option.startswith('-')
+        if menu_option.disabled_flag:
+            option = option[1:]
+        menu_option.text = option
+        menu_option.is_selected = option == self.selected
+
+    def get_value(self):
+        return self.selected
+
+    def is_input(self):
+        return True
+
+    def select(self, text):
+        if not text in self.items:
+            return
+
+        for menu_option in self.rows.values():
+            if menu_option.is_selected:
+                menu_option.unselect()
+        self.selected = text
+        for menu_option in self.rows.values():
+            if menu_option.text == text:
+                menu_option.select()
+
+        if self.on_select is not None:
+            self.on_select(text)
+
+    def set_options(self, options):
+        self.selected = None
+        self.set_items(options)
+
+    def teardown(self):
+        self.on_select = None
+        VirtualList.teardown(self)
+
 class Dropdown(Control):
     def __init__(self, options=[], selected=None, id=None,
                  max_height=400, align=VALIGN_TOP, on_select=None,
@@ -225,6 +289,7 @@ class Dropdown(Control):
             self.pulldown_menu = None
 
     def delete(self):
+        Control.delete(self)
         if self.field is not None:
             self.field.delete()
             self.field = None
@@ -259,7 +324,7 @@ class Dropdown(Control):
                 self.label.delete()
                 self.label = None
             self._delete_pulldown_menu()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
             if self.on_select is not None:
                 if self.id is not None:
@@ -303,14 +368,13 @@ class Dropdown(Control):
 
         font = self.label.document.get_font()
         height = font.ascent - font.descent
-        self.label.x = x
-        self.label.y = y - font.descent
+        self.label.set_position(x, y - font.descent)
 
     def set_options(self, options, selected=None):
         self.delete()
         self.options = options
         self.selected = selected or self.options[0]
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def size(self, dialog):
         if dialog is None:
@@ -340,4 +404,9 @@ class Dropdown(Control):
     def teardown(self):
         self.on_select = False
         self._delete_pulldown_menu()
-        Control.teardown(self)
\ No newline at end of file
+        Control.teardown(self)
+
+    def translate(self, dx, dy):
+        Control.layout(self, self.x + dx, self.y + dy)
+        self.field.translate(dx, dy)
+        self.label.set_position(self.label.x + dx, self.label.y + dy)
\ No newline at end of file
@@ -36,6 +36,27 @@ class KyttenLabel(pyglet.text.Label):
         self.top_group, self.background_group, self.foreground_group, \
             self.foreground_decoration_group = GetKyttenLayoutGroups(group)
 
+    def set_position(self, x, y):
+        """
+        Moves the label.  Unlike setting x and y, which lays out the text
+        all over again, the existing vertices are translated.
+        """
+        dx, dy = x - self._x, y - self._y
+        if not dx and not dy:
+            return
+        if dx != int(dx) or dy != int(dy):
+            # vertices are integral, let pyglet round the new position
+            self.begin_update()
+            self.x, self.y = x, y
+            self.end_update()
+            return
+        dx, dy = int(dx), int(dy)
+        for vlist in self._vertex_lists:
+            vertices = vlist.vertices
+            vertices[0::2] = [vx + dx for vx in vertices[0::2]]
+            vertices[1::2] = [vy + dy for vy in vertices[1::2]]
+        self._x, self._y = x, y
+
     def teardown(self):
         pyglet.text.Label.teardown(self)
         group = self.top_group.parent
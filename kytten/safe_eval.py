@@ -2,68 +2,148 @@
 # Copyrighted (C) Michael Spencer
 #
 # Source: http://code.activestate.com/recipes/364469/
+#
+# Evaluates the literals of a Python expression (numbers, strings, dicts,
+# tuples and lists) without executing any code.  The expressions are
+# parsed with the _ast module, as the compiler module is deprecated, and
+# the parsed expressions are kept in a small LRU cache, so that parsing the
+# same source again only walks the tree.
+
+import _ast
 
-import compiler
+# Number of parsed expressions to keep
+CACHE_SIZE = 32
 
 class Unsafe_Source_Error(Exception):
-    def __init__(self,error,descr = None,node = None):
-	self.error = error
-	self.descr = descr
-	self.node = node
-	self.lineno = getattr(node,"lineno",None)
+    def __init__(self, error, descr=None, node=None):
+        self.error = error
+        self.descr = descr
+        self.node = node
+        self.lineno = getattr(node, "lineno", None)
 
     def __repr__(self):
-	return "Line %d.  %s: %s" % (self.lineno, self.error, self.descr)
+        return "Line %s.  %s: %s" % (self.lineno, self.error, self.descr)
     __str__ = __repr__
 
 class SafeEval(object):
 
-    def visit(self, node,**kw):
-	cls = node.__class__
-	meth = getattr(self,'visit'+cls.__name__,self.default)
-	return meth(node, **kw)
+    def visit(self, node, **kw):
+        cls = node.__class__
+        meth = getattr(self, 'visit' + cls.__name__, self.default)
+        return meth(node, **kw)
 
     def default(self, node, **kw):
-	for child in node.getChildNodes():
-	    return self.visit(child, **kw)
+        for field in node._fields:
+            child = getattr(node, field, None)
+            if isinstance(child, _ast.AST):
+                return self.visit(child, **kw)
 
-    visitExpression = default
+    def visitExpression(self, node, **kw):
+        return self.visit(node.body, **kw)
 
-    def visitConst(self, node, **kw):
-	return node.value
+    def visitNum(self, node, **kw):
+        return node.n
 
-    def visitDict(self, node,**kw):
-	return dict([(self.visit(k),self.visit(v)) for k,v in node.items])
+    def visitStr(self, node, **kw):
+        return node.s
+
+    def visitDict(self, node, **kw):
+        return dict([(self.visit(k), self.visit(v))
+                     for k, v in zip(node.keys, node.values)])
 
     def visitTuple(self, node, **kw):
-	return tuple(self.visit(i) for i in node.nodes)
+        return tuple([self.visit(i) for i in node.elts])
 
     def visitList(self, node, **kw):
-	return [self.visit(i) for i in node.nodes]
+        return [self.visit(i) for i in node.elts]
 
-    def visitUnarySub(self, node, **kw):
-	return -self.visit(node.expr)
+    def visitUnaryOp(self, node, **kw):
+        if isinstance(node.op, _ast.USub):
+            return -self.visit(node.operand)
+        return self.default(node, **kw)
 
 class SafeEvalWithErrors(SafeEval):
 
     def default(self, node, **kw):
-	raise Unsafe_Source_Error("Unsupported source construct",
-				node.__class__,node)
+        raise Unsafe_Source_Error("Unsupported source construct",
+                                  node.__class__, node)
 
-    def visitName(self,node, **kw):
-	raise Unsafe_Source_Error("Strings must be quoted",
-				 node.name, node)
+    def visitName(self, node, **kw):
+        raise Unsafe_Source_Error("Strings must be quoted",
+                                  node.id, node)
 
     # Add more specific errors if desired
 
+class ParseCache(object):
+    """
+    Keeps the most recently used parsed expressions by their source.
+    """
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.trees = {}
+        self.order = []
+
+    def parse(self, source):
+        """
+        Returns the parsed expression of the source, parsing it only if it
+        is not in the cache.
+
+        @param source The source of a Python expression
+        """
+        tree = self.trees.get(source)
+        if tree is not None:
+            if self.order[-1] is not source:
+                self.order.remove(source)
+                self.order.append(source)
+            return tree
+        tree = compile(source, "<safe_eval>", "eval", _ast.PyCF_ONLY_AST)
+        if len(self.order) >= self.size:
+            del self.trees[self.order.pop(0)]
+        self.trees[source] = tree
+        self.order.append(source)
+        return tree
+
+    def clear(self):
+        self.trees = {}
+        self.order = []
+
+parse_cache = ParseCache()
 
 def safe_eval(source, fail_on_error = True):
     walker = fail_on_error and SafeEvalWithErrors() or SafeEval()
     try:
-	ast = compiler.parse(source,"eval")
+        ast = parse_cache.parse(source)
     except SyntaxError, err:
-	raise Unsafe_Source_Error(err, source)
-    try:
-	return walker.visit(ast)
-    except Unsafe_Source_Error, err:
-	raise
\ No newline at end of file
+        error = Unsafe_Source_Error(err, source)
+        error.lineno = err.lineno
+        raise error
+    return walker.visit(ast)
+
+if __name__ == "__main__":
+    # Benchmark: python safe_eval.py [theme.json]
+    import os
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(os.path.dirname(__file__), os.pardir,
+                            'graphics', 'theme', 'theme.json')
+    source = ''.join(open(path).read().split('\r'))
+    loads = 200
+
+    start = time.time()
+    for _ in xrange(loads):
+        parse_cache.clear()
+        safe_eval(source)
+    parsed = time.time() - start
+
+    start = time.time()
+    for _ in xrange(loads):
+        safe_eval(source)
+    cached = time.time() - start
+
+    print "%s, %d loads" % (path, loads)
+    print "parsed: %.2f ms per load" % (parsed / loads * 1000)
+    print "cached: %.2f ms per load" % (cached / loads * 1000)
@@ -90,7 +90,6 @@ class Scrollable(Wrapper):
         self.bg_group = None
         self.fg_group = None
         self.highlight_group = None
-        self.needs_layout = False
 
     def _get_controls(self):
         """
@@ -222,26 +221,18 @@ class Scrollable(Wrapper):
         if self.vscrollbar:
             top += self.vscrollbar.get(self.content_height,
                                        self.content.height)
-        self.content.layout(left, top)
+        self.content.place(left, top)
 
-        self.needs_layout = False
-
-    def on_update(self, dt):
+    def set_needs_layout(self):
         """
-        On updates, we redo the layout if scrollbars have changed position
-
-        @param dt Time passed since last update event (in seconds)
+        One of our children changed.  We are invalidated, so the Dialog lays
+        us out again and collects our controls anew.
         """
-        if self.needs_layout:
-            width, height = self.width, self.height
-            self.size(self.saved_dialog)
-            self.expand(width, height)
-            self.layout(self.x, self.y)
+        self.invalidate()
 
-    def set_needs_layout(self):
-        self.needs_layout = True
+    def set_needs_update_controls(self):
         if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+            self.saved_dialog.set_needs_update_controls()
 
     def set_wheel_hint(self, control):
         if self.saved_dialog is not None:
@@ -309,13 +300,33 @@ class Scrollable(Wrapper):
         self.content_height = self.height
 
         if self.hscrollbar is not None:
+            self.hscrollbar.parent = self
             self.hscrollbar.size(dialog)
             self.hscrollbar.set(self.max_width, max(self.content.width,
                                                     self.max_width))
             self.height += self.hscrollbar.height
 
         if self.vscrollbar is not None:
+            self.vscrollbar.parent = self
             self.vscrollbar.size(dialog)
             self.vscrollbar.set(self.max_height, max(self.content.height,
                                                      self.max_height))
             self.width += self.vscrollbar.width
+
+    def translate(self, dx, dy):
+        """
+        Moves the Scrollable along with its scissor region and content.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        if self.hscrollbar is not None:
+            self.hscrollbar.translate(dx, dy)
+        if self.vscrollbar is not None:
+            self.vscrollbar.translate(dx, dy)
+        self.root_group.x += dx
+        self.root_group.y += dy
+        self.content_x += dx
+        self.content_y += dy
+        self.content.place(self.content.x + dx, self.content.y + dy)
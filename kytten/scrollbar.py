@@ -93,6 +93,7 @@ class HScrollbar(Control):
         """
         Delete all graphic elements used by the scrollbar
         """
+        Control.delete(self)
         if self.left is not None:
             self.left.delete()
             self.left = None
@@ -137,7 +138,7 @@ class HScrollbar(Control):
             self.pos = (right - pos_width) / max_width  # Shift to the right
         self.pos = min(max(self.pos, 0.0), 1.0 - self.bar_width)
         self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def get(self, width, max_width):
         """
@@ -185,7 +186,7 @@ class HScrollbar(Control):
         if self.is_dragging:
             self.drag_bar(dx, dy)
             self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
             return pyglet.event.EVENT_HANDLED
 
     def on_mouse_press(self, x, y, button, modifiers):
@@ -204,7 +205,7 @@ class HScrollbar(Control):
             self.set_bar_pos(x, y)
             self.is_dragging = True
             self.delete()
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
         else:
             left_x, left_y, left_width, left_height = self._get_left_region()
             if x >= left_x and x < left_x + left_width and \
@@ -243,7 +244,7 @@ class HScrollbar(Control):
         """
         self.drag_bar(scroll_y * 10, 0)
         self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def on_update(self, dt):
         """
@@ -253,7 +254,7 @@ class HScrollbar(Control):
         """
         if self.is_scrolling:
             self.drag_bar(self.scroll_delta * 50.0 * dt, 0)
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
     def set(self, width, max_width):
         """
@@ -323,6 +324,18 @@ class HScrollbar(Control):
                 dialog.theme[path]['gui_color'],
                 dialog.batch, dialog.fg_group)
 
+    def translate(self, dx, dy):
+        """
+        Moves the scrollbar components by translating them
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        for element in [self.left, self.right, self.space, self.bar]:
+            if element is not None:
+                element.translate(dx, dy)
+
 class VScrollbar(HScrollbar):
     """
     A vertical scrollbar.  Position is measured from 0.0 to 1.0, and bar size
@@ -419,7 +432,7 @@ class VScrollbar(HScrollbar):
             self.pos = 1.0 - float(bottom) / max_height - self.bar_width
         self.pos = min(max(self.pos, 0.0), 1.0 - self.bar_width)
         self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
         """
@@ -432,7 +445,7 @@ class VScrollbar(HScrollbar):
         """
         self.drag_bar(0, scroll_y * 10)
         self.delete()
-        self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def on_update(self, dt):
         """
@@ -443,7 +456,7 @@ class VScrollbar(HScrollbar):
         """
         if self.is_scrolling:
             self.drag_bar(0, -self.scroll_delta * 50.0 * dt)
-            self.saved_dialog.set_needs_layout()
+            self.invalidate()
 
     def set(self, height, max_height):
         """Sets the new height of the scrollbar, and the height of
@@ -52,6 +52,7 @@ class Slider(Control):
         """
         Delete all graphic elements used by the slider
         """
+        Control.delete(self)
         if self.bar is not None:
             self.bar.delete()
             self.bar = None
@@ -183,4 +184,19 @@ class Slider(Control):
 
     def teardown(self):
         self.on_set = None
-        Control.teardown(self)
\ No newline at end of file
+        Control.teardown(self)
+
+    def translate(self, dx, dy):
+        """
+        Moves the slider components by translating them
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        if self.bar is not None:
+            self.bar.translate(dx, dy)
+            if self.knob is not None:
+                self.knob.translate(dx, dy)
+            for marker in self.markers:
+                marker.translate(dx, dy)
\ No newline at end of file
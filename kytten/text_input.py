@@ -227,4 +227,17 @@ class Input(Control):
 
     def teardown(self):
         self.on_input = False
-        Control.teardown(self)
\ No newline at end of file
+        Control.teardown(self)
+
+    def translate(self, dx, dy):
+        self.x, self.y = self.x + dx, self.y + dy
+        self.field.translate(dx, dy)
+        if self.highlight is not None:
+            self.highlight.translate(dx, dy)
+        if self.is_focus():
+            self.text_layout.begin_update()
+            self.text_layout.x += dx
+            self.text_layout.y += dy
+            self.text_layout.end_update()
+        else:
+            self.label.set_position(self.label.x + dx, self.label.y + dy)
\ No newline at end of file
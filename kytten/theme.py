@@ -5,6 +5,7 @@ import os
 
 import pyglet
 from pyglet import gl
+from pyglet.image.atlas import TextureBin, AllocatorException
 
 try:
     import json
@@ -23,6 +24,9 @@ except ImportError:
             # strip carriage returns
             return safe_eval.safe_eval(''.join(str(expr).split('\r')))
 
+# Size of the textures into which the images of a theme are packed
+THEME_ATLAS_SIZE = 512
+
 DEFAULT_THEME_SETTINGS = {
     "font": "Lucida Grande",
     "font_size": 12,
@@ -38,6 +42,10 @@ class ThemeTextureGroup(pyglet.graphics.TextureGroup):
     ThemeTextureGroup, in addition to setting the texture, also ensures that
     we map to the nearest texel instead of trying to interpolate from nearby
     texels.  This prevents 'blooming' along the edges.
+
+    As the images of a Theme share a texture atlas, all graphic elements
+    within the same parent group have equal ThemeTextureGroups, and the
+    Batch draws them together.
     """
     def set_state(self):
         pyglet.graphics.TextureGroup.set_state(self)
@@ -46,6 +54,20 @@ class ThemeTextureGroup(pyglet.graphics.TextureGroup):
         gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER,
                            gl.GL_NEAREST)
 
+def TranslateVertices(vertex_list, dx, dy, get_vertices):
+    """
+    Adds an offset to the 2D vertices of a vertex list.  As the vertices
+    are integral, they are computed again by get_vertices() for an offset
+    which is not.
+    """
+    if dx != int(dx) or dy != int(dy):
+        vertex_list.vertices = get_vertices()
+        return
+    dx, dy = int(dx), int(dy)
+    vertices = vertex_list.vertices
+    vertices[0::2] = [x + dx for x in vertices[0::2]]
+    vertices[1::2] = [y + dy for y in vertices[1::2]]
+
 class UndefinedGraphicElementTemplate:
     def __init__(self, theme):
         self.theme = theme
@@ -146,6 +168,14 @@ class TextureGraphicElement:
         if self.vertex_list is not None:
             self.vertex_list.vertices = self._get_vertices()
 
+    def translate(self, dx, dy):
+        """
+        Moves the element without computing its vertices again.
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        if self.vertex_list is not None:
+            TranslateVertices(self.vertex_list, dx, dy, self._get_vertices)
+
 class FrameTextureGraphicElement:
     def __init__(self, theme, texture, inner_texture, margins, padding,
                  color, batch, group):
@@ -217,6 +247,14 @@ class FrameTextureGraphicElement:
         if self.vertex_list is not None:
             self.vertex_list.vertices = self._get_vertices()
 
+    def translate(self, dx, dy):
+        """
+        Moves the element without computing its vertices again.
+        """
+        self.x, self.y = self.x + dx, self.y + dy
+        if self.vertex_list is not None:
+            TranslateVertices(self.vertex_list, dx, dy, self._get_vertices)
+
 class UndefinedGraphicElement(TextureGraphicElement):
     def __init__(self, theme, color, batch, group):
         self.x = self.y = self.width = self.height = 0
@@ -245,40 +283,96 @@ class ScopedDict(dict):
 
     This would return the highlight color assigned to the highlight a button
     should have when it is clicked.
+
+    Lookups are served from caches: each ScopedDict keeps a flat dictionary
+    of all keys visible in it, including those inherited from its parents,
+    and the results of paths looked up from it by tuple.  Changing any
+    ScopedDict of the tree invalidates the caches of the whole tree.
     """
     def __init__(self, arg={}, parent=None):
         self.parent = parent
+        if parent is None:
+            self.root = self
+            self.version = 0  # incremented whenever the tree changes
+        else:
+            self.root = parent.root
+        self.flat = None
+        self.flat_version = -1
+        self.paths = {}
         for k, v in arg.iteritems():
             if isinstance(v, dict):
                 self[k] = ScopedDict(v, self)
             else:
                 self[k] = v
 
+    def _get_flat(self):
+        """
+        Returns the dictionary of all keys visible in this scope.  It is
+        recomputed, and the cached paths are dropped, after the tree changed.
+        """
+        if self.flat_version != self.root.version:
+            if self.parent is None:
+                flat = {}
+            else:
+                flat = dict(self.parent._get_flat())
+            flat.update(dict.iteritems(self))
+            self.flat = flat
+            self.paths = {}
+            self.flat_version = self.root.version
+        return self.flat
+
+    def _invalidate(self):
+        self.root.version += 1
+
     def __getitem__(self, key):
         if key is None:
             return self
         elif isinstance(key, list) or isinstance(key, tuple):
-            if len(key) > 1:
-                return self.__getitem__(key[0]).__getitem__(key[1:])
-            elif len(key) == 1:
-                return self.__getitem__(key[0])
-            else:
-                return self  # theme[][key] should return theme[key]
-        else:
+            self._get_flat()
+            path = tuple(key)
             try:
-                return dict.__getitem__(self, key)
+                return self.paths[path]
             except KeyError:
-                if self.parent is not None:
-                    return self.parent.__getitem__(key)
-                else:
-                    raise
+                value = self
+                for k in path:
+                    value = value[k]
+                self.paths[path] = value
+                return value
+        else:
+            return self._get_flat()[key]
 
     def __setitem__(self, key, value):
+        self._invalidate()
         if isinstance(value, dict):
             dict.__setitem__(self, key, ScopedDict(value, self))
         else:
             dict.__setitem__(self, key, value)
 
+    def __delitem__(self, key):
+        self._invalidate()
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self._invalidate()
+        dict.clear(self)
+
+    def pop(self, *args):
+        self._invalidate()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._invalidate()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if not self.has_key(key):
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).iteritems():
+            self[k] = v
+
     def get(self, key, default=None):
         if isinstance(key, list) or isinstance(key, tuple):
             if len(key) > 1:
@@ -288,19 +382,11 @@ class ScopedDict(dict):
             else:
                 raise KeyError(key)  # empty list
 
-        if self.has_key(key):
-            return dict.get(self, key)
-        elif self.parent:
-            return self.parent.get(key, default)
-        else:
-            return default
+        return self._get_flat().get(key, default)
 
     def get_path(self, path, default=None):
         assert isinstance(path, list) or isinstance(path, tuple)
-        if len(path) == 1:
-            return self.get(path[0], default)
-        else:
-            return self.__getitem__(path[0]).get_path(path[1:], default)
+        return self.__getitem__(path[:-1]).get(path[-1], default)
 
     def set_path(self, path, value):
         assert isinstance(path, list) or isinstance(path, tuple)
@@ -336,6 +422,9 @@ class Theme(ScopedDict):
     Theme is a dictionary-based class that converts any elements beginning
     with 'image' into a GraphicElementTemplate.  This allows us to specify
     both simple textures and 9-patch textures, and more complex elements.
+
+    The images are packed into one texture atlas when they are loaded, so
+    a Dialog binds a single texture to draw all its graphic elements.
     """
     def __init__(self, arg, override={}, default=DEFAULT_THEME_SETTINGS,
                  allow_empty_theme=False, name='theme.json'):
@@ -358,6 +447,7 @@ class Theme(ScopedDict):
 
         if isinstance(arg, Theme):
             self.textures = arg.textures
+            self.atlas = arg.atlas
             for k, v in arg.iteritems():
                 self.__setitem__(k, v)
             self.update(override)
@@ -379,6 +469,7 @@ class Theme(ScopedDict):
                 input = {}
 
         self.textures = {}
+        self.atlas = TextureBin(THEME_ATLAS_SIZE, THEME_ATLAS_SIZE)
         self._update_with_images(self, input)
         self.update(override)
 
@@ -394,12 +485,21 @@ class Theme(ScopedDict):
     def _get_texture(self, filename):
         """
         Returns the texture associated with a filename.  Loads it from
-        resources if we haven't previously fetched it.
+        resources into our atlas if we haven't previously fetched it.
+        Images too large for the atlas get a texture of their own.
 
         @param filename The filename of the texture
         """
         if not self.textures.has_key(filename):
-            texture = self.loader.texture(filename)
+            image_file = self.loader.file(filename)
+            try:
+                image = pyglet.image.load(filename, file=image_file)
+            finally:
+                image_file.close()
+            try:
+                texture = self.atlas.add(image)
+            except AllocatorException:
+                texture = image.get_texture()
             texture.src = filename
             self.textures[filename] = texture
         return self.textures[filename]
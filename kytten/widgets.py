@@ -28,6 +28,11 @@ class Widget:
     layout() method to place them on the screen.  When their size is gotten
     for the first time, they initialize any requisite graphic elements
     that could not be done at creation time.
+
+    Containers size and place their children through measure() and
+    place(), which skip children that have neither been invalidated nor
+    moved since the last layout.  A Widget whose content changes calls
+    invalidate() to mark itself and its ancestors dirty.
     """
     def __init__(self, width=0, height=0):
         """
@@ -40,6 +45,10 @@ class Widget:
         self.width = width
         self.height = height
         self.saved_dialog = None
+        self.parent = None
+        self.is_dirty = True
+        self.last_size = None
+        self.last_layout = None
 
     def _get_controls(self):
         """
@@ -51,9 +60,9 @@ class Widget:
     def delete(self):
         """
         Deletes any graphic elements we have constructed.  Note that
-        we may be asked to recreate them later.
+        we may be asked to recreate them later, so we are marked dirty.
         """
-        pass
+        self.set_dirty()
 
     def ensure_visible(self):
         if self.saved_dialog is not None:
@@ -79,6 +88,15 @@ class Widget:
         return x >= self.x and x < self.x + self.width and \
                y >= self.y and y < self.y + self.height
 
+    def invalidate(self):
+        """
+        Marks us and our ancestors dirty and asks the Dialog to redo its
+        layout on the next update.
+        """
+        self.set_dirty()
+        if self.saved_dialog is not None:
+            self.saved_dialog.set_needs_layout()
+
     def is_expandable(self):
         """
         Returns true if the widget can expand to fill available space.
@@ -107,6 +125,51 @@ class Widget:
         """
         self.x, self.y = x, y
 
+    def measure(self, dialog, parent=None):
+        """
+        Sizes us as a child of the given parent.  Unless we are dirty, the
+        size of the last time is reused without sizing our children.
+
+        @param dialog The Dialog which contains this Widget
+        @param parent The Widget which contains this Widget
+        """
+        self.parent = parent
+        if self.is_dirty or self.last_size is None:
+            self.size(dialog)
+            self.last_size = (self.width, self.height)
+        else:
+            self.width, self.height = self.last_size
+
+    def place(self, x, y):
+        """
+        Lays us out, unless we are clean and were last laid out at the same
+        location with the same size.  If we are clean and only our location
+        changed, we are translated instead.
+
+        @param x X coordinate of our lower left corner
+        @param y Y coordinate of our lower left corner
+        """
+        placement = (x, y, self.width, self.height)
+        if placement == self.last_layout and not self.is_dirty:
+            return
+        if self.is_dirty or self.last_layout is None or \
+           placement[2:] != self.last_layout[2:]:
+            self.layout(x, y)
+        else:
+            self.translate(x - self.x, y - self.y)
+        self.last_layout = placement
+        self.is_dirty = False
+
+    def set_dirty(self):
+        """
+        Marks us and our ancestors to be sized and laid out again on the
+        next layout of the Dialog.
+        """
+        widget = self
+        while widget is not None:
+            widget.is_dirty = True
+            widget = widget.parent
+
     def size(self, dialog):
         """
         Constructs any graphic elements needed, and recalculates our size
@@ -124,6 +187,17 @@ class Widget:
         self.delete()
         self.saved_dialog = None
 
+    def translate(self, dx, dy):
+        """
+        Moves us without changing our size.  Widgets with graphic elements
+        translate their vertices; by default we are laid out again at the
+        new location, which places our children there as well.
+
+        @param dx Delta X
+        @param dy Delta Y
+        """
+        self.layout(self.x + dx, self.y + dy)
+
 class Control(Widget, pyglet.event.EventDispatcher):
     """
     Controls are widgets which can accept events.
@@ -162,14 +236,12 @@ class Control(Widget, pyglet.event.EventDispatcher):
     def disable(self):
         self.disabled_flag = True
         self.delete()
-        if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def enable(self):
         self.disabled_flag = False
         self.delete()
-        if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def get_cursor(self, x, y):
         return self.cursor
@@ -257,6 +329,7 @@ class Graphic(Widget):
         self.min_width = self.min_height = 0
 
     def delete(self):
+        Widget.delete(self)
         if self.graphic is not None:
             self.graphic.delete()
             self.graphic = None
@@ -287,6 +360,10 @@ class Graphic(Widget):
             self.min_height = self.graphic.height
         self.width, self.height = self.min_width, self.min_height
 
+    def translate(self, dx, dy):
+        Widget.layout(self, self.x + dx, self.y + dy)
+        self.graphic.translate(dx, dy)
+
 class Label(Widget):
     """A wrapper around a simple text label."""
     def __init__(self, text="", bold=False, italic=False,
@@ -302,6 +379,7 @@ class Label(Widget):
         self.label = None
 
     def delete(self):
+        Widget.delete(self)
         if self.label is not None:
             self.label.delete()
             self.label = None
@@ -309,14 +387,12 @@ class Label(Widget):
     def layout(self, x, y):
         Widget.layout(self, x, y)
         font = self.label.document.get_font()
-        self.label.x = x
-        self.label.y = y - font.descent
+        self.label.set_position(x, y - font.descent)
 
     def set_text(self, text):
         self.text = text
         self.delete()
-        if self.saved_dialog is not None:
-            self.saved_dialog.set_needs_layout()
+        self.invalidate()
 
     def size(self, dialog):
         if dialog is None:
@@ -1,316 +1,76 @@
+import sys
+import pyglet
+
+if __name__ == "__main__" and sys.argv[1:2] == ['--replay']:
+    # the replay is headless, so the engine importing pyglet.gl must not
+    # create the hidden shadow window and its GL context
+    pyglet.options['shadow_window'] = False
+
 from engine.application import Application
 from engine.service import (
     ServiceManager, GameObjectService,
     PhysicsService, GraphicsService,
     InputService, ResourceService,
     MessageService,
-    AbstractService
+    DebugDrawService, AbstractService
 )
 from engine.gui import (
-    GuiService, AbstractGui
+    GuiService, AbstractGui, XmlGui
 )
-from engine.object import (
-    GameObject, GraphicalObject,
-    PhysicalObject, CombinedObject
+from engine.object import GraphicalObject
+from engine.event import subscribe
+from engine.timer import TimerService
+from engine.replication import NEVER, ReplicationClientService
+from engine.recording import InputRecorder, ReplayApplication
+from engine.particles import ParticleService, ParticleSystem
+from engine.world import WorldService
+from game import (
+    WORLD_SIZE, SpaceShip, Asteroid, REPLICATED_TYPES, asteroid_count,
+    create_asteroids
 )
 import engine.graphics
-import pyglet
 import kytten
-import pymunk
 from pymunk import Vec2d
 import random
 import math
 import os.path
-import sys
 import cPickle as pickle
 
 DEBUG_DRAW = True
 
 
-class SpaceShip(CombinedObject):
-    image_path = "SpaceShip2.png"
-    points = [(32, 0),
-              (-32, 32),
-              (-32, -32)]
-    mass = 1
-    maximum_speed = 350
-    group = 1
-    scale = 0.75
-
-    def __init__(self, *args, **kwargs):
-        """
-        Create a new spaceship object.
-        """
-        super(SpaceShip, self).__init__(*args, **kwargs)
-
-        self.is_turning_left = False
-        self.is_turning_right = False
-        self.is_accellerating = False
-        self.is_shooting = False
-        self.is_special = False
-
-        self.next_shot = 0.
-        self.next_special = 0.
-
-        self.accelleration = 50
-        self.turning_speed = 6
-        self.body.angular_velocity = 0
-
-    def update(self, dt):
-        if self.is_turning_left and not self.is_turning_right:
-            self.body.angular_velocity = self.turning_speed
-        elif self.is_turning_right and not self.is_turning_left:
-            self.body.angular_velocity = -self.turning_speed
-
-        if self.is_accellerating:
-            self.body.apply_force(self.body.rotation_vector *
-                                  self.accelleration)
-        else:
-            self.body.reset_forces()
-
-        if self.next_shot > 0.:
-            self.next_shot -= dt
-        if self.next_special > 0.:
-            self.next_special -= dt
-
-        if self.is_shooting and self.next_shot <= 0.:
-            # reset time to next shot
-            self.next_shot = 0.5
-
-            # spawn a new Shot object
-            position = self.body.position + self.body.rotation_vector * 40
-            velocity = self.body.rotation_vector * Shot.initial_speed \
-                       + self.body.velocity
-            self.object_service.add_object(Shot(position=position,
-                                                velocity=velocity,
-                                                angle=self.body.angle))
-
-        if self.is_special and self.next_special <= 0.:
-            start = self.body.position
-            end = self.body.position + self.body.rotation_vector * 10000
-
-            ps = ServiceManager.instance[PhysicsService]
-            info = ps.segment_query(start, end, True, group=1)
-
-            if (info is not None
-                and isinstance(info.shape.body.object, Asteroid)):
-                self.next_special = 0.5
-                position = self.body.position + self.body.rotation_vector * 40
-                velocity = self.body.rotation_vector * 100 + self.body.velocity
-                missile = Missile(target=info.shape.body.object,
-                                  position=position,
-                                  velocity=velocity,
-                                  angle=self.body.angle)
-                self.object_service.add_object(missile)
-
-    def turn_left(self, value=True):
-        self.is_turning_left = value
-        if not value and not self.is_turning_right:
-            self.body.angular_velocity = 0
-
-    def turn_right(self, value=True):
-        self.is_turning_right = value
-        if not value and not self.is_turning_left:
-            self.body.angular_velocity = 0
-
-    def on_collision(self, other, arbiter):
-        if isinstance(other, Asteroid):
-            #spawn an explosion
-            self.object_service.add_object(Explosion(position=arbiter.contacts[0].position))
-            self.object_service.add_object(Explosion(position=self.body.position,
-                                                     scale=2))
-
-            # spawn some more explosions after time
-            ms = ServiceManager.instance[MessageService]
-            for _ in range(3):
-                ms.send_message(self.object_service,
-                                'add_object',
-                                random.random(),
-                                Explosion(position=self.body.position + Vec2d((random.random() - 0.5) * 100,
-                                                                              (random.random() - 0.5) * 100),
-                                          scale=random.random() + 1))
-
-            self.object_service.remove_object(self)
-            return True
-        else:
-            return False
-
-
-class Asteroid(CombinedObject):
-    image_path = "Asteroid1.png"
-    radius = 32
-    mass = 1
-
-    def on_collision(self, other, arbiter):
-        if isinstance(other, Shot) or isinstance(other, SpaceShip):
-            if self.scale > 0.75:
-                direction = other.body.velocity
-                direction.rotate(math.pi / 2)
-
-                velocity = direction.normalized() * 300 + self.body.velocity
-                position = self.body.position
-                self.object_service.add_object(Asteroid(position=position,
-                                                        velocity=velocity,
-                                                        scale=self.scale / 2))
-                self.object_service.add_object(Asteroid(position=position,
-                                                        velocity= -velocity,
-                                                        scale=self.scale / 2))
-
-            # chance to spawn a coin
-            if random.random() <= Pickup.spawn_chance:
-                self.object_service.add_object(Pickup(position=self.body.position,
-                                                      velocity=self.body.velocity))
-
-            self.object_service.remove_object(self)
-        # return true anyways
-        return True
-
-
-class Shot(CombinedObject):
-    image_path = "shot.png"
-    points = [(8, 0),
-              (-8, 4),
-              (-8, -4)]
-    mass = 1
-    initial_speed = 700
-    maximum_speed = SpaceShip.maximum_speed + initial_speed
-    lifetime = 0.75
-    scale = 0.3
-
-    def __init__(self, *args, **kwargs):
-        super(Shot, self).__init__(*args, **kwargs)
-        self.lifetime = kwargs.get('lifetime', self.lifetime)
-
-    def update(self, dt):
-        self.lifetime -= dt
-        if self.lifetime <= 0.:
-            self.object_service.remove_object(self)
-
-    def on_collision(self, other, arbiter):
-        if isinstance(other, Asteroid):
-            #spawn an explosion
-            explosion = Explosion(position=arbiter.contacts[0].position)
-            self.object_service.add_object(explosion)
-            self.object_service.remove_object(self)
-            return True
-        else:
-            return False
-
-
-class Missile(Shot):
-    image_path = "missile.png"
-    maximum_speed = SpaceShip.maximum_speed
-    scale = 1
-
-    def __init__(self, target, *args, **kwargs):
-        super(Missile, self).__init__(*args, **kwargs)
-        self.target = target
-        self.lifetime = 10.
-        self.last_cloud = 0.
-
-    def update(self, dt):
-        #TODO: FIXME
-        Shot.update(self, dt)
-
-        mis_pos = self.body.position
-        #mis_vel = self.body.velocity
-        tar_pos = self.target.body.position
-        tar_vel = self.target.body.velocity
-
-        self.target_point = tar_pos - mis_pos + tar_vel# - mis_vel
-
-        desired_vector = (self.target_point) / self.maximum_speed
-        missile_dir = self.body.rotation_vector
-
-        angle_diff = desired_vector.get_angle_between(missile_dir)
-        self.body.angular_velocity = -angle_diff * 10
-
-
-        #TODO remove this
-        #desired_vector = tar_pos - mis_pos
-
-
-        term = math.radians(45) - min(abs(angle_diff), math.radians(45))
-        self.body.apply_force(missile_dir * 1000 * term)
-        #self.body.velocity = desired_vector.normalized() * self.maximum_speed
-
-        # check if a cloud needs to be created
-        if self.last_cloud > 0.:
-            self.last_cloud -= dt
-        else:
-            # spawn a new cloud object to show the moved path
-            self.last_cloud = 0.05
-            cloud = Cloud(position=self.sprite.position)
-            self.object_service.add_object(cloud)
-
-        self.desired_vector = desired_vector
-
-    def debug_draw(self):
-        #return
-        #print self.body.position, self.target_point
-        engine.graphics.draw_line(self.body.position,
-                                  #self.target.body.position,
-                                  self.body.position + self.target_point,
-                                  #self.body.position + self.desired_vector * 1000,
-                                  (1.0, 0, 0, 1.0))
-
-        engine.graphics.draw_line(self.body.position,
-                                  self.target.body.position,
-                                  (0, 1.0, 0, 1.0))
-
-
-class Cloud(GraphicalObject):
-    animation_path = "simple_explosion_2.png"
-    animation_tiling = (1, 8)
-    animation_duration = 0.8
-    group_index = 0
-
-    def on_animation_end(self):
-        self.object_service.remove_object(self)
-
-
-class Explosion(GraphicalObject):
-    animation_tiling = (4, 4)
-    animation_duration = 0.5
-    group_index = 2
-
-    def __init__(self, *args, **kwargs):
-        if 'animation_path' not in kwargs:
-            kwargs['animation_path'] = "explosion%d.png" % random.randint(0, 6)
-        super(Explosion, self).__init__(*args, **kwargs)
-
-    def on_animation_end(self):
-        self.object_service.remove_object(self)
-
-
-class Pickup(CombinedObject):
-    image_path = "coin.png"
-    radius = 16
-    mass = 0.000001
-    group = 2
-
-    spawn_chance = 0.5
-
-    def on_collision(self, other, arbiter):
-        if isinstance(other, SpaceShip):
-            ServiceManager.instance[YaaGameService].points += 500
-            self.object_service.remove_object(self)
-            return False
-        return True
-
-
 class Marker(GraphicalObject):
     image_path = "spaceship.png"
     display_group = 11
+    screen_space = True
     angle = -math.pi / 2
     scale = 0.5
+    replication_policy = NEVER
 
 
 class YaaGameService(AbstractService):
-    def __init__(self, window, window_size):
+    def __init__(self, window, window_size, networked=False,
+                 world_size=None):
+        """
+        Create the game rules. Without a window (headless replay) there
+        are neither labels nor menus. The world has the size of the
+        window, unless a 'world_size' is given.
+        """
+        self.window = window
         self.window_size = window_size
-        window.set_handler('on_escape', self.on_escape)
+        self.world_size = world_size or window_size
+        self.networked = networked
         self.asteroid_count = 0
+        self.points = 0
+        self.game_started = False
+        self.lifes = []
+        self.labels = []
+        self.quicksave = None
+
+        if window is None:
+            return
+
+        window.set_handler('on_escape', self.on_escape)
         self.font = pyglet.font.load('', 36, bold=True)
         self.point_label = pyglet.font.Text(self.font,
                                             '',
@@ -319,36 +79,79 @@ class YaaGameService(AbstractService):
                                             y=window_size[1] - 10)
         self.point_label.halign = 'right'
         self.point_label.valign = 'top'
-        self.points = 0
-        self.game_started = False
-        self.lifes = []
-
-        self.labels = []
         self.labels.append(self.point_label)
 
     def on_init(self, mgr):
         mgr[InputService].register_input_handler(pyglet.window.key.ESCAPE, self, 'on_escape')
+        mgr[InputService].register_input_handler(pyglet.window.key.F5, self, 'on_quicksave')
+        mgr[InputService].register_input_handler(pyglet.window.key.F9, self, 'on_quickload')
 
     def on_escape(self, value):
-        if value:
-            self.mgr[GuiService].show_gui("main")
-
-    def on_object_added(self, obj):
-        if isinstance(obj, SpaceShip):
+        # there are no menus when connected to a server
+        if value and not self.networked:
+            self.show_gui("main")
+
+    def on_quicksave(self, value):
+        if value and not self.networked:
+            self.quicksave = self.mgr.snapshot()
+
+    def on_quickload(self, value):
+        if value and self.quicksave is not None:
+            self.mgr.restore(self.quicksave)
+
+    def get_state(self):
+        # the asteroid count follows from the restored objects
+        return self.points, self.game_started, self.lifes
+
+    def set_state(self, state):
+        self.points, self.game_started, self.lifes = state
+
+    def show_gui(self, name):
+        if self.window is not None:
+            self.mgr[GuiService].show_gui(name)
+
+    def hide_gui(self, name):
+        if self.window is not None:
+            self.mgr[GuiService].hide_gui(name)
+
+    def rebuild_gui(self, name):
+        if self.window is not None:
+            self.mgr[GuiService].rebuild_gui(name)
+
+    def bind_input(self, ship):
+        # set up SpaceShip input event handlers
+        self.mgr[InputService].register_input_handler(pyglet.window.key.A, ship, 'turn_left')
+        self.mgr[InputService].register_input_handler(pyglet.window.key.D, ship, 'turn_right')
+        self.mgr[InputService].register_input_handler(pyglet.window.key.W, ship, 'is_accellerating')
+        self.mgr[InputService].register_input_handler(pyglet.window.key.SPACE, ship, 'is_shooting')
+        self.mgr[InputService].register_input_handler(pyglet.window.key.LCTRL, ship, 'is_special')
+
+    def on_controlled(self, ship):
+        # the server assigned a ship to this client
+        self.bind_input(ship)
+        self.mgr[WorldService].follow(ship)
+
+    def on_add_points(self, points):
+        self.points += points
+
+    @subscribe('object_added', types=(SpaceShip,))
+    def on_ships_added(self, ships):
+        if self.networked:
+            return
+        for ship in ships:
             self.is_ship_dead = False
-
-            # set up SpaceShip input event handlers
-            self.mgr[InputService].register_input_handler(pyglet.window.key.A, obj, 'turn_left')
-            self.mgr[InputService].register_input_handler(pyglet.window.key.D, obj, 'turn_right')
-            self.mgr[InputService].register_input_handler(pyglet.window.key.W, obj, 'is_accellerating')
-            self.mgr[InputService].register_input_handler(pyglet.window.key.SPACE, obj, 'is_shooting')
-            self.mgr[InputService].register_input_handler(pyglet.window.key.LCTRL, obj, 'is_special')
-
-        elif isinstance(obj, Asteroid):
-            self.asteroid_count += 1
-
-    def on_object_removed(self, obj):
-        if isinstance(obj, SpaceShip):
+            self.bind_input(ship)
+            self.mgr[WorldService].follow(ship)
+
+    @subscribe('object_added', types=(Asteroid,))
+    def on_asteroids_added(self, asteroids):
+        self.asteroid_count += len(asteroids)
+
+    @subscribe('object_removed', types=(SpaceShip,))
+    def on_ships_removed(self, ships):
+        if self.networked or self.mgr.restoring:
+            return
+        for ship in ships:
             # recreate the ship again, if lifes are left
             marker = self.lifes.pop()
             self.mgr[GameObjectService].remove_object(marker)
@@ -365,18 +168,22 @@ class YaaGameService(AbstractService):
                                          halign='center',
                                          valign='baseline')
                 self.labels.append(label)"""
-                self.mgr[GuiService].show_gui("submithighscore")
-
-        elif isinstance(obj, Asteroid):
-            self.asteroid_count -= 1
-            if self.asteroid_count == 0 and self.game_started:
-                # spawn new asteroids after some time
-                self.mgr[MessageService].send_message(self,
-                                                      'on_spawn_asteroids',
-                                                      delay=3.)
-            if self.game_started:
-                # calculate points
-                self.points += (2. - obj.scale) * 100
+                # build the screen again for the points of this game
+                self.rebuild_gui("submithighscore")
+                self.show_gui("submithighscore")
+
+    @subscribe('object_removed', types=(Asteroid,))
+    def on_asteroids_removed(self, asteroids):
+        self.asteroid_count -= len(asteroids)
+        if self.asteroid_count == 0 and self.game_started:
+            # spawn new asteroids after some time
+            self.mgr[MessageService].send_message(self,
+                                                  'on_spawn_asteroids',
+                                                  delay=3.)
+        if self.game_started:
+            # calculate points
+            for asteroid in asteroids:
+                self.points += (2. - asteroid.scale) * 100
 
     def is_space_empty(self, position, size, layers= -1, group=0):
         size /= 2.
@@ -390,23 +197,23 @@ class YaaGameService(AbstractService):
 
     def find_empty_space(self, size, tries=100):
         for _ in range(tries):
-            position = (random.random() * self.window_size[0],
-                        random.random() * self.window_size[1])
+            position = (random.random() * self.world_size[0],
+                        random.random() * self.world_size[1])
             if self.is_space_empty(position, size):
                 return position
         raise Exception("Could not find empty space")
 
     def on_recreate_spaceship(self):
         self.game_started = True
-        if self.is_space_empty(Vec2d(self.window_size) / 2, 80):
-            ship = SpaceShip(position=(self.window_size[0] / 2, self.window_size[1] / 2))
+        if self.is_space_empty(Vec2d(self.world_size) / 2, 80):
+            ship = SpaceShip(position=(self.world_size[0] / 2, self.world_size[1] / 2))
             self.mgr[GameObjectService].add_object(ship)
         else:
             self.mgr[MessageService].send_message(self, 'on_recreate_spaceship',
                                                   delay=0.1)
 
     def on_spawn_asteroids(self):
-        for _ in range(5):
+        for _ in range(asteroid_count(self.world_size)):
             velocity = (random.random() - 0.5) * 100, (random.random() - 0.5) * 100
             scale = random.random() + 0.5
             size = Asteroid.radius * scale
@@ -416,7 +223,7 @@ class YaaGameService(AbstractService):
 
     def on_start(self):
         self.mgr[GameObjectService].clear()
-        self.mgr[GuiService].hide_gui("main")
+        self.hide_gui("main")
 
         self.mgr[MessageService].send_message(self, 'on_recreate_spaceship', 0.5)
         self.on_spawn_asteroids()
@@ -440,6 +247,7 @@ class YaaGameService(AbstractService):
         highscores.sort()
         highscores.reverse()
         pickle.dump(highscores, open('highscores.dat', 'w+'))
+        self.rebuild_gui("showhighscores")
 
     def get_highscores(self):
         try:
@@ -448,32 +256,27 @@ class YaaGameService(AbstractService):
             return []
 
 
-class MainMenu(AbstractGui):
+class MainMenu(XmlGui):
     def __init__(self, name="main"):
-        AbstractGui.__init__(self, name)
+        XmlGui.__init__(self, name, os.path.join('guis', 'main_menu.xml'),
+                        callbacks={
+                            "start": self.on_start,
+                            "highscores": self.on_highscores,
+                            "options": self.on_options,
+                            "quit": self.on_quit,
+                        })
 
-    def _build_gui(self, window, batch, group):
-        def exit_game():
-            sys.exit(0)
+    def on_start(self):
+        ServiceManager.instance[YaaGameService].on_start()
 
-        def show_highscores():
-            ServiceManager.instance[GuiService].show_gui("showhighscores")
+    def on_highscores(self):
+        ServiceManager.instance[GuiService].show_gui("showhighscores")
 
-        def show_options():
-            ServiceManager.instance[GuiService].show_gui("options")
+    def on_options(self):
+        ServiceManager.instance[GuiService].show_gui("options")
 
-        return kytten.Dialog(
-            kytten.TitleFrame("Main Menu",
-                kytten.VerticalLayout([
-                    kytten.Button("Start", on_click=ServiceManager.instance[YaaGameService].on_start),
-                    kytten.Button("Highscores", on_click=show_highscores),
-                    kytten.Button("Options", on_click=show_options),
-                    kytten.Button("Quit", on_click=exit_game),
-                ], align=kytten.HALIGN_LEFT),
-            ),
-            window=window, theme=self.theme, batch=batch, group=group,
-            anchor=kytten.ANCHOR_CENTER,
-        )
+    def on_quit(self):
+        sys.exit(0)
 
 
 class OptionsGui(AbstractGui):
@@ -526,10 +329,12 @@ class ShowHighscoresGui(AbstractGui):
         return kytten.Dialog(
             kytten.TitleFrame("Highscores",
                 kytten.VerticalLayout([
-                    kytten.GridLayout([
-                        [kytten.Label(name), kytten.Label("%i" % int(score))] \
-                        for score, name in highscores
-                    ]),
+                    kytten.Scrollable(
+                        kytten.VirtualList(highscores,
+                                           create_row=self._create_row,
+                                           update_row=self._update_row,
+                                           width=200),
+                        height=300),
                     kytten.Button("Close", on_click=self.hide)
                 ], align=kytten.HALIGN_LEFT),
             ),
@@ -537,13 +342,23 @@ class ShowHighscoresGui(AbstractGui):
             anchor=kytten.ANCHOR_CENTER,
         )
 
+    def _create_row(self):
+        return kytten.HorizontalLayout([kytten.Label(), kytten.Spacer(),
+                                        kytten.Label()])
+
+    def _update_row(self, row, highscore):
+        score, name = highscore
+        name_label, spacer, score_label = row.content
+        name_label.set_text(name)
+        score_label.set_text("%i" % int(score))
+
 
 class SubmitHighscoreGui(AbstractGui):
     def __init__(self, name="submithighscore"):
         AbstractGui.__init__(self, name)
 
     def _build_gui(self, window, batch, group):
-        #points = ServiceManager.instance[YaaGameService].points
+        points = ServiceManager.instance[YaaGameService].points
         dialog = None
 
         def on_enter(dialog):
@@ -564,6 +379,7 @@ class SubmitHighscoreGui(AbstractGui):
             kytten.TitleFrame("Submit Highscore",
                 kytten.VerticalLayout([
                     kytten.GridLayout([
+                        [kytten.Label("Points"), kytten.Label("%i" % points)],
                         [kytten.Label("Name"), kytten.Input("name", "",
                                                             max_length=20)]
                     ]),
@@ -580,49 +396,132 @@ class SubmitHighscoreGui(AbstractGui):
         return dialog
 
 
+def create_particle_systems(mgr):
+    """
+    Add the particle systems of the clouds, flames and explosions.
+    """
+    particles = mgr[ParticleService]
+    particles.add_system('smoke', ParticleSystem("simple_explosion_2.png",
+                                                 (1, 8), lifetime=0.8))
+    particles.add_system('flames', ParticleSystem("flames.png", lifetime=0.3,
+                                                  fade=True))
+    for index in range(7):
+        particles.add_system("explosion%d" % index,
+                             ParticleSystem("explosion%d.png" % index, (4, 4),
+                                            lifetime=0.5, group_index=2))
+
+
 class YaaGame(Application):
     window_size = 700, 700
+    world_size = WORLD_SIZE
+
+    def __init__(self, connection=None, record=None):
+        """
+        Create the game, either standalone or as a client of the
+        dedicated server at the 'connection' address (see server.py).
+        With a 'record' path, the session is recorded to it and the game
+        starts right away, as the menus are not part of the recording.
+        """
+        self.connection = connection
+        self.record = record
+        Application.__init__(self)
 
     def setup(self):
         # set up game services
         mgr = self.mgr
-        bounds = (-10, -10, self.window_size[0] + 10, self.window_size[1] + 10)
-        mgr += PhysicsService(bounds=bounds)
-        mgr += GraphicsService()
+        if self.record is not None:
+            # first of all, as it seeds the random number generator
+            mgr += InputRecorder(self.record)
+        # the objects of a server are created and removed by its snapshots
+        # and spawn events only, so the game rules must not run locally.
+        # The WorldService wraps the objects around.
+        mgr += PhysicsService(collisions=self.connection is None)
+        mgr += GraphicsService(view_size=self.window_size)
         mgr += GameObjectService()
         mgr += InputService(window=self.window)
         mgr += ResourceService()
-        mgr += YaaGameService(self.window, self.window_size)
+        mgr += YaaGameService(self.window, self.window_size,
+                              networked=self.connection is not None,
+                              world_size=self.world_size)
         mgr += MessageService()
+        mgr += TimerService()
         mgr += GuiService(window=self.window, group_index=5)
+        mgr += DebugDrawService()
+        mgr += ParticleService()
+        mgr += WorldService(self.world_size)
 
         # setup resource locations
         mgr[ResourceService].add_resource_location("graphics", "sounds")
+        create_particle_systems(mgr)
 
         mgr[InputService].register_input_handler(pyglet.window.key.R,
                                                  self.mgr[PhysicsService],
                                                  'switch_debug_draw')
 
-        # create some Asteroids and add them to the object manager
-        for _ in range(5):
-            position = (random.random() * self.window_size[0],
-                        random.random() * self.window_size[1])
-            velocity = ((random.random() - 0.5) * 100,
-                        (random.random() - 0.5) * 100)
-            scale = random.random() + 0.5
-            asteroid = Asteroid(position=position,
-                                velocity=velocity,
-                                scale=scale)
+        if self.connection is not None:
+            # the server owns the game, just show its objects
+            mgr += ReplicationClientService(REPLICATED_TYPES,
+                                            self.connection)
+            return
 
-            self.mgr[GameObjectService].add_object(asteroid)
+        create_asteroids(mgr, self.world_size)
 
         mgr[GuiService].add_gui(OptionsGui())
         mgr[GuiService].add_gui(ShowHighscoresGui())
         mgr[GuiService].add_gui(SubmitHighscoreGui())
         mgr[GuiService].add_gui(MainMenu())
-        mgr[GuiService].show_gui("main")
+        if self.record is not None:
+            mgr[YaaGameService].on_start()
+        else:
+            mgr[GuiService].show_gui("main")
+
+    def teardown(self):
+        if self.record is not None:
+            self.mgr[InputRecorder].close()
+
+
+class YaaGameReplay(ReplayApplication):
+    """
+    Headless replay of a session recorded with '--record', e.g. to
+    benchmark the exact same session across builds.
+    """
+    window_size = YaaGame.window_size
+    world_size = YaaGame.world_size
+
+    def setup(self):
+        # the same game services as YaaGame, without graphics and menus
+        mgr = self.mgr
+        mgr += PhysicsService(sync_sprites=False)
+        mgr += GameObjectService()
+        mgr += InputService()
+        mgr += YaaGameService(None, self.window_size,
+                              world_size=self.world_size)
+        mgr += MessageService()
+        mgr += TimerService()
+        mgr += WorldService(self.world_size)
+
+        mgr[InputService].register_input_handler(pyglet.window.key.R,
+                                                 self.mgr[PhysicsService],
+                                                 'switch_debug_draw')
+
+        create_asteroids(mgr, self.world_size)
+        mgr[YaaGameService].on_start()
 
 
 if __name__ == "__main__":
-    app = YaaGame()
+    connection = None
+    record = None
+    if len(sys.argv) > 2 and sys.argv[1] == '--connect':
+        host, _, port = sys.argv[2].partition(':')
+        connection = (host, int(port or 12345))
+    elif len(sys.argv) > 2 and sys.argv[1] == '--record':
+        record = sys.argv[2]
+    elif len(sys.argv) > 2 and sys.argv[1] == '--replay':
+        replay = YaaGameReplay(sys.argv[2])
+        replay.run()
+        print "Replayed %d ticks in %.3f seconds (%.3f ms per tick)" % (
+            replay.ticks, replay.duration,
+            replay.duration * 1000. / max(replay.ticks, 1))
+        sys.exit(0)
+    app = YaaGame(connection, record)
     app.run()
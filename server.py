@@ -0,0 +1,249 @@
+"""
+Headless dedicated server for YaaGame. Clients connect with
+'python main.py --connect host:port' and get a spaceship each.
+
+Usage: python server.py [port]
+       python server.py --benchmark [latency]
+       python server.py --snapshot-benchmark [count]
+"""
+import pyglet
+
+# the server has no window, so the engine importing pyglet.gl must not
+# create the hidden shadow window and its GL context
+pyglet.options['shadow_window'] = False
+
+from engine.application import HeadlessApplication
+from engine.service import (
+    ServiceManager, GameObjectService, PhysicsService,
+    MessageService,
+    AbstractService
+)
+from engine.event import subscribe
+from engine.timer import TimerService
+from engine.replication import (
+    ReplicationServerService, ReplicationClientService
+)
+from engine.world import WorldService
+from game import (
+    WORLD_SIZE, SpaceShip, Shot, Asteroid, REPLICATED_TYPES,
+    create_asteroids
+)
+import random
+import time
+import timeit
+import sys
+
+
+class ServerGameService(AbstractService):
+    """
+    The game rules of the dedicated server: keeps the field populated
+    with asteroids and gives every connected client a spaceship, which
+    is recreated after it was destroyed.
+    """
+
+    def __init__(self, world_size):
+        self.world_size = world_size
+        self.asteroid_count = 0
+        self.ships = {}
+
+    def on_init(self, mgr):
+        self.on_spawn_asteroids()
+
+    def on_client_connected(self, address):
+        self.on_recreate_spaceship(address)
+
+    def on_client_disconnected(self, address):
+        ship = self.ships.pop(address, None)
+        if ship is not None:
+            self.mgr[GameObjectService].remove_object(ship)
+
+    def on_recreate_spaceship(self, address):
+        replication = self.mgr[ReplicationServerService]
+        if address not in replication.clients:
+            return # disconnected in the meantime
+        position = (random.random() * self.world_size[0],
+                    random.random() * self.world_size[1])
+        ship = SpaceShip(position=position)
+        self.ships[address] = ship
+        self.mgr[GameObjectService].add_object(ship)
+        self.mgr[WorldService].follow(ship)
+        replication.set_controlled(address, ship)
+
+    def on_spawn_asteroids(self):
+        create_asteroids(self.mgr, self.world_size)
+
+    @subscribe('object_added', types=(Asteroid,))
+    def on_asteroids_added(self, asteroids):
+        self.asteroid_count += len(asteroids)
+
+    @subscribe('object_removed', types=(Asteroid,))
+    def on_asteroids_removed(self, asteroids):
+        self.asteroid_count -= len(asteroids)
+        if self.asteroid_count == 0:
+            self.mgr[MessageService].send_message(self, 'on_spawn_asteroids',
+                                                  delay=3.)
+
+    @subscribe('object_removed', types=(SpaceShip,))
+    def on_ships_removed(self, ships):
+        for address, ship in self.ships.items():
+            if ship in ships:
+                del self.ships[address]
+                self.mgr[MessageService].send_message(self,
+                                                      'on_recreate_spaceship',
+                                                      2., address)
+
+
+class YaaGameServer(HeadlessApplication):
+    world_size = WORLD_SIZE
+
+    def __init__(self, port=12345):
+        HeadlessApplication.__init__(self)
+        self.port = port
+
+    def setup(self):
+        mgr = self.mgr
+        mgr += PhysicsService(sync_sprites=False)
+        mgr += GameObjectService()
+        mgr += MessageService()
+        mgr += TimerService()
+        mgr += WorldService(self.world_size)
+        mgr += ReplicationServerService(REPLICATED_TYPES, ('', self.port))
+        mgr += ServerGameService(self.world_size)
+
+    def teardown(self):
+        self.mgr[ReplicationServerService].close()
+
+
+def prediction_benchmark(latency=0.1, duration=10.):
+    """
+    Run the server and a client over 127.0.0.1, with 'latency' seconds
+    added to the datagrams in each direction, while the client steers
+    and fires with its predicted ship. Prints the prediction error of the
+    client, i.e. the distance between the predicted and the corrected
+    position of the ship, and checks that the client spawns no shots.
+    """
+    server = YaaGameServer(0)
+    server.setup()
+    server.mgr.send_broadcast('on_init', server.mgr)
+    replication = server.mgr[ReplicationServerService]
+    replication.transport.latency = latency
+
+    mgr = ServiceManager()
+    mgr += PhysicsService(collisions=False, sync_sprites=False)
+    mgr += GameObjectService()
+    mgr += MessageService()
+    mgr += TimerService()
+    mgr += WorldService(WORLD_SIZE)
+    mgr += ReplicationClientService(REPLICATED_TYPES,
+                                    ('127.0.0.1', replication.address[1]))
+    mgr.send_broadcast('on_init', mgr)
+    client = mgr[ReplicationClientService]
+    client.transport.latency = latency
+
+    # the prediction error of each reconciliation
+    errors = []
+    reconcile = client.reconcile
+    def record(message):
+        reconcile(message)
+        if client.controlled is not None:
+            errors.append(client.prediction_error)
+    client.reconcile = record
+
+    interval = 1. / server.tick_rate
+    start = time.time()
+    local_shots = 0
+    try:
+        while time.time() - start < duration:
+            elapsed = time.time() - start
+            ship = client.controlled
+            if ship is not None:
+                ship.turn_left(elapsed % 2. < 0.5)
+                ship.is_accellerating = elapsed % 3. < 2.
+                ship.is_shooting = True
+            # each manager is the current one while it is ticked
+            ServiceManager.instance = server.mgr
+            server.mgr.send_broadcast('on_tick', interval)
+            ServiceManager.instance = mgr
+            mgr.send_broadcast('on_tick', interval)
+            local_shots = max(local_shots, len([
+                obj for obj in mgr[GameObjectService].objects
+                if isinstance(obj, Shot) and not hasattr(obj, 'id')]))
+            delay = start + elapsed + interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        server.teardown()
+        client.close()
+
+    if not errors:
+        print "No input was acknowledged within %.1f seconds" % duration
+        return
+    errors.sort()
+    print "Latency %.0f ms each way, %d reconciliations" % (latency * 1000.,
+                                                           len(errors))
+    print "Prediction error: mean %.2f, median %.2f, max %.2f" % (
+        sum(errors) / len(errors), errors[len(errors) / 2], errors[-1])
+    print "Shots spawned by the client: %d" % local_shots
+
+
+def snapshot_benchmark(count=5000, repeat=10):
+    """
+    Measure the snapshot and restore of the ServiceManager with 'count'
+    asteroids, restoring into the same objects, e.g. to rewind, and into
+    a new game, which creates all objects.
+    """
+    def create_manager():
+        mgr = ServiceManager()
+        mgr += PhysicsService(collisions=False, sync_sprites=False)
+        mgr += GameObjectService()
+        mgr += MessageService()
+        mgr += TimerService()
+        mgr.send_broadcast('on_init', mgr)
+        return mgr
+
+    mgr = create_manager()
+    for _ in xrange(count):
+        position = (random.random() * WORLD_SIZE[0],
+                    random.random() * WORLD_SIZE[1])
+        velocity = ((random.random() - 0.5) * 100,
+                    (random.random() - 0.5) * 100)
+        mgr[GameObjectService].add_object(
+            Asteroid(position=position, velocity=velocity,
+                     scale=random.choice((0.25, 0.5, 1.))))
+    mgr.send_broadcast('on_tick', 0.)
+    data = mgr.snapshot()
+
+    def time(function, setup=lambda: None):
+        return min(timeit.repeat(function, setup, number=1,
+                                 repeat=repeat)) * 1000.
+
+    games = []
+    results = [
+        ('snapshot', time(mgr.snapshot)),
+        ('restore', time(lambda: mgr.restore(data))),
+        ('restore (new game)',
+         time(lambda: games[-1].restore(data),
+              lambda: games.append(create_manager()))),
+    ]
+
+    print "%d asteroids, %d bytes, best of %d runs" % (count, len(data),
+                                                        repeat)
+    for name, duration in results:
+        print "%-20s %8.2f ms" % (name, duration)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+        prediction_benchmark(latency)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == '--snapshot-benchmark':
+        snapshot_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+        sys.exit(0)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 12345
+    server = YaaGameServer(port)
+    print "Serving on port %d" % port
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass